@@ -1,11 +1,17 @@
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
 import os
 import pickle
+import queue
 import shutil
 import subprocess
+import tempfile
+import threading
 import pandas as pd
 from pathlib import Path
-from typing import Any, List, Union, Callable
+from typing import Any, Dict, List, Union, Callable
 
 from consts import *
 from cache import *
@@ -177,64 +183,164 @@ def load_pickle(path: Path):
     return obj
 
 def parse_dwarf_proginfo(binpath: Path) -> ProgramInfo:
-    return parse_dwarf.parse_from_objfile(str(binpath))
+    proginfo = parse_dwarf.parse_from_objfile(str(binpath))
+    proginfo.compute_fingerprint()
+    return proginfo
 
-# returns either the path to the outputted pickle file or None on error
-def parse_ghidra_to_pickle(binpath: Path) -> Union[Path, None]:
+# Run analyzeHeadless on the given binaries in a fresh project created inside project_dir,
+# then run the parse_ghidra_exec.py post-script (with script_args) on each of the imported programs.
+# Every job gets its own project directory & name, so concurrent runs never share state.
+def run_ghidra_headless(binpaths: List[Path], project_dir: Path, script_args: List[str]) -> int:
     GHIDRA_ANALYZE_HEADLESS_PATH = GHIDRA_BUILD_DIR.joinpath("support/analyzeHeadless")
     GHIDRA_SCRIPTS_PATH = SRC_DIR
-    PICKLE_OUT_PATH = SRC_DIR.joinpath("ghidra.pickle")
-
-    cmd = """
-    {}
-        {}
-        tempproject
-        -import {}
-        -scriptpath {}
-        -postscript parse_ghidra_exec.py pickle {}
-        -deleteproject
-    """.format(
-        GHIDRA_ANALYZE_HEADLESS_PATH,
-        SRC_DIR,
-        binpath,
-        GHIDRA_SCRIPTS_PATH,
-        PICKLE_OUT_PATH
-    )
 
-    ret = subprocess.call(
-        cmd.split(),
+    cmd = [
+        str(GHIDRA_ANALYZE_HEADLESS_PATH),
+        str(project_dir),
+        "project_{}".format(project_dir.name),
+        "-import", *[ str(binpath) for binpath in binpaths ],
+        "-scriptpath", str(GHIDRA_SCRIPTS_PATH),
+        "-postscript", "parse_ghidra_exec.py", *script_args,
+        "-deleteproject"
+    ]
+
+    return subprocess.call(
+        cmd,
         # stdout=subprocess.DEVNULL,
         # stderr=subprocess.STDOUT
     )
 
+# scratch_dir: a directory private to this job, which holds the Ghidra project and the pickle
+# returns either the path to the outputted pickle file or None on error
+def parse_ghidra_to_pickle(binpath: Path, scratch_dir: Path) -> Union[Path, None]:
+    PICKLE_OUT_PATH = scratch_dir.joinpath("ghidra.pickle")
+    project_dir = Path(tempfile.mkdtemp(prefix="project_", dir=scratch_dir))
+
+    ret = run_ghidra_headless([binpath], project_dir, ["pickle", str(PICKLE_OUT_PATH)])
+
     return None if ret != 0 or not PICKLE_OUT_PATH.exists() else PICKLE_OUT_PATH
-    
+
+# Analyze all the given binaries with a single analyzeHeadless (JVM) launch.
+# The binaries are imported into one temporary project and the parse_ghidra_exec.py
+# post-script runs on each of them, writing <scratch_dir>/<binary name>.pickle.
+# Returns a {binary path: pickle path} mapping of the binaries that were parsed successfully.
+def parse_ghidra_batch_to_pickles(binpaths: List[Path], scratch_dir: Path) -> Dict[Path, Path]:
+    # Ghidra names each imported program after its file name, which in turn names the pickle
+    names = [ binpath.name for binpath in binpaths ]
+    if len(set(names)) != len(names):
+        raise Exception("Binaries analyzed in the same batch must have unique file names")
+
+    project_dir = Path(tempfile.mkdtemp(prefix="project_", dir=scratch_dir))
+    run_ghidra_headless(binpaths, project_dir, ["pickledir", str(scratch_dir)])
+
+    pickle_paths = { binpath: scratch_dir.joinpath("{}.pickle".format(binpath.name)) for binpath in binpaths }
+    return { binpath: path for binpath, path in pickle_paths.items() if path.exists() }
+
+# Parse a batch of binaries with Ghidra, launching analyzeHeadless only once.
+# Binaries that Ghidra failed to parse are missing from the returned mapping.
+def parse_ghidra_proginfo_batch(binpaths: List[Path]) -> Dict[Path, ProgramInfo]:
+    with tempfile.TemporaryDirectory(prefix="ghidra_job_") as scratch_dir:
+        pickle_paths = parse_ghidra_batch_to_pickles(binpaths, Path(scratch_dir))
+        proginfos = { binpath: load_pickle(path) for binpath, path in pickle_paths.items() }
+
+    for proginfo in proginfos.values():
+        proginfo.compute_fingerprint()
+    return proginfos
 
 def parse_ghidra_proginfo(binpath: Path) -> ProgramInfo:
 
-    PICKLE_OUT_PATH = parse_ghidra_to_pickle(binpath)
-    if PICKLE_OUT_PATH is None:
-        raise Exception("Ghidra could not parse binary to pickle object")
-    
-    # Assume successful parse and storage to ghidra.pickle
-    # Load the pickle file (stores ProgramInfo object parsed by Ghidra)
-    proginfo = load_pickle(str(PICKLE_OUT_PATH))
-
-    # Delete the pickle file after loaded
-    os.remove(str(PICKLE_OUT_PATH))
-    
+    # the scratch directory (and the pickle in it) is deleted once the ProgramInfo is loaded
+    with tempfile.TemporaryDirectory(prefix="ghidra_job_") as scratch_dir:
+        PICKLE_OUT_PATH = parse_ghidra_to_pickle(binpath, Path(scratch_dir))
+        if PICKLE_OUT_PATH is None:
+            raise Exception("Ghidra could not parse binary to pickle object")
+
+        # Load the pickle file (stores ProgramInfo object parsed by Ghidra)
+        proginfo = load_pickle(str(PICKLE_OUT_PATH))
+
+    proginfo.compute_fingerprint()
+
     # Return the parsed program info
     return proginfo
 
+# A bounded pool of headless Ghidra workers.
+# Jobs (batches of binaries) are pulled from a queue by the worker threads; each job runs
+# its own analyzeHeadless process in a private scratch directory, so up to 'workers'
+# binaries/batches are decompiled concurrently.
+class GhidraWorkerPool(object):
+    def __init__(
+        self,
+        workers: int = os.cpu_count() or 1,
+        batch_size: int = 1 # the number of binaries analyzed by each analyzeHeadless launch
+    ):
+        self.workers = max(workers, 1)
+        self.batch_size = max(batch_size, 1)
+
+    # the batch of binaries -> parse results, run by a worker thread
+    def _run_job(self, binpaths: List[Path]) -> Dict[Path, ProgramInfo]:
+        if len(binpaths) == 1:
+            return { binpaths[0]: parse_ghidra_proginfo(binpaths[0]) }
+        return parse_ghidra_proginfo_batch(binpaths)
+
+    def _worker(self, jobs: queue.Queue, results: Dict[Path, ProgramInfo], lock: threading.Lock):
+        while True:
+            binpaths = jobs.get()
+            if binpaths is None:
+                return
+            try:
+                res = self._run_job(binpaths)
+            except Exception:
+                logging.exception("Ghidra failed to parse {}".format([ str(binpath) for binpath in binpaths ]))
+                res = {}
+            with lock:
+                results.update(res)
+
+    # Parse all the binaries, returning a {binary path: ProgramInfo} mapping.
+    # Binaries that Ghidra failed to parse are missing from the mapping.
+    def parse(self, binpaths: List[Path]) -> Dict[Path, ProgramInfo]:
+        jobs: queue.Queue = queue.Queue()
+        results: Dict[Path, ProgramInfo] = {}
+        lock = threading.Lock()
+
+        # binaries that share a file name can't be analyzed in the same batch
+        batches: List[List[Path]] = []
+        for binpath in binpaths:
+            batch = next((batch for batch in batches if len(batch) < self.batch_size and binpath.name not in [ b.name for b in batch ]), None)
+            if batch is None:
+                batch = []
+                batches.append(batch)
+            batch.append(binpath)
+
+        for batch in batches:
+            jobs.put(batch)
+        # one sentinel per worker, so every worker exits once the queue is drained
+        for _ in range(self.workers):
+            jobs.put(None)
+
+        threads = [ threading.Thread(target=self._worker, args=(jobs, results, lock), daemon=True) for _ in range(min(self.workers, len(batches))) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
+
+# this module's source is a dependency of the artifacts cached here: it holds the parse entry points,
+# the fingerprinting of parsed programs and the compare2 cache key (import_deps only follows the imports
+# of the cached modules, which don't include this one)
+BUILD_PARSE_DEP = Path(__file__).resolve()
+
 def get_parser(name: str, cache: bool = True) -> Callable:
     _map = {
         "dwarf": {
-            "deps": ["parse_dwarf.py", "parse_dwarf_util.py"],
+            "deps": ["parse_dwarf"],
             "parse": parse_dwarf_proginfo 
         },
 
         "ghidra": {
-            "deps": ["parse_ghidra.py", "parse_ghidra_util.py"],
+            "deps": ["parse_ghidra_exec"],
+            # the decompiler output also depends on the Ghidra installation
+            "extra": { "ghidra": GHIDRA_BUILD_DIR.name },
             "parse": parse_ghidra_proginfo
         }
     }
@@ -246,8 +352,10 @@ def get_parser(name: str, cache: bool = True) -> Callable:
     if not cache:
         return res["parse"]
     else:
-        deps = LANG_DEPS + RESOLVE_DEPS + [ SRC_DIR.joinpath(dep) for dep in res["deps"] ]
-        return redis_path_dependent_cacher(deps)(res["parse"])
+        # cached by the content of the binary & the parser source files (the modules imported by the parser,
+        # and this module, which drives the parsers)
+        deps = sorted(import_deps(*res["deps"]) + [ BUILD_PARSE_DEP ])
+        return ContentAddressedCache("parse_{}".format(name), deps, extra=res.get("extra"))(res["parse"])
 
 def parse_proginfo_pair(prog: Program, opts: BuildOptions, decompiler: str = "ghidra") -> Tuple[ProgramInfo, ProgramInfo]:
 
@@ -265,13 +373,36 @@ def parse_proginfo_pair(prog: Program, opts: BuildOptions, decompiler: str = "gh
 
     return (dwarf_proginfo, decomp_proginfo)
 
+# Parse the binaries of a corpus with the named parser.
+# The cached parses are all fetched with a single lookup, and only the misses are parsed
+# (Ghidra misses concurrently, by a GhidraWorkerPool). Binaries that failed to parse are missing from the result.
+def parse_proginfos(name: str, binpaths: List[Path], workers: int = os.cpu_count() or 1) -> Dict[Path, ProgramInfo]:
+    parser = get_parser(name)
+    hits, misses = parser.prefetch(binpaths)
+    proginfos = dict(hits)
+
+    if name == "ghidra":
+        parsed = GhidraWorkerPool(workers=workers).parse(misses)
+    else:
+        parse = get_parser(name, cache=False)
+        parsed = { binpath: parse(binpath) for binpath in misses }
+
+    for binpath, proginfo in parsed.items():
+        parser.put(binpath, proginfo)
+    proginfos.update(parsed)
+    return proginfos
+
 def compare2_uncached(l: ProgramInfo, r: ProgramInfo) -> UnoptimizedProgramInfoCompare2:
     return UnoptimizedProgramInfoCompare2(
         UnoptimizedProgramInfo(l),
         UnoptimizedProgramInfo(r)
     )
 
-compare2 = redis_path_dependent_cacher(LANG_DEPS + RESOLVE_DEPS + COMPARE_DEPS)(compare2_uncached)
+# keyed by the fingerprints of the 2 programs, rather than by serializing them on every lookup
+def compare2_key(l: ProgramInfo, r: ProgramInfo) -> str:
+    return "{}:{}".format(l.get_fingerprint(), r.get_fingerprint())
+
+compare2 = redis_path_dependent_cacher(sorted(import_deps("compare_unoptimized") + [ BUILD_PARSE_DEP ]), key_func=compare2_key)(compare2_uncached)
 
 def parse_compare_program(
     prog: Program,
@@ -317,12 +448,67 @@ def compute_comparisons_metrics_dataframe(
         columns=col_names
     )
 
+# the metrics computed by the corpus runner's worker processes.
+# Metrics are usually lambdas, which can't be pickled, so they are handed to
+# the (forked) workers through the pool initializer instead of with each job.
+_WORKER_METRICS: List[Metric] = []
+
+def _init_metrics_worker(metrics: List[Metric]):
+    global _WORKER_METRICS
+    _WORKER_METRICS = metrics
+
+# parse, compare, and compute the metrics for a single (program, options) pair.
+# Only the compact metric row is returned, so the (large) comparison objects never
+# have to be sent back to the parent process.
+# Returns None if any stage fails for this program.
+def compute_program_metrics(
+    prog: Program,
+    opts: BuildOptions,
+    decompiler: str = "ghidra",
+    metrics: Union[List[Metric], None] = None
+) -> Union[List[Union[int, float]], None]:
+    metrics = metrics if metrics is not None else _WORKER_METRICS
+    try:
+        cmp = parse_compare_program(prog, opts, decompiler=decompiler)
+        return compute_comparison_metrics(cmp, metrics)
+    except Exception:
+        logging.exception("Failed to compute metrics for {} ({})".format(prog.get_name(), mangle(prog.get_name(), opts)))
+        return None
+
+# workers: the number of worker processes to use. 1 computes every program in this process.
+# A program that fails to parse/compare gets a row of missing values instead of aborting the sweep.
 def compute_programs_metrics_dataframe(
     progs: List[Program],
     opts: BuildOptions,
     metrics: List[Metric],
-    decompiler: str = "ghidra"
-):
+    decompiler: str = "ghidra",
+    workers: int = 1
+) -> pd.DataFrame:
     prog_names = [ prog.get_name() for prog in progs ]
-    cmps = [ parse_compare_program(prog, opts, decompiler=decompiler) for prog in progs ]
-    return compute_comparisons_metrics_dataframe(prog_names, cmps, metrics)
\ No newline at end of file
+    col_names = [ metric.get_display_name() for metric in metrics ]
+
+    if workers <= 1:
+        rows = [ compute_program_metrics(prog, opts, decompiler=decompiler, metrics=metrics) for prog in progs ]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_metrics_worker,
+            initargs=(metrics,)
+        ) as pool:
+            futures = [ pool.submit(compute_program_metrics, prog, opts, decompiler) for prog in progs ]
+            rows = []
+            for prog, future in zip(progs, futures):
+                try:
+                    rows.append(future.result())
+                except Exception:
+                    # the worker itself died (e.g. killed for running out of memory)
+                    logging.exception("Worker failed while computing metrics for {}".format(prog.get_name()))
+                    rows.append(None)
+
+    rows = [ row if row is not None else [None] * len(metrics) for row in rows ]
+    return pd.DataFrame(
+        rows,
+        index=prog_names,
+        columns=col_names
+    )
\ No newline at end of file
@@ -1,8 +1,13 @@
-from typing import List, Any
+from typing import Callable, Dict, List, Any, Tuple, Union
+from functools import lru_cache, wraps
+import ast
+import hashlib
+import logging
+import os
 import time
 from pathlib import Path
-from functools import lru_cache
-from rediscache import SimpleCache, cache_it
+import cachestats
+from rediscache import SimpleCache, LocalCache, WriteBehind, cache_it, CacheMissException, ExpiredKeyException
 
 # SimpleCache(
 #     limit=10000,
@@ -25,37 +30,344 @@ def last_modification_ns(p: Path) -> int:
         res = p.stat().st_mtime_ns
         return res if res else -1
 
-class CacheObjectWrapper(object):
-    def __init__(self, obj: Any):
-        self.obj = obj
+# {(path, mtime_ns, size) -> sha256 hex digest}
+# avoids re-hashing files that haven't been touched since they were last hashed
+_FILE_DIGESTS: Dict[Tuple[str, int, int], str] = {}
+
+# get the SHA-256 hex digest of a file's contents
+def file_digest(p: Path) -> str:
+    stat = p.stat()
+    memo_key = (str(p.resolve()), stat.st_mtime_ns, stat.st_size)
+    digest = _FILE_DIGESTS.get(memo_key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(str(p), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _FILE_DIGESTS[memo_key] = digest
+    return digest
+
+# {(path, mtime_ns, size) -> names of the modules imported by the module at path}
+_MODULE_IMPORTS: Dict[Tuple[str, int, int], List[str]] = {}
+
+# the names of all the modules imported by a Python source file (anywhere in it, i.e. also inside functions)
+def module_imports(p: Path) -> List[str]:
+    stat = p.stat()
+    memo_key = (str(p.resolve()), stat.st_mtime_ns, stat.st_size)
+    names = _MODULE_IMPORTS.get(memo_key)
+    if names is None:
+        try:
+            tree = ast.parse(p.read_text(), filename=str(p))
+        except SyntaxError:
+            logging.warning("Can't parse {}, its imports aren't tracked as cache dependencies".format(p))
+            tree = ast.Module(body=[], type_ignores=[])
+        names = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names += [ alias.name for alias in node.names ]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names.append(node.module)
+        _MODULE_IMPORTS[memo_key] = names
+    return names
+
+# The source files of the given modules and of all the modules they (transitively) import from src_dir.
+# Used as the dependencies of cached functions, instead of hand-maintained lists of files.
+def import_deps(*modules: str, src_dir: Path = Path(__file__).resolve().parent) -> List[Path]:
+    deps: List[Path] = []
+    todo = list(modules)
+    while todo:
+        p = src_dir.joinpath("{}.py".format(todo.pop().split(".")[0]))
+        if p in deps or not p.exists():
+            continue
+        deps.append(p)
+        todo += module_imports(p)
+    return sorted(deps)
+
+# combine named component digests into a single digest
+def combine_digests(digests: Dict[str, str]) -> str:
+    h = hashlib.sha256()
+    for name, digest in sorted(digests.items()):
+        h.update("{}={}\n".format(name, digest).encode())
+    return h.hexdigest()
+
+# The metadata record stored next to a cached payload.
+# It is small, so the staleness of an entry can be decided without fetching the payload.
+class CacheMetadata(object):
+    def __init__(self, deps: List[Path], payload_size: int):
         self.timestamp: int = get_timestamp_ns()
+        # {dependency path -> SHA-256 of its contents at the time the payload was stored}
+        self.dep_digests: Dict[str, str] = { str(dep): file_digest(dep) for dep in deps if dep.exists() }
+        self.payload_size: int = payload_size
 
-    def is_up_to_date(self, deps: List[Path]) -> bool:
-        return self.timestamp > 0 and all([ dep.exists() and (self.timestamp > last_modification_ns(dep) > 0) for dep in deps ])
+    def get_timestamp(self) -> int:
+        return self.timestamp
+
+    def get_dep_digests(self) -> Dict[str, str]:
+        return self.dep_digests
 
-    def get_obj(self):
-        return self.obj
+    def get_payload_size(self) -> int:
+        return self.payload_size
+
+    # compares contents rather than modification times, so a checkout or a touch of an unchanged file
+    # doesn't invalidate the entry
+    def is_up_to_date(self, deps: List[Path]) -> bool:
+        return all([ dep.exists() and self.dep_digests.get(str(dep)) == file_digest(dep) for dep in deps ])
 
 CACHE = SimpleCache(
     expire=0, # keys never expire
     hashkeys=True # uses hashes instead of pickled objects as keys
 )
 
+# in-process tier in front of CACHE: keeps the most recently used results alive,
+# so repeated calls return the same objects without a round-trip or unpickling
+# (bounded by SIMPLECACHE_LOCAL_MAX_ENTRIES and SIMPLECACHE_LOCAL_MAX_BYTES)
+LOCAL_CACHE = LocalCache()
+
+# if SIMPLECACHE_WRITE_BEHIND is set, computed results are stored to CACHE on a background thread
+# (see WriteBehind; pending stores are flushed at exit)
+WRITE_BEHIND = WriteBehind() if os.environ.get("SIMPLECACHE_WRITE_BEHIND") else None
+
 # caches function call to local Redis database
-redis_cacher = cache_it(cache=CACHE)
+redis_cacher = cache_it(cache=CACHE, local_cache=LOCAL_CACHE, write_behind=WRITE_BEHIND)
 
 # caches function call to local Redis database
-# checks dependency paths on load to determine whether to recompute, similar to Makefile
-def redis_path_dependent_cacher(paths: List[Path]):
-    def recache_callback(wrapper: CacheObjectWrapper) -> bool:
-        return not wrapper.is_up_to_date(paths)
+# checks the contents of the dependency paths on load to determine whether to recompute (see import_deps)
+# (using the entry's metadata record, so stale payloads are never fetched)
+# key_func: (*args, **kwargs) -> str ... computes cache keys from the call arguments (see cache_it)
+def redis_path_dependent_cacher(paths: List[Path], key_func: Union[Callable, None] = None):
+    def recache_meta_callback(meta: CacheMetadata) -> bool:
+        return not meta.is_up_to_date(paths)
 
     return cache_it(
         cache=CACHE,
-        recache_callback=recache_callback,
-        store_transform=lambda obj: CacheObjectWrapper(obj),
-        load_transform=lambda wrapper: wrapper.get_obj()
+        make_meta=lambda size: CacheMetadata(paths, size),
+        recache_meta_callback=recache_meta_callback,
+        key_func=key_func,
+        local_cache=LOCAL_CACHE,
+        write_behind=WRITE_BEHIND
     )
 
+# Caches the results of a function of a single file (i.e. a parser of a binary) by content.
+# An entry is keyed by the SHA-256 of the input file and a digest of the dependency (source) files,
+# so identical binaries hit the cache regardless of their path, mtime, or the checkout they come from.
+# Alongside the entries, a manifest of the dependency digests last used for each input is stored,
+# which allows a miss to be attributed to the component that caused it.
+class ContentAddressedCache(object):
+    def __init__(
+        self,
+        name: str, # the name of the cached artifact (i.e. "parse_dwarf")
+        deps: List[Path], # the source files the artifact depends on
+        extra: Union[Dict[str, str], None] = None, # additional named key components (i.e. tool versions)
+        cache: SimpleCache = None,
+        local_cache: Union[LocalCache, None] = LOCAL_CACHE,
+        write_behind: Union[WriteBehind, None] = WRITE_BEHIND
+    ):
+        self.name = name
+        self.deps = deps
+        self.extra = extra if extra is not None else {}
+        self.cache = cache if cache is not None else CACHE
+        self.local_cache = local_cache
+        self.write_behind = write_behind
+        self.stats = cachestats.get_stats(self.cache.prefix, name)
+
+    # {component name -> digest} for all the dependency components
+    def get_deps_digests(self) -> Dict[str, str]:
+        digests = { dep.name: file_digest(dep) for dep in self.deps }
+        digests.update(self.extra)
+        return digests
+
+    def _artifact_key(self, input_digest: str, deps_digest: str) -> str:
+        return "{}:artifact:{}:{}".format(self.name, input_digest, deps_digest)
+
+    def _manifest_key(self, input_digest: str) -> str:
+        return "{}:manifest:{}".format(self.name, input_digest)
+
+    def _try_get(self, key: str) -> Tuple[bool, Any]:
+        try:
+            return (True, self.cache.get_pickle(key))
+        except (CacheMissException, ExpiredKeyException):
+            return (False, None)
+
+    # artifacts are keyed by content, so a local entry never goes stale
+    def _try_get_local(self, key: str) -> Tuple[bool, Any]:
+        if self.local_cache is None:
+            return (False, None)
+        found, res, _ = self.local_cache.get(key)
+        return (found, res)
+
+    # _try_get(), recording the fetch in the stats
+    def _try_fetch(self, key: str) -> Tuple[bool, Any, int]:
+        start = cachestats.timer()
+        try:
+            data = self.cache.get_bytes(key)
+        except (CacheMissException, ExpiredKeyException):
+            return (False, None, 0)
+        fetched = cachestats.timer()
+        res = self.cache.decode_pickle(data)
+        self.stats.observe("transfer_seconds", fetched - start)
+        self.stats.observe("serialize_seconds", cachestats.timer() - fetched)
+        self.stats.observe("payload_bytes", len(data))
+        return (True, res, len(data))
+
+    def _put_local(self, key: str, res: Any, size: Union[int, None] = None):
+        if self.local_cache is not None:
+            self.local_cache.put(key, res, size=size)
+
+    # store an artifact in the background (see WriteBehind), then record its actual size in the local tier
+    def _store_behind(self, key: str, input_digest: str, digests: Dict[str, str], result: Any):
+        size = self._store(key, input_digest, digests, result)
+        if self.local_cache is not None:
+            self.local_cache.resize(key, size)
+
+    # store an artifact and the manifest of its dependency digests, returning the artifact's size
+    def _store(self, key: str, input_digest: str, digests: Dict[str, str], result: Any) -> int:
+        start = cachestats.timer()
+        payload = self.cache.encode_pickle(result)
+        serialized = cachestats.timer()
+        self.cache.store_bytes(key, payload)
+        self.cache.store_pickle(self._manifest_key(input_digest), digests)
+        self.stats.observe("serialize_seconds", serialized - start)
+        self.stats.observe("transfer_seconds", cachestats.timer() - serialized)
+        self.stats.observe("payload_bytes", len(payload))
+        return len(payload)
+
+    def _compute(self, function: Callable, p: Path) -> Any:
+        start = cachestats.timer()
+        result = function(p)
+        self.stats.observe("compute_seconds", cachestats.timer() - start)
+        return result
+
+    # Look up the artifacts of many input files at once, with a single pipelined request.
+    # Nothing is computed: returns the (path, artifact) pairs of the hits, and the paths of the misses.
+    def prefetch(self, paths: List[Path]) -> Tuple[List[Tuple[Path, Any]], List[Path]]:
+        deps_digest = combine_digests(self.get_deps_digests())
+        hits, pending = [], []
+        for p in paths:
+            key = self._artifact_key(file_digest(p), deps_digest)
+            found, res = self._try_get_local(key)
+            if found:
+                self.stats.incr("local_hits")
+                hits.append((p, res))
+            else:
+                pending.append((p, key))
+
+        if self.cache.connection is None:
+            self.stats.incr("misses", len(pending))
+            return (hits, [ p for (p, _) in pending ])
+
+        start = cachestats.timer()
+        payloads = self.cache.mget_bytes([ key for (_, key) in pending ])
+        self.stats.observe("transfer_seconds", cachestats.timer() - start)
+
+        misses = []
+        for (p, key) in pending:
+            data = payloads.get(key)
+            if data is None:
+                self.stats.incr("misses")
+                misses.append(p)
+                continue
+
+            start = cachestats.timer()
+            res = self.cache.decode_pickle(data)
+            self.stats.observe("serialize_seconds", cachestats.timer() - start)
+            self.stats.observe("payload_bytes", len(data))
+            self.stats.incr("hits")
+            self._put_local(key, res, len(data))
+            hits.append((p, res))
+        return (hits, misses)
+
+    # Cache an artifact computed elsewhere (i.e. by a batch job scheduled for the misses of prefetch())
+    def put(self, p: Path, result: Any):
+        digests = self.get_deps_digests()
+        input_digest = file_digest(p)
+        key = self._artifact_key(input_digest, combine_digests(digests))
+        size = None
+        if self.cache.connection is not None:
+            try:
+                size = self._store(key, input_digest, digests, result)
+            except Exception as e:
+                self.stats.incr("errors")
+                logging.exception(e)
+        self._put_local(key, result, size)
+
+    # Explain why the artifact for this input file is (or would be) a cache miss.
+    # Returns None on a hit, otherwise the list of components that caused the miss:
+    # "input" if this input content was never cached, else the names of the dependencies that changed.
+    def explain_miss(self, p: Path) -> Union[List[str], None]:
+        input_digest = file_digest(p)
+        digests = self.get_deps_digests()
+        if self.cache.connection is None:
+            return ["cache"]
+
+        if self._artifact_key(input_digest, combine_digests(digests)) in self.cache:
+            return None
+
+        found, manifest = self._try_get(self._manifest_key(input_digest))
+        if not found:
+            return ["input"]
+
+        names = set(manifest.keys()) | set(digests.keys())
+        return sorted([ name for name in names if manifest.get(name) != digests.get(name) ])
+
+    # Path -> A ==> Path -> A
+    def __call__(self, function: Callable) -> Callable:
+        @wraps(function)
+        def func(p: Path):
+            input_digest = file_digest(p)
+            digests = self.get_deps_digests()
+            key = self._artifact_key(input_digest, combine_digests(digests))
+
+            found, res = self._try_get_local(key)
+            if found:
+                self.stats.incr("local_hits")
+                return res
+
+            if self.cache.connection is None:
+                self.stats.incr("misses")
+                result = self._compute(function, p)
+                self._put_local(key, result)
+                return result
+
+            try:
+                found, res, size = self._try_fetch(key)
+                if found:
+                    self.stats.incr("hits")
+                    self._put_local(key, res, size)
+                    return res
+                self.stats.incr("misses")
+                # explaining a miss costs more digests & lookups, only pay for it when it's logged
+                if logging.getLogger().isEnabledFor(logging.INFO):
+                    logging.info("{} cache miss for {} (caused by: {})".format(self.name, p, self.explain_miss(p)))
+            except:
+                self.stats.incr("errors")
+                logging.exception("Unknown redis-simple-cache error. Please check your Redis free space.")
+
+            result = self._compute(function, p)
+            if self.write_behind is not None:
+                # kept with an estimated size until the writer resizes it (so before submitting it)
+                self._put_local(key, result)
+                self.write_behind.submit(self._store_behind, key, input_digest, digests, result, stats=self.stats)
+                return result
+
+            size = None
+            try:
+                size = self._store(key, input_digest, digests, result)
+            except Exception as e:
+                self.stats.incr("errors")
+                logging.exception(e)
+            self._put_local(key, result, size)
+            return result
+
+        func.explain_miss = self.explain_miss
+        func.stats = self.stats
+        func.prefetch = self.prefetch
+        func.put = self.put
+        return func
+
+# the maximum number of entries kept by each function decorated with `cache`
+INTRA_RUN_CACHE_SIZE = int(os.environ.get("INTRA_RUN_CACHE_SIZE", 4096))
+
 # a cache decorator for intra-run caching (not persisted to Redis)
-cache = lru_cache(maxsize=None)
+# bounded, so long runs over many programs don't keep every result alive
+cache = lru_cache(maxsize=INTRA_RUN_CACHE_SIZE)
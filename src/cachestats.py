@@ -0,0 +1,204 @@
+"""
+Instrumentation of the caching layer (see rediscache.cache_it and
+cache.ContentAddressedCache): per cached function counters of hits, misses
+and recache events, and histograms of serialization time, transfer time,
+compute time and payload sizes.
+
+    >>> import cachestats
+    >>> cachestats.get_stats("SimpleCache", "compare2").to_dict()
+    >>> print(cachestats.summary())
+
+If the SIMPLECACHE_STATS environment variable is set, a summary of all the
+stats is written at exit: to stderr if its value is "1" or "stderr",
+otherwise appended to the file it names.
+"""
+import atexit
+import os
+import sys
+import threading
+import time
+
+# upper bounds of the histogram buckets of durations (in seconds)
+SECONDS_BOUNDS = [0.0001, 0.001, 0.01, 0.1, 1.0, 10.0, 100.0]
+# upper bounds of the histogram buckets of sizes (in bytes)
+BYTES_BOUNDS = [2 ** 10, 2 ** 14, 2 ** 17, 2 ** 20, 2 ** 24, 2 ** 27, 2 ** 30]
+
+
+class Histogram(object):
+    """
+    A fixed-bucket histogram. The last bucket counts the values above the
+    largest bound.
+    """
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        idx = 0
+        while idx < len(self.bounds) and value > self.bounds[idx]:
+            idx += 1
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_dict(self):
+        labels = ["<={0}".format(bound) for bound in self.bounds] + [">{0}".format(self.bounds[-1])]
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.mean(),
+            "min": self.min,
+            "max": self.max,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class CacheStats(object):
+    """
+    The stats of a single cached function within a cache namespace.
+    Thread-safe.
+    """
+    COUNTERS = ["hits", "local_hits", "misses", "recaches", "errors"]
+    SECONDS_HISTOGRAMS = ["serialize_seconds", "transfer_seconds", "compute_seconds"]
+    BYTES_HISTOGRAMS = ["payload_bytes"]
+
+    def __init__(self, namespace, function):
+        self.namespace = namespace
+        self.function = function
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = dict((name, 0) for name in CacheStats.COUNTERS)
+            self.histograms = dict((name, Histogram(SECONDS_BOUNDS)) for name in CacheStats.SECONDS_HISTOGRAMS)
+            self.histograms.update((name, Histogram(BYTES_BOUNDS)) for name in CacheStats.BYTES_HISTOGRAMS)
+
+    def incr(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def observe(self, histogram, value):
+        with self.lock:
+            self.histograms[histogram].add(value)
+
+    def get(self, counter):
+        return self.counters[counter]
+
+    def get_histogram(self, histogram):
+        return self.histograms[histogram]
+
+    def lookups(self):
+        return self.counters["hits"] + self.counters["local_hits"] + self.counters["misses"] + self.counters["recaches"]
+
+    def hit_rate(self):
+        lookups = self.lookups()
+        return (self.counters["hits"] + self.counters["local_hits"]) / lookups if lookups else None
+
+    def saved_seconds(self):
+        """
+        Estimate of the compute time saved by the hits (at the mean compute
+        time of the misses), less the time spent fetching and decoding them.
+        """
+        compute = self.histograms["compute_seconds"].mean()
+        if compute is None:
+            return None
+        hits = self.counters["hits"] + self.counters["local_hits"]
+        overhead = self.histograms["transfer_seconds"].total + self.histograms["serialize_seconds"].total
+        return hits * compute - overhead
+
+    def to_dict(self):
+        with self.lock:
+            d = dict(self.counters)
+            d.update((name, hist.to_dict()) for (name, hist) in self.histograms.items())
+        d["namespace"] = self.namespace
+        d["function"] = self.function
+        d["hit_rate"] = self.hit_rate()
+        d["saved_seconds"] = self.saved_seconds()
+        return d
+
+    def __str__(self):
+        def fmt(value, spec):
+            return "-" if value is None else spec.format(value)
+
+        return "{0}:{1} hits={2} local_hits={3} misses={4} recaches={5} errors={6} hit_rate={7} " \
+               "serialize={8}s transfer={9}s compute={10}s (mean {11}s) payload={12}B saved~{13}s".format(
+            self.namespace,
+            self.function,
+            self.counters["hits"],
+            self.counters["local_hits"],
+            self.counters["misses"],
+            self.counters["recaches"],
+            self.counters["errors"],
+            fmt(self.hit_rate(), "{0:.1%}"),
+            fmt(self.histograms["serialize_seconds"].total, "{0:.3f}"),
+            fmt(self.histograms["transfer_seconds"].total, "{0:.3f}"),
+            fmt(self.histograms["compute_seconds"].total, "{0:.3f}"),
+            fmt(self.histograms["compute_seconds"].mean(), "{0:.3f}"),
+            self.histograms["payload_bytes"].total,
+            fmt(self.saved_seconds(), "{0:.3f}"),
+        )
+
+
+# (namespace, function) -> CacheStats
+_STATS = {}
+_STATS_LOCK = threading.Lock()
+
+
+def get_stats(namespace, function):
+    """
+    :return: CacheStats, the (created on first use) stats of a function within a namespace
+    """
+    key = (namespace, function)
+    stats = _STATS.get(key)
+    if stats is None:
+        with _STATS_LOCK:
+            stats = _STATS.setdefault(key, CacheStats(namespace, function))
+    return stats
+
+
+def all_stats():
+    """
+    :return: list of CacheStats, ordered by namespace and function
+    """
+    return [_STATS[key] for key in sorted(_STATS.keys())]
+
+
+def reset_stats():
+    for stats in all_stats():
+        stats.reset()
+
+
+def summary():
+    """
+    :return: str, one line per cached function that was looked up
+    """
+    lines = [str(stats) for stats in all_stats() if stats.lookups() > 0]
+    return "\n".join(["Cache stats:"] + lines) if lines else "Cache stats: no lookups"
+
+
+def timer():
+    return time.perf_counter()
+
+
+def _dump_summary():
+    dest = os.environ.get("SIMPLECACHE_STATS")
+    if not dest:
+        return
+    if dest in ("1", "stderr"):
+        sys.stderr.write(summary() + "\n")
+    else:
+        with open(dest, "a") as f:
+            f.write(summary() + "\n")
+
+
+atexit.register(_dump_summary)
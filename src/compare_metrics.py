@@ -37,6 +37,13 @@ def varnode_compare_records_metatypes(records: Iterator[VarnodeCompareRecord], m
         if record.get_varnode().get_datatype().get_metatype() in metatypes
     ]
 
+# the number of (primitive) elements of the records' varnodes (matched at one of the levels, if given)
+# a StridedVarnode counts once per element
+def count_varnode_compare_records(records: Iterator[VarnodeCompareRecord], levels: Iterator[int] = None) -> int:
+    if levels is None:
+        return sum([ record.get_count() for record in records ])
+    return sum([ record.get_level_counts().get(level, 0) for record in records for level in levels ])
+
 def varnodes_from_compare_records(records: Iterator[VarnodeCompareRecord]) -> List[Varnode]:
     return [ record.get_varnode() for record in records ]
 
@@ -86,6 +93,16 @@ class MetricsInterface(object):
             records = varnode_compare_records_matched_at_levels(records, compare_levels)
         return records
 
+    # like filter_varnode_compare_records(), but counts the matching varnode elements
+    def count_varnodes(
+        self,
+        primitive: bool = False,
+        metatypes: List[int] = None,
+        compare_levels: List[int] = None
+    ) -> int:
+        records = self.filter_varnode_compare_records(primitive=primitive, metatypes=metatypes)
+        return count_varnode_compare_records(records, levels=compare_levels)
+
 class MetricsSet(object):
     pass
 
@@ -117,18 +134,19 @@ class VarnodesMetricsSet(MetricsSet):
         self.primitive = primitive
         self.metatype = metatype
 
-        self.varnodes_truth = len(interface.filter_varnode_compare_records(
+        self.varnodes_truth = interface.count_varnodes(
             primitive=primitive,
             metatypes=(metatype,) if metatype is not None else None
-        ))
+        )
 
         self.varnode_compare_score = 0
         self.matched_at_level = {}
         for level in VarnodeCompareLevel.range():
-            matched_at = len(interface.filter_varnode_compare_records(
+            matched_at = interface.count_varnodes(
                 primitive=primitive,
-                metatypes=(metatype,) if metatype is not None else None
-            ))
+                metatypes=(metatype,) if metatype is not None else None,
+                compare_levels=(level,)
+            )
             self.varnode_compare_score += level * matched_at
             self.matched_at_level[level] = matched_at
 
@@ -2,15 +2,18 @@ from lang import *
 from lang_address import *
 from lang_datatype import *
 from util import *
+from compare_scope import *
+from bisect import bisect_right
 
 class StaticPCVariable(object):
-    def __init__(self, pc, var):
+    # liverange: the variable's AddressLiveRange at the given PC, if already known
+    def __init__(self, pc, var, liverange=None):
         # self.var: Variable
         self.var = var
 
         # self.liverange: AddressLiveRange
         # holds the variable's address and associated PC range for the given PC
-        self.liverange = self.var.get_liverange_at_pc(pc)
+        self.liverange = liverange if liverange is not None else self.var.get_liverange_at_pc(pc)
 
         # self.size: int
         self.size = None
@@ -55,6 +58,10 @@ class StaticPCVariable(object):
     def get_addr_range(self):
         return self.addr_range
 
+    # the Varnode of the variable's live range at this PC
+    def get_varnode(self):
+        return Varnode(self.get_datatype(), self.liverange, var=self.var)
+
     # does this variable contain the given address?
     def contains(self, addr):
         if not self.is_instantiated():
@@ -62,7 +69,7 @@ class StaticPCVariable(object):
         elif not self.addr_range:
             return addr == self.get_addr()
         else: # addr and addr_range are instantiated...
-            self.addr_range.contains(addr)
+            return self.addr_range.contains(addr)
 
     # if this Variable contains the given Address at this PC,
     # what is the offset from the start of this variable's range
@@ -71,7 +78,7 @@ class StaticPCVariable(object):
     # Address -> int | None
     def contained_offset(self, addr):
         if self.contains(addr):
-            return self.addr.distance(addr)
+            return self.get_addr().distance(addr)
         return None
 
     # StaticPCVariable -> StaticPCVariableCompare2
@@ -80,10 +87,10 @@ class StaticPCVariable(object):
 
     # codify uniqueness -> determined by parent variable (self.var) and the instantiated address (self.addr)
     def __hash__(self):
-        return hash((self.var, self.addr))
+        return hash((self.var, self.get_addr()))
 
     def __eq__(self, other):
-        return self.var is other.var and self.addr == other.addr
+        return self.var is other.var and self.get_addr() == other.get_addr()
 
 class DataTypeCompare2(object):
     def __init__(self, left_dtype, right_dtype):
@@ -190,299 +197,274 @@ class StaticPCVariableCompare2(object):
     def get_dtype_comparison(self):
         return self.dtype_comparison
 
-# Holds a StaticPCVariable + info pertaining to the comparison between this variable and another set of 
-# StaticPCVariable objects.
-# Tracks number of bytes "covered", variable overlaps, and more.
-# Caches previous comparisons for fast lookup.
-class StaticPCVariableCompareN(object):
-    def __init__(self, var_inst):
-        self.var_inst = var_inst
-
-        # dict[id(StaticPCVariable), StaticPCVariableCompare2]
-        self.comparisons = {}
-        self.bytes_overlapped = 0
-
-    # given a StaticPCVariable from another set, compare and update the internal state
-    def add_comparison(self, other_var_inst):
-        comparison = StaticPCVariableCompare2(self.var_inst, other_var_inst)
-        if comparison.does_overlap():
-            self.comparisons.append(comparison)
-            self.bytes_overlapped += comparison.get_addr_range_overlap().bytes_overlapped()
-        # TODO: finish
-
-    def get_var_inst(self):
-        return self.var_inst
-
-    def get_comparisons(self):
-        return self.comparisons
-
-    def get_bytes_overlapped(self):
-        return self.bytes_overlapped
-
-    def get_comparison_var_insts(self):
-        return [ cmp.get_overlap().get_right_var_inst() for cmp in self.comparisons ]
-
-# represents a "snapshot" of an Address region at a given PC during program execution.
-# holds a list of StaticPCVariable objects for the given region.
-class StaticPCAddressSpace(object):
-    def __init__(self, addrtype, var_insts):
-        self.addrtype = addrtype
-        self.var_insts = var_insts
-        self._verify_var_inst_types()
-
-    def _verify_var_inst_types(self):
-        for var_inst in self.var_insts:
-            assert (var_inst.get_addrtype() == self.addrtype)
-
-    # is the given AddressSpace known / placeable in memory?
-    # i.e., the address space is not UNKNOWN or EXTERNAL
-    @staticmethod
-    def is_known():
-        return False
-
-    # is the space rangeable?
-    @staticmethod
-    def is_rangeable():
-        return False
-
-    # does the space consist of only one location (e.g., a register)?
-    @staticmethod
-    def is_location():
-        return False
-
-    def get_addrtype(self):
-        return self.addrtype
-
-    def get_var_insts(self):
-        return self.var_insts
-
-    # is the other space referring to the same space as this one?
-    # default behavior: simple comparison of addrtypes
-    def same_space(self, other):
-        return self.get_addrtype() == other.get_addrtype()
-
-    # compares the variable instances of 2 address spaces
-    # returns StaticPCAddressSpaceCompare2 | None
-    def compare(self, other):
-        raise NotImplementedError()
-
-# Represents a snapshot of an Address space at a given PC.
-# "Rangeable" address spaces include stack frames, heap regions, memory accessible as register offsets
-class StaticPCAddressSpaceRangeable(StaticPCAddressSpace):
-    def __init__(self, addrtype, var_insts):
-        super(__class__, self).__init__(addrtype, var_insts)
-        self.var_insts.sort(key=lambda v: v.addr)
-
-    @staticmethod
-    def is_known():
-        return True
+# partition Varnodes into a ConstPCAddressSpace for each AddressRegion they occupy
+# [Varnode] -> {AddressRegion -> ConstPCAddressSpace}
+def make_address_spaces(varnodes):
+    return dict([
+        (region, ConstPCAddressSpace(region, region_varnodes)) for (region, region_varnodes) in partition_varnodes_by_region(varnodes).items()
+    ])
 
+# the "context" of program variables at a given PC: the Varnodes that are live, in an address space per region.
+# A context holds over a range of PCs, throughout which the same Varnodes are live.
+class StaticPCContext(object):
+    # pc_range: AddressRange of the PCs [start, end) the context holds over
+    # spaces: {AddressRegion -> ConstPCAddressSpace}
+    def __init__(self, pc_range, spaces):
+        self.pc_range = pc_range
+        self.spaces = spaces
+
+    # the context of the given variables at a single PC
+    # (Address, [Variable]) -> StaticPCContext
     @staticmethod
-    def is_rangeable():
-        return True
-
-    def compare(self, other):
-        assert( self.same_space(other) )
-        #TODO: incorporate StaticPCVariableCompareRecord objects
-        #TODO: use StaticPCAddressSpaceCompare2 to perform this logic
-        
-        # assume self & other var_insts are sorted ascending by addr
-        # iterate over the 'Left', 'Right', and 'Conflict' objects
-        zipper = OrderedZipper(
-            self.var_insts,
-            other.var_insts,
-            key=lambda var_inst: var_inst.addr # sort by addr
-        )
-
-        # accumulate all StaticPCVariableCompare2 objects between left and right
-        # variables in this address space
-        comparisons = []
-
-        # state variables
-        # If prev_left set, then it implies that the prev_left addr range
-        # could possibly overlap with the next right addr range.
-        # The same applies for prev_right.
-
-        # StaticPCVariable | None
-        prev_left = None
-        # StaticPCVariable | None
-        prev_right = None
-
-        for cur in zipper:
-            if cur.is_left():
-                left_var_inst = cur.get_value()
-                if prev_right:
-                    comparison = StaticPCVariableCompare2(left_var_inst, prev_right)
-                    if comparison.does_overlap():
-                        comparisons.append(comparison)
-                    else:
-                        prev_right = None
-                prev_left = left_var_inst
-
-            elif cur.is_right():
-                right_var_inst = cur.get_value()
-                if prev_left:
-                    comparison = StaticPCVariableCompare2(prev_left, right_var_inst)
-                    if comparison.does_overlap():
-                        comparisons.append(comparison)
-                    else:
-                        prev_left = None
-                prev_right = right_var_inst
-
-            elif cur.is_conflict():
-                left_var_inst, right_var_inst = cur.get_value()
-                comparison = StaticPCVariableCompare2(left_var_inst, right_var_inst)
-                if comparison.does_overlap():
-                    comparisons.append(comparison)
-                prev_left = left_var_inst
-                prev_right = right_var_inst
-
-
-# Represents an address "space" consisting of a single location
-# Identified by its Address object
-# e.g., a register location at a specific PC
-class StaticPCAddressSpaceLocation(StaticPCAddressSpace):
-    def __init__(self, var_inst):
-        self.var_inst = var_inst
-        super(__class__, self).__init__(self.get_addr().get_addrtype(), [var_inst])
+    def at_pc(pc, vars):
+        var_insts = [ StaticPCVariable(pc, var) for var in vars ]
+        return StaticPCContext.from_var_insts(pc, [ var_inst for var_inst in var_insts if var_inst.is_instantiated() ])
 
+    # the context of the parameters & local variables of a function at a single PC,
+    # found through the function's PC index rather than by checking every variable
+    # (Address, Function) -> StaticPCContext
     @staticmethod
-    def is_known():
-        return True
+    def at_function_pc(pc, function):
+        var_insts = [ StaticPCVariable(pc, var, liverange=liverange) for (var, liverange) in function.get_live_at_pc(pc) ]
+        return StaticPCContext.from_var_insts(pc, var_insts)
 
+    # (Address, [StaticPCVariable]) -> StaticPCContext
     @staticmethod
-    def is_location():
-        return True
+    def from_var_insts(pc, var_insts):
+        return StaticPCContext(AddressRange(pc, size=1), make_address_spaces([ var_inst.get_varnode() for var_inst in var_insts ]))
 
-    def get_addr(self):
-        return self.var_inst.get_addr()
-
-    def get_var_inst(self):
-        return self.var_inst
+    def get_pc_range(self):
+        return self.pc_range
 
-    # is the other space referring to the same space as this one?
-    # the locations must match exactly
-    def same_space(self, other):
-        return self.get_addr() == other.get_addr()
+    def get_addrspaces(self):
+        return self.spaces
 
-    def compare(self, other):
-        # ensure the addresses being compared are identical
-        assert( self.same_space(other) )
+    # AddressRegion -> ConstPCAddressSpace | None
+    def get_addrspace(self, region):
+        return self.spaces.get(region, None)
 
-        return [StaticPCVariableCompare2(self.get_var_inst(), other.get_var_inst())]
+    def get_varnodes(self):
+        return sum([ space.get_varnodes() for space in self.spaces.values() ], [])
 
-# Represents a snapshot of an Address space at a given PC.
-# Address spaces include stack frames, heap regions, memory accessible from register offset, register, etc.
-class StaticPCAddressSpaceUnknown(StaticPCAddressSpace):
-    def __init__(self, addrtype, var_insts):
-        super(__class__, self).__init__(addrtype, var_insts)
+    def get_bytes(self, varnode_filter=None):
+        return sum([ varnode.get_size() or 0 for varnode in self.get_varnodes() if varnode_filter is None or varnode_filter(varnode) ])
 
-    @staticmethod
-    def is_known():
-        return False
+    # the Varnodes that occupy the given Address
+    # Address -> [Varnode]
+    def get_varnodes_at_address(self, addr):
+        space = self.spaces.get(addr.get_region(), None)
+        if space is None:
+            return []
+        index = space.get_index()
+        if index is not None:
+            return index.at(addr.space_offset())
+        return [ varnode for varnode in space.get_varnodes() if varnode.get_addr() == addr ]
 
-    # how to compare unknown locations?
+    # return StaticPCContextCompare2
     def compare(self, other):
-        return []
-
-class StaticPCAddressSpaceCompare2(object):
-    def __init__(self, left_addrspace, right_addrspace):
-        # ensure the left and right address spaces are pointing to the same region
-        assert(left_addrspace.same_space(right_addrspace))
-        self.left_addrspace = left_addrspace
-        self.right_addrspace = right_addrspace
-        
-        self.var_inst_comparisons = self.left_addrspace.compare(self.right_addrspace)
-
-    def get_left_addrspace(self):
-        return self.left_addrspace
+        return StaticPCContextCompare2(self, other)
 
-    def get_right_addrspace(self):
-        return self.right_addrspace
+# compares the left & right contexts of a range of PCs, region by region.
+# The comparisons of the regions that haven't changed since a previous comparison can be reused from it.
+class StaticPCContextCompare2(object):
+    # prev: StaticPCContextCompare2 | None, a previous comparison to reuse region comparisons from
+    # changed_regions: the AddressRegions that changed since prev (all, if None)
+    def __init__(self, left_context, right_context, prev=None, changed_regions=None):
+        self.left_context = left_context
+        self.right_context = right_context
 
-    def get_var_inst_comparisons(self):
-        return self.var_inst_comparisons
+        # {AddressRegion -> ConstPCAddressSpaceCompare2}
+        self.addrspace_comparisons = self._compare(prev, changed_regions)
 
-# the "context" of program variables at a given PC
-class StaticPCContext(object):
-    def __init__(self, pc, vars):
-        self.pc = pc
-        # map each Variable to a StaticPCVariable.
-        # filter out the those that aren't "instantiated" at the given PC.
-        self.var_insts = [ var_inst for var_inst 
-            in ( StaticPCVariable(self.pc, var) for var in vars ) 
-            if var_inst.is_instantiated() 
+    # match left address spaces with right address spaces based on region
+    # if a region is missing from one side, it is matched with an empty space
+    # () -> [(AddressRegion, ConstPCAddressSpace, ConstPCAddressSpace)]
+    def _merge_addrspaces(self):
+        left_spaces = self.left_context.get_addrspaces()
+        right_spaces = self.right_context.get_addrspaces()
+        regions = list(left_spaces.keys()) + [ region for region in right_spaces.keys() if region not in left_spaces ]
+        return [
+            (region, left_spaces.get(region) or ConstPCAddressSpace(region, []), right_spaces.get(region) or ConstPCAddressSpace(region, []))
+            for region in regions
         ]
 
-        # construct a list of StaticPCAddressSpace objects, one for each
-        # address type present
-        self.addrspaces = self._partition_addr_spaces()
-
-    def _partition_addr_spaces(self):
-        # collect each StaticPCVariable by AddressType
-        # must separate registers by register number
-
-        # keys: AddressType code (int)
-        # values: [StaticPCVariable]
+    def _compare(self, prev, changed_regions):
         _map = {}
+        for (region, left_space, right_space) in self._merge_addrspaces():
+            reused = None
+            if prev is not None and changed_regions is not None and region not in changed_regions:
+                reused = prev.get_space_comparison(region)
+            _map[region] = reused if reused is not None else ConstPCAddressSpaceCompare2(left_space, right_space)
+        return _map
 
-        # keys: Register # (int)
-        # values: StaticPCVariable
-        _register_map = {}
-
-        for var_inst in self.var_insts:
-            addrtype = var_inst.get_addrtype()
-            if addrtype == AddressType.REGISTER:
-                regnum = var_inst.get_addr().get_register()
-                _register_map[regnum] = var_inst
-            elif addrtype in _map:
-                _map[addrtype].append(var_inst)
-            else:
-                _map[addrtype] = [var_inst]
-
-        # for each AddressType list of StaticPCVariables, construct
-        # a StaticPCAddressSpace object
-        # TODO: account for registers each having their own space
-        # TODO: account for subclasses of StaticPCAddressSpace
-        addrspaces = []
-        for (addrtype, var_insts) in _map.items():
-            space = StaticPCAddressSpaceRangeable(addrtype, var_insts) \
-                if AddressType.rangeable(addrtype) \
-                else StaticPCAddressSpaceUnknown(addrtype, var_insts)
-            addrspaces.append(space)
-
-        for (regnum, var_inst) in _register_map.items():
-            addrspaces.append(StaticPCAddressSpaceLocation(var_inst))
-
-        return addrspaces
+    def get_left(self):
+        return self.left_context
 
-    def get_addrspaces(self):
-        return self.addrspaces
+    def get_right(self):
+        return self.right_context
+
+    def get_pc_range(self):
+        return self.left_context.get_pc_range()
+
+    # AddressRegion -> ConstPCAddressSpaceCompare2 | None
+    def get_space_comparison(self, region):
+        return self.addrspace_comparisons.get(region, None)
+
+    def get_space_comparison_map(self):
+        return self.addrspace_comparisons
+
+    # [VarnodeCompareRecord], one for each left Varnode
+    def get_varnode_compare_records(self):
+        return sum([ list(cmp.get_varnode_compare_records()) for cmp in self.addrspace_comparisons.values() ], [])
+
+    def bytes_overlapped(self, varnode_filter=None):
+        return sum([ cmp.bytes_overlapped(varnode_filter=varnode_filter) for cmp in self.addrspace_comparisons.values() ])
+
+    def get_bytes(self, varnode_filter=None):
+        return self.left_context.get_bytes(varnode_filter=varnode_filter)
+
+# Compares the variables of 2 (optimized) functions at every PC, with a sweep line over their live ranges.
+# The start & end PCs of the live ranges of both functions are the events of the sweep, visited in order.
+# Each event adds or removes a Varnode from the live set of its side, and marks its AddressRegion as changed.
+# Between 2 consecutive event PCs the live sets are constant, so one StaticPCContextCompare2 covers the
+# whole PC interval. Only the regions that changed are compared again, the others are reused from the
+# comparison of the previous interval.
+class OptimizedFunctionCompare2(object):
+    # left, right: Function
+    # primitive: compare primitive varnodes (runs of array elements kept as StridedVarnodes)?
+    def __init__(self, left, right, primitive=False):
+        self.left = left
+        self.right = right
+        self.primitive = primitive
+
+        # [StaticPCContextCompare2], ordered by PC range, one for each PC interval where the live sets change
+        # (PC intervals where neither function has a live variable are skipped)
+        self.context_comparisons = self._sweep()
+
+        # start PC offsets of the context comparisons, for lookups by PC
+        self.starts = [ cmp.get_pc_range().get_start().space_offset() for cmp in self.context_comparisons ]
+
+        # {Varnode -> VarnodeCompareRecord}: comparisons of each left Varnode over its whole live range
+        self.varnode_compare_record_map = self._make_varnode_compare_record_map()
+
+    # the live range events of a function: (PC offset, is start, Varnode)
+    # Function -> [(int, bool, Varnode)]
+    def _make_events(self, function):
+        events = []
+        for (start, end, (var, liverange)) in function.get_pc_index():
+            if end <= start:
+                continue
+            varnode = Varnode(var.get_datatype(), liverange, var=var)
+            for varnode in (varnode.flatten_strided() if self.primitive else [ varnode ]):
+                events.append((start, True, varnode))
+                events.append((end, False, varnode))
+        return events
+
+    def _sweep(self):
+        # (PC offset, is start, side, Varnode), where side 0 = left and 1 = right
+        events = [ (pc, is_start, 0, varnode) for (pc, is_start, varnode) in self._make_events(self.left) ] + \
+            [ (pc, is_start, 1, varnode) for (pc, is_start, varnode) in self._make_events(self.right) ]
+        # PC ranges are half-open: at the same PC, live ranges end before others start
+        events.sort(key=lambda event: (event[0], event[1]))
+
+        # the live set of each side: {AddressRegion -> {Varnode -> None}} (ordered by insertion)
+        live = ({}, {})
+        # the spaces of each side's live set, rebuilt for the changed regions only
+        spaces = ({}, {})
+        changed_regions = set()
 
-    # Address -> StaticPCVariable | None
-    def get_var_inst_at_address(self, addr):
-        for var_inst in self.var_insts:
-            if var_inst.contains(addr):
-                return var_inst
+        comparisons = []
+        prev = None
+        i = 0
+        while i < len(events):
+            pc = events[i][0]
+            while i < len(events) and events[i][0] == pc:
+                (_, is_start, side, varnode) = events[i]
+                region = varnode.get_addr().get_region()
+                region_live = live[side].setdefault(region, {})
+                if is_start:
+                    region_live[varnode] = None
+                else:
+                    region_live.pop(varnode, None)
+                    if not region_live:
+                        del live[side][region]
+                changed_regions.add(region)
+                i += 1
+
+            # nothing is live after the last event
+            if i == len(events):
+                break
+
+            if not live[0] and not live[1]:
+                spaces = ({}, {})
+                prev = None
+                changed_regions = set()
+                continue
+
+            for region in changed_regions:
+                for side in (0, 1):
+                    if region in live[side]:
+                        spaces[side][region] = ConstPCAddressSpace(region, list(live[side][region].keys()))
+                    else:
+                        spaces[side].pop(region, None)
+
+            pc_range = AddressRange(AbsoluteAddress.intern(pc), end=AbsoluteAddress.intern(events[i][0]))
+            prev = StaticPCContextCompare2(
+                StaticPCContext(pc_range, dict(spaces[0])),
+                StaticPCContext(pc_range, dict(spaces[1])),
+                prev=prev,
+                changed_regions=changed_regions
+            )
+            comparisons.append(prev)
+            changed_regions = set()
+
+        return comparisons
+
+    # combine the records of each left Varnode across the PC intervals it is live in
+    def _make_varnode_compare_record_map(self):
+        _map = {}
+        seen = set()
+        for context_cmp in self.context_comparisons:
+            for record in context_cmp.get_varnode_compare_records():
+                # records of reused region comparisons are shared between intervals
+                if id(record) in seen:
+                    continue
+                seen.add(id(record))
+                varnode = record.get_varnode()
+                if varnode not in _map:
+                    _map[varnode] = VarnodeCompareRecord(varnode)
+                for comparison in record.get_comparisons():
+                    _map[varnode].add_comparison(comparison)
+        return _map
+
+    def get_left(self):
+        return self.left
+
+    def get_right(self):
+        return self.right
+
+    def get_context_comparisons(self):
+        return self.context_comparisons
+
+    # the comparison of the contexts at the given PC Address (or None)
+    # Address -> StaticPCContextCompare2 | None
+    def get_context_comparison_at_pc(self, pc):
+        i = bisect_right(self.starts, pc.space_offset()) - 1
+        if i >= 0 and self.context_comparisons[i].get_pc_range().contains(pc):
+            return self.context_comparisons[i]
         return None
 
-    # return StaticPCContextCompare2
-    def compare(self, other):
-        return StaticPCContextCompare2(self, other)
+    def get_varnode_compare_record(self, varnode):
+        return self.varnode_compare_record_map.get(varnode, None)
 
-class StaticPCContextCompare2(object):
-    def __init__(self, left_context, right_context):
-        self.left_context = left_context
-        self.right_context = right_context
+    def get_varnode_compare_record_map(self):
+        return self.varnode_compare_record_map
 
-        # TODO: 
-        self.addrspace_comparisons = []
+    def get_varnode_compare_records(self):
+        return list(self.varnode_compare_record_map.values())
 
-    def _merge_addrspaces(self):
-        # we need addrspaces for each left and right to be in some order for easier merging
-        # use OrderedZipper again?
-        # define ordering based on AddressType of addrspaces?
-        pass
+    def select_varnode_compare_records(self, varnode_cmp_record_cond=None):
+        return [ record for record in self.get_varnode_compare_records() if varnode_cmp_record_cond is None or varnode_cmp_record_cond(record) ]
 
-    def _compare(self):
-        pass
+    def flip(self):
+        return OptimizedFunctionCompare2(self.right, self.left, primitive=self.primitive)
@@ -1,38 +1,91 @@
 from typing import List, Tuple, Union
+import numpy as np
 from lang import *
 from lang_address import *
 from lang_datatype import *
 from util import *
+from interval import *
 from compare_variable import *
 
+# Joins 2 sets of [start, end) intervals on overlap, each set sorted by start.
+# Returns the (left indices, right indices) of all the overlapping pairs, ordered by left index
+# then right index.
+# For each left interval, the candidate right intervals are found by binary search: those that
+# start before it ends, and that end after it starts (using the running maximum of the right ends,
+# which are sorted themselves when the right intervals don't overlap each other).
+def interval_overlap_pairs(
+    left_starts: np.ndarray,
+    left_ends: np.ndarray,
+    right_starts: np.ndarray,
+    right_ends: np.ndarray
+) -> 'Tuple[np.ndarray, np.ndarray]':
+    max_right_ends = np.maximum.accumulate(right_ends)
+    lo = np.searchsorted(max_right_ends, left_starts, side="right")
+    hi = np.searchsorted(right_starts, left_ends, side="left")
+    counts = np.maximum(hi - lo, 0)
+
+    # expand each left interval's [lo, hi) range of candidates
+    left_idxs = np.repeat(np.arange(len(left_starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    right_idxs = np.repeat(lo, counts) + offsets
+
+    # drop the candidates that don't overlap (only when right intervals overlap each other), and empty intervals
+    keep = (right_ends[right_idxs] > left_starts[left_idxs]) \
+        & (right_starts[right_idxs] < left_ends[left_idxs]) \
+        & (left_starts[left_idxs] < left_ends[left_idxs]) \
+        & (right_starts[right_idxs] < right_ends[right_idxs])
+    return (left_idxs[keep], right_idxs[keep])
+
+# group varnodes by the AddressRegion of their address
+def partition_varnodes_by_region(varnodes: List[Varnode]) -> 'dict[AddressRegion, List[Varnode]]':
+    _map: dict[AddressRegion, List[Varnode]] = {}
+    for varnode in varnodes:
+        region = varnode.get_addr().get_region()
+        if region in _map:
+            _map[region].append(varnode)
+        else:
+            _map[region] = [varnode]
+    return _map
+
+# an IntervalTree over the address ranges of varnodes that share a rangeable AddressRegion
+def make_varnode_index(varnodes: List[Varnode]) -> IntervalTree:
+    intervals = []
+    for varnode in varnodes:
+        start = varnode.get_addr().space_offset()
+        intervals.append((start, start + (varnode.get_size() or 0), varnode))
+    return IntervalTree(intervals)
+
+# pairs of distinct varnodes of an index whose address ranges overlap
+def find_index_overlaps(index: IntervalTree) -> List[Tuple[Varnode, Varnode]]:
+    return [ (l, r) for l, r in index.overlapping_pairs() if l is not r and hash(l) != hash(r) ]
+
+# find erroneous overlaps between varnodes of the same rangeable regions
+def find_varnode_overlaps(varnodes: List[Varnode]) -> List[Tuple[Varnode, Varnode]]:
+    return sum([
+        find_index_overlaps(make_varnode_index(region_varnodes))
+        for region, region_varnodes in partition_varnodes_by_region(varnodes).items() if region.is_range()
+    ], [])
+
 # represents a "snapshot"/set of variables at a given PC during the program
 # allows us to compare memory regions, etc. for variables at a given PC
 class ConstPCVariableSetSnapshot(object):
     def __init__(self, varnodes: List[Varnode]):
         self.varnodes = varnodes
 
-        # partition Varnodes into address spaces based on their address regions
-        self.spaces: dict[AddressRegion, ConstPCAddressSpace] = self._partition_spaces()
-
-    def _partition_spaces(self) -> 'List[ConstPCAddressSpace]':
         # collect Varnodes for each AddressRegion
-        _map: dict[AddressRegion, List[Varnode]] = {}
+        _map = partition_varnodes_by_region(varnodes)
 
-        for varnode in self.varnodes:
-            region = varnode.get_addr().get_region()
-            if region in _map:
-                _map[region].append(varnode)
-            else:
-                _map[region] = [varnode]
-
-        # construct the ConstPCAddressSpace objects for each
-        return dict([ (region, ConstPCAddressSpace(region, varnodes)) for (region, varnodes) in _map.items() ])
+        # partition Varnodes into address spaces based on their address regions
+        self.spaces: dict[AddressRegion, ConstPCAddressSpace] = dict([
+            (region, ConstPCAddressSpace(region, region_varnodes)) for (region, region_varnodes) in _map.items()
+        ])
 
     def get_varnodes(self) -> List[Varnode]:
         return self.varnodes
 
+    # flatten to primitive varnodes (runs of array elements are kept as single StridedVarnodes)
     def flatten(self) -> 'ConstPCVariableSetSnapshot':
-        return ConstPCVariableSetSnapshot(sum([ varnode.flatten() for varnode in self.varnodes ], []))
+        return ConstPCVariableSetSnapshot(sum([ varnode.flatten_strided() for varnode in self.varnodes ], []))
 
     def get_address_spaces(self) -> 'dict[AddressRegion, ConstPCAddressSpace]':
         return self.spaces
@@ -44,9 +97,28 @@ class ConstPCVariableSetSnapshot(object):
     def get_bytes(self, varnode_filter=None) -> int:
         return sum([ varnode.get_size() for varnode in self.varnodes if varnode_filter is None or varnode_filter(varnode) ])
 
-    def _find_overlaps(self) -> Tuple[Varnode, Varnode]:
+    def _find_overlaps(self) -> List[Tuple[Varnode, Varnode]]:
         return sum([ space._find_overlaps() for space in self.spaces.values() ], [])
 
+    # the address range index of a (rangeable) AddressRegion, or None (see ConstPCAddressSpace.get_index())
+    def get_index(self, region: AddressRegion) -> 'Union[IntervalTree, None]':
+        space = self.spaces.get(region, None)
+        return space.get_index() if space is not None else None
+
+    # the varnodes whose address ranges overlap the given AddressRange, ordered by address
+    def find_overlapping(self, addr_range: AddressRange) -> List[Varnode]:
+        start = addr_range.get_start()
+        index = self.get_index(start.get_region())
+        if index is None:
+            return []
+        offset = start.space_offset()
+        return index.overlap(offset, offset + addr_range.get_size())
+
+    # the varnodes that occupy the given Address
+    def find_at(self, addr: Address) -> List[Varnode]:
+        index = self.get_index(addr.get_region())
+        return index.at(addr.space_offset()) if index is not None else []
+
     def __hash__(self) -> int:
         return hash(tuple(self.varnodes))
 
@@ -168,11 +240,17 @@ class ConstPCAddressSpace(object):
         self.region = region
         self.varnodes = sorted(varnodes, key=lambda v: v.get_addr()) if self.rangeable() else varnodes
 
+        # IntervalTree of the varnodes' address ranges (rangeable spaces only), built on first use
+        self.index: 'Union[IntervalTree, None]' = None
+
+        # (starts, ends) arrays of the varnodes' address ranges, built on first use
+        self.intervals: 'Union[Tuple[np.ndarray, np.ndarray], None]' = None
+
+        # varnodes of the same space may overlap (e.g. locals that share a stack slot),
+        # the comparison pairs are exact regardless. Use _find_overlaps() to find them.
         for varnode in self.varnodes:
             self._verify_region(varnode)
 
-        assert(not self._find_overlaps())
-
     def _verify_region(self, varnode: Varnode):
         assert( varnode.get_addr().get_region() == self.region )
 
@@ -192,64 +270,39 @@ class ConstPCAddressSpace(object):
         return self.rangeable()
 
     # find erroneous overlaps within this space of varnodes
-    def _find_overlaps(self) -> Tuple[Varnode, Varnode]:
-        return [ (l, r) for l, r in self._get_comparison_pairs_rangeable(self) if l != r and l is not r and hash(l) != hash(r) ] if self.rangeable() else []
+    def _find_overlaps(self) -> List[Tuple[Varnode, Varnode]]:
+        return find_index_overlaps(self.get_index()) if self.rangeable() else []
+
+    # the address range index of the varnodes, or None if the space isn't rangeable
+    def get_index(self) -> 'Union[IntervalTree, None]':
+        if self.index is None and self.rangeable():
+            self.index = make_varnode_index(self.varnodes)
+        return self.index
 
     # by default, no comparison pairs can be formed
     def get_comparison_pairs(self, other: 'ConstPCAddressSpace') -> 'List[Tuple[Varnode, Varnode]]':
         return self._get_comparison_pairs_rangeable(other) if self.rangeable() else []
 
+    # the [start, end) offsets of the varnodes (in order), as integer arrays
+    def get_intervals(self) -> 'Tuple[np.ndarray, np.ndarray]':
+        if self.intervals is None:
+            starts = np.array([ varnode.get_addr().space_offset() for varnode in self.varnodes ], dtype=np.int64)
+            sizes = np.array([ varnode.get_size() or 0 for varnode in self.varnodes ], dtype=np.int64)
+            self.intervals = (starts, starts + sizes)
+        return self.intervals
+
+    # the indices (into the left & right varnodes) of the pairs of varnodes whose address ranges overlap
+    def get_comparison_index_pairs(self, other: 'ConstPCAddressSpace') -> 'Tuple[np.ndarray, np.ndarray]':
+        if not self.rangeable() or not self.varnodes or not other.get_varnodes():
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        left_starts, left_ends = self.get_intervals()
+        right_starts, right_ends = other.get_intervals()
+        return interval_overlap_pairs(left_starts, left_ends, right_starts, right_ends)
+
     def _get_comparison_pairs_rangeable(self, other: 'ConstPCAddressSpace') -> 'List[Tuple[Varnode, Varnode]]':
-        # create iterator the "merges" the 2 address spaces
-        zipper = OrderedZipper(
-            self.get_varnodes(),
-            other.get_varnodes(),
-            key=lambda varnode: varnode.get_addr() # sort by addr
-        )
-
-        # accumulate a list of Varnode pairs that overlap between the sets
-        pairs = []
-
-        # state variables
-        # If prev_left set, then it implies that the prev_left addr range
-        # could possibly overlap with the next right addr range.
-        # The same applies for prev_right.
-
-        # Varnode | None
-        prev_left = None
-        # Varnode | None
-        prev_right = None
-
-        def _addr_range_overlap(l: Varnode, r: Varnode) -> bool:
-            return l.get_addr_range().does_overlap(r.get_addr_range())
-
-        for cur in zipper:
-            if cur.is_left(): # left list was iterated
-                left_varnode = cur.get_value()
-                if prev_right:
-                    if _addr_range_overlap(left_varnode, prev_right):
-                        pairs.append((left_varnode, prev_right))
-                    else:
-                        prev_right = None
-                prev_left = left_varnode
-
-            elif cur.is_right(): # right list was iterated
-                right_varnode = cur.get_value()
-                if prev_left:
-                    if _addr_range_overlap(prev_left, right_varnode):
-                        pairs.append((prev_left, right_varnode))
-                    else:
-                        prev_left = None
-                prev_right = right_varnode
-
-            elif cur.is_conflict(): # left & right varnodes matched start addr
-                left_varnode, right_varnode = cur.get_value()
-                if _addr_range_overlap(left_varnode, right_varnode):
-                    pairs.append((left_varnode, right_varnode))
-                prev_left = left_varnode
-                prev_right = right_varnode
-
-        return pairs
+        left_idxs, right_idxs = self.get_comparison_index_pairs(other)
+        right_varnodes = other.get_varnodes()
+        return [ (self.varnodes[l], right_varnodes[r]) for l, r in zip(left_idxs.tolist(), right_idxs.tolist()) ]
 
     def __hash__(self) -> int:
         return hash((self.region, tuple(self.varnodes)))
@@ -275,13 +328,14 @@ class ConstPCAddressSpaceCompare2(object):
         self.varnode_compare_record_map: dict[Varnode, VarnodeCompareRecord] = \
             dict([(varnode, VarnodeCompareRecord(varnode)) for varnode in self.left.get_varnodes()])
 
-        # merge the two sets and get pairs of varnodes to compare
-        # based on address overlaps
-        compare_pairs: List[Tuple[Varnode, Varnode]] = left.get_comparison_pairs(right)
+        # join the two sets on address overlaps, to get the (indices of the) pairs of varnodes to compare
+        left_idxs, right_idxs = left.get_comparison_index_pairs(right)
 
         # for each pair to compare, make the comparison and update internal state
-        for left_varnode, right_varnode in compare_pairs:
-            self._compare(left_varnode, right_varnode)
+        left_varnodes = left.get_varnodes()
+        right_varnodes = right.get_varnodes()
+        for l, r in zip(left_idxs.tolist(), right_idxs.tolist()):
+            self._compare(left_varnodes[l], right_varnodes[r])
 
     # compare the 2 varnodes and update the internal state
     def _compare(self, left_varnode: Varnode, right_varnode: Varnode):
@@ -180,7 +180,7 @@ class UnoptimizedProgramInfoCompare2(object):
             for var in fn.get_vars() + fn.get_params():
                 varnodes = var.get_varnodes()
                 if primitive:
-                    varnodes = sum([ varnode.flatten() for varnode in varnodes ], [])
+                    varnodes = sum([ varnode.flatten_strided() for varnode in varnodes ], [])
                 varnode_compare_records += [ VarnodeCompareRecord(varnode) for varnode in varnodes ]
         return varnode_compare_records
 
@@ -95,6 +95,9 @@ class VarnodeCompare2(object):
 
         self.compare_code: int = self._compute_compare_code()
 
+        # compare levels of the left elements, computed on demand (see get_element_compare_levels())
+        self.element_compare_levels: Union[List[Tuple[int, int, int]], None] = None
+
         # if both left and right types are primitive, perform type lattice comparison
         # TODO: implement this
 
@@ -144,6 +147,50 @@ class VarnodeCompare2(object):
     def get_compare_code_str(self) -> str:
         return VarnodeCompare2Code.to_string(self.compare_code)
 
+    # the compare levels of the elements of the left varnode (see StridedVarnode) against the
+    # elements of the right varnode, as runs [(start index, end index, level)] of the left elements
+    # that overlap the right varnode. Elements are only expanded where the two runs don't line up.
+    def get_element_compare_levels(self) -> List[Tuple[int, int, int]]:
+        if self.element_compare_levels is None:
+            self.element_compare_levels = self._compute_element_compare_levels()
+        return self.element_compare_levels
+
+    def _compute_element_compare_levels(self) -> List[Tuple[int, int, int]]:
+        if not self.does_overlap():
+            return []
+
+        if not self.left.is_strided() and not self.right.is_strided():
+            return [ (0, 1, self.get_compare_level()) ]
+
+        # bytes spanned by the right varnode, relative to the left address
+        start = self.right.get_addr() - self.left.get_addr()
+        end = start + self.right.get_size()
+        lo, hi = self.left.get_element_range(start, end)
+        stride = self.left.get_stride()
+
+        # left & right elements line up one to one, so they all compare the same way
+        if stride > 0 and self.left.is_dense() and self.right.is_dense() \
+            and self.right.get_stride() == stride \
+            and start % stride == 0:
+            first_left = self.left.get_element(lo)
+            first_right = self.right.get_element((lo * stride - start) // stride)
+            return [ (lo, hi, VarnodeCompare2(first_left, first_right).get_compare_level()) ]
+
+        # otherwise, compare each overlapped left element with the right elements it overlaps
+        levels = []
+        for i in range(lo, hi):
+            left_elem = self.left.get_element(i)
+            elem_start = i * stride - start
+            r_lo, r_hi = self.right.get_element_range(elem_start, elem_start + left_elem.get_size())
+            level = max([VarnodeCompareLevel.NO_MATCH] + [
+                VarnodeCompare2(left_elem, self.right.get_element(j)).get_compare_level() for j in range(r_lo, r_hi)
+            ])
+            if levels and levels[-1][1] == i and levels[-1][2] == level:
+                levels[-1] = (levels[-1][0], i + 1, level)
+            else:
+                levels.append((i, i + 1, level))
+        return levels
+
     def get_datatype_comparison(self) -> Union[DataTypeCompare2, None]:
         return self.datatype_comparison
 
@@ -205,8 +252,49 @@ class VarnodeCompareRecord(object):
         # this varnode is always the "left" varnode in these comparisons
         self.varnode_comparison_map: dict[Varnode, VarnodeCompare2] = {}
 
+        # {VarnodeCompareLevel -> number of elements}, computed on demand
+        self.level_counts: Union['dict[int, int]', None] = None
+
+    # the best compare level of any element of the varnode
     def get_compare_level(self) -> int:
-        return max([VarnodeCompareLevel.NO_MATCH] + [cmp2.get_compare_level() for cmp2 in self.get_comparisons()])
+        return max([VarnodeCompareLevel.NO_MATCH] + [ level for level, count in self.get_level_counts().items() if count > 0 ])
+
+    # the number of (primitive) elements of the varnode: 1 unless it is a StridedVarnode
+    def get_count(self) -> int:
+        return self.varnode.get_count()
+
+    # the number of elements of the varnode that are matched at each VarnodeCompareLevel
+    # each element is matched at the best level of the comparisons it is involved in
+    def get_level_counts(self) -> 'dict[int, int]':
+        if self.level_counts is None:
+            self.level_counts = self._compute_level_counts()
+        return self.level_counts
+
+    def _compute_level_counts(self) -> 'dict[int, int]':
+        segments = sum([ cmp2.get_element_compare_levels() for cmp2 in self.get_comparisons() ], [])
+        count = self.get_count()
+
+        # sweep across the elements, tracking how many segments of each level are open
+        events: 'dict[int, List[Tuple[int, int]]]' = {}
+        for lo, hi, level in segments:
+            events.setdefault(lo, []).append((level, 1))
+            events.setdefault(hi, []).append((level, -1))
+
+        open_segments = [0] * (VarnodeCompareLevel.MATCH + 1)
+        counts: 'dict[int, int]' = {}
+        bounds = sorted(set([0, count] + list(events.keys())))
+        for start, end in zip(bounds, bounds[1:]):
+            for level, delta in events.get(start, []):
+                open_segments[level] += delta
+            best = max([VarnodeCompareLevel.NO_MATCH] + [ level for level, num in enumerate(open_segments) if num > 0 ])
+            counts[best] = counts.get(best, 0) + (end - start)
+        return counts
+
+    # the compare level of the i-th element of the varnode
+    def get_element_compare_level(self, i: int) -> int:
+        return max([VarnodeCompareLevel.NO_MATCH] + [
+            level for cmp2 in self.get_comparisons() for lo, hi, level in cmp2.get_element_compare_levels() if lo <= i < hi
+        ])
 
     def compared_with(self) -> int:
         return len(self.varnode_comparison_map)
@@ -247,6 +335,7 @@ class VarnodeCompareRecord(object):
         # been inserted
         if compare2.get_right() not in self.varnode_comparison_map:
             self.varnode_comparison_map[compare2.get_right()] = compare2
+            self.level_counts = None
 
     def get_compared_varnodes(self) -> List[Varnode]:
         return list(self.varnode_comparison_map.keys())
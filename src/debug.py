@@ -10,8 +10,8 @@ def find_erroneous_overlaps(proginfo: ProgramInfo) -> List[Tuple[Varnode, Varnod
     unopt_proginfo = UnoptimizedProgramInfo(proginfo)
     gbls = unopt_proginfo.get_unoptimized_globals()
     fns = unopt_proginfo.get_unoptimized_functions().values()
-    return sum([ ConstPCVariableSetSnapshot(fn.get_varnodes())._find_overlaps() for fn in fns ], []) \
-        + ConstPCVariableSetSnapshot(gbls)._find_overlaps()
+    return sum([ find_varnode_overlaps(fn.get_varnodes()) for fn in fns ], []) \
+        + find_varnode_overlaps(gbls)
 
 def _name(varnode: Varnode) -> str:
     return varnode.get_var().get_name()
@@ -0,0 +1,73 @@
+import hashlib
+import weakref
+
+# Hash-consing (interning) of immutable values.
+# Structurally equal values built through intern_value() are the same object, which
+# saves memory and lets equality tests succeed on identity.
+# Values are held weakly, so an interned value is freed once nothing else references it.
+
+# {(class, structural key...) -> value}
+_INTERNED = weakref.WeakValueDictionary()
+
+# key: hashable structural key of the value (should include its class)
+# make: () -> value, called to build the value if it isn't interned yet
+def intern_value(key, make):
+    value = _INTERNED.get(key)
+    if value is None:
+        value = _INTERNED.setdefault(key, make())
+    return value
+
+# is this the interned value of the given key?
+def is_interned_value(key, value):
+    return _INTERNED.get(key) is value
+
+# the number of live interned values
+def interned_count():
+    return len(_INTERNED)
+
+# Memoized hashes and digests of (dict-based) objects that don't change once built.
+# Memos are kept in these attributes of the object's __dict__.
+HASH_MEMO = "_hash"
+DIGEST_MEMO = "_digest"
+
+# Objects that are filled in after they're built (i.e. Variables, Functions & ProgramInfos, by the
+# resolver) are marked incomplete until they're filled in. Their memoized hashes & digests would
+# describe partial content, so hashing or digesting an incomplete object is an error.
+INCOMPLETE = "_incomplete"
+
+def mark_incomplete(obj):
+    obj.__dict__[INCOMPLETE] = True
+    return obj
+
+def mark_complete(obj):
+    obj.__dict__.pop(INCOMPLETE, None)
+    return obj
+
+def assert_complete(obj):
+    assert not obj.__dict__.get(INCOMPLETE), "{} hashed before it was complete".format(type(obj).__name__)
+
+# for objects changed after they're complete: their hashes & digests must not be memoized yet
+def assert_not_memoized(obj):
+    assert HASH_MEMO not in obj.__dict__ and DIGEST_MEMO not in obj.__dict__, "{} changed after it was hashed".format(type(obj).__name__)
+
+# decorates a __hash__ method, caching its result on the object
+def memoized_hash(compute):
+    def __hash__(self):
+        h = self.__dict__.get(HASH_MEMO)
+        if h is None:
+            assert_complete(self)
+            h = compute(self)
+            self.__dict__[HASH_MEMO] = h
+        return h
+    return __hash__
+
+# the pickled state of an object with memoized hashes: hashes aren't persisted, since the hashes
+# of some values (i.e. None) differ between processes. Digests are stable, and are persisted.
+def state_without_hash_memo(obj):
+    state = obj.__dict__.copy()
+    state.pop(HASH_MEMO, None)
+    return state
+
+# the SHA-256 hex digest of a list of strings
+def digest_strings(parts):
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
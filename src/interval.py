@@ -0,0 +1,86 @@
+# A static interval tree: an index over [start, end) integer intervals, each tagged with a value,
+# that finds the intervals overlapping a point or a range in O(log n + k).
+# The intervals are kept sorted by start, and the tree is implicit in the sorted order: the node of
+# a slice [lo, hi) is its middle element, and its subtrees are the slices on either side. Each node
+# records the largest end of its subtree, so subtrees ending before a query are skipped.
+# Intervals are half-open: empty intervals (start == end) overlap nothing.
+class IntervalTree(object):
+    # intervals: iterable of (start, end, value)
+    def __init__(self, intervals=()):
+        items = sorted(intervals, key=lambda item: (item[0], item[1]))
+        self.starts = [ start for (start, end, value) in items ]
+        self.ends = [ end for (start, end, value) in items ]
+        self.values = [ value for (start, end, value) in items ]
+
+        # the largest end in the subtree rooted at each node
+        self.max_ends = [ None ] * len(items)
+        self._build(0, len(items))
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        max_end = self.ends[mid]
+        for sub_max_end in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if sub_max_end is not None and sub_max_end > max_end:
+                max_end = sub_max_end
+        self.max_ends[mid] = max_end
+        return max_end
+
+    def __len__(self):
+        return len(self.starts)
+
+    # (start, end, value) of each interval, ordered by start
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends, self.values))
+
+    # the positions (in start order) of the intervals that overlap [start, end)
+    # (int, int) -> [int]
+    def _overlapping(self, start, end):
+        found = []
+        if start >= end:
+            return found
+
+        # in-order traversal, pruning subtrees that end before start or begin after end
+        stack = [ (0, len(self.starts)) ]
+        pending = []
+        while stack or pending:
+            if stack:
+                lo, hi = stack.pop()
+                if lo >= hi:
+                    continue
+                mid = (lo + hi) // 2
+                if self.max_ends[mid] <= start:
+                    continue
+                # visit left subtree, then the node & right subtree
+                pending.append((mid, hi))
+                stack.append((lo, mid))
+            else:
+                mid, hi = pending.pop()
+                if self.starts[mid] >= end:
+                    continue
+                if self.ends[mid] > start and self.ends[mid] > self.starts[mid]:
+                    found.append(mid)
+                stack.append((mid + 1, hi))
+        return found
+
+    # the values of the intervals that overlap [start, end), ordered by start
+    # (int, int) -> [value]
+    def overlap(self, start, end):
+        return [ self.values[i] for i in self._overlapping(start, end) ]
+
+    # the values of the intervals that contain the point
+    # int -> [value]
+    def at(self, point):
+        return self.overlap(point, point + 1)
+
+    # the (value, value) pairs of intervals that overlap each other, each pair reported once
+    # (earlier start first)
+    # () -> [(value, value)]
+    def overlapping_pairs(self):
+        pairs = []
+        for i in range(0, len(self.starts)):
+            for j in self._overlapping(self.starts[i], self.ends[i]):
+                if j > i:
+                    pairs.append((self.values[i], self.values[j]))
+        return pairs
@@ -2,6 +2,7 @@
 from lang_address import *
 from lang_datatype import *
 from lang_variable import *
+from interval import IntervalTree
 
 # hold the results of a translation into this common language
 # from either DWARF info or Ghidra decompilation
@@ -9,6 +10,8 @@ class ProgramInfo(object):
     def __init__(self, globals=[], functions=[]):
         self.globals = globals
         self.functions = functions
+        # stable content fingerprint (hex digest), see compute_fingerprint()
+        self.fingerprint = None
 
     def get_globals(self):
         return self.globals
@@ -31,6 +34,35 @@ class ProgramInfo(object):
     def select_primitive_varnodes(self, function_cond=None, variable_cond=None, varnode_cond=None):
         return sum([ gbl.select_primitive_varnodes(varnode_cond=varnode_cond) for gbl in self.globals if variable_cond is None or variable_cond(gbl) ], []) + sum([fn.select_primitive_varnodes(variable_cond=variable_cond, varnode_cond=varnode_cond) for fn in self.functions if function_cond is None or function_cond(fn) ], [])
 
+    # Compute (and store) a stable fingerprint of this program's content.
+    # This is meant to be done once, at parse time, so the fingerprint is persisted
+    # (pickled/cached) along with the object and can serve as a cheap cache key.
+    # () -> str
+    def compute_fingerprint(self):
+        self.fingerprint = self.digest()
+        return self.fingerprint
+
+    # A stable SHA-256 hex digest of this program's content, built from the (memoized) digests
+    # of its globals and functions.
+    # () -> str
+    def digest(self):
+        memo = self.__dict__.get(DIGEST_MEMO)
+        if memo is None:
+            assert_complete(self)
+            memo = digest_strings([ gbl.digest() for gbl in self.globals ] + [ "|" ] + [ fn.digest() for fn in self.functions ])
+            self.__dict__[DIGEST_MEMO] = memo
+        return memo
+
+    def __getstate__(self):
+        return state_without_hash_memo(self)
+
+    # () -> str
+    def get_fingerprint(self):
+        # objects pickled before fingerprints existed don't have the attribute
+        if getattr(self, "fingerprint", None) is None:
+            self.compute_fingerprint()
+        return self.fingerprint
+
     def print_summary(self):
         print("----------------GLOBALS----------------------")
         for gbl in self.globals:
@@ -41,6 +73,7 @@ class ProgramInfo(object):
         for fn in self.functions:
             fn.print_summary()
 
+    @memoized_hash
     def __hash__(self):
         return hash((tuple(self.globals), tuple(self.functions)))
 
@@ -127,10 +160,60 @@ class Function(object):
     def select_primitive_varnodes(self, variable_cond=None, varnode_cond=None):
         return sum([ var.select_primitive_varnodes(varnode_cond=varnode_cond) for var in self.select_variables(variable_cond=variable_cond) ], [])
 
+    # An IntervalTree over the (absolute) PC ranges of the live ranges of all parameters and local
+    # variables, with (Variable, AddressLiveRange) values. Built on first use.
+    # () -> IntervalTree
+    def get_pc_index(self):
+        index = self.__dict__.get(PC_INDEX_MEMO)
+        if index is None:
+            intervals = []
+            for var in self.params + self.vars:
+                for liverange in var.get_liveranges():
+                    pc_range = liverange.get_pc_range()
+                    if pc_range is not None and pc_range.get_start().get_addrtype() == AddressType.ABSOLUTE:
+                        intervals.append((pc_range.get_start().space_offset(), pc_range.get_end().space_offset(), (var, liverange)))
+            index = IntervalTree(intervals)
+            self.__dict__[PC_INDEX_MEMO] = index
+        return index
+
+    # which variables are live at the given PC Address, and where?
+    # Address -> [(Variable, AddressLiveRange)]
+    def get_live_at_pc(self, pc):
+        if pc.get_addrtype() != AddressType.ABSOLUTE:
+            return []
+        return self.get_pc_index().at(pc.space_offset())
+
+    # the Varnodes of the variables live at the given PC Address
+    # Address -> [Varnode]
+    def get_varnodes_at_pc(self, pc):
+        return [ Varnode(var.get_datatype(), liverange, var=var) for (var, liverange) in self.get_live_at_pc(pc) ]
+
     def print_summary(self):
         print("{} :: {} @ PC range=({}, {})".format(self.name, self.get_prototype(), self.startaddr, self.endaddr))
         for var in (self.params + self.vars):
             print("\t{}".format(var))
 
+    # A stable SHA-256 hex digest of this function's content, computed once.
+    # () -> str
+    def digest(self):
+        memo = self.__dict__.get(DIGEST_MEMO)
+        if memo is None:
+            assert_complete(self)
+            memo = digest_strings([
+                str(self.name),
+                str(self.startaddr),
+                str(self.endaddr),
+                self.rettype.digest() if self.rettype is not None else "None",
+                str(self.variadic)
+            ] + [ param.digest() for param in self.params ] + [ "|" ] + [ var.digest() for var in self.vars ])
+            self.__dict__[DIGEST_MEMO] = memo
+        return memo
+
+    def __getstate__(self):
+        state = state_without_hash_memo(self)
+        state.pop(PC_INDEX_MEMO, None)
+        return state
+
+    @memoized_hash
     def __hash__(self):
         return hash((self.startaddr, self.endaddr, self.rettype, tuple(self.params), tuple(self.vars), self.variadic))
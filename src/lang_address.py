@@ -1,3 +1,4 @@
+from hashcons import *
 
 class AddressType:
     ABSOLUTE = 0
@@ -38,6 +39,51 @@ class AddressType:
     def unknown_location(addrtype):
         return addrtype in [ AddressType.UNKNOWN, AddressType.EXTERNAL ]
 
+# Base class of compact, immutable value records (addresses, ranges, varnodes).
+# Attributes are stored in __slots__ rather than a per-instance dict, and are only
+# set by __init__ (through object.__setattr__): assigning to them afterwards raises.
+class ImmutableRecord(object):
+    __slots__ = ("_hash",) # the cached hash, set on first use by __hash__() of subclasses
+
+    # {attribute -> value} used when unpickling a state that lacks the attribute
+    _defaults = {}
+    # attributes that are derived from the others, and aren't pickled
+    _transient = ("_hash",)
+
+    # the names of this record's attributes (the slots of the class hierarchy), in declaration order
+    @classmethod
+    def _fields(cls):
+        fields = cls.__dict__.get("_record_fields")
+        if fields is None:
+            fields = []
+            for klass in reversed(cls.__mro__):
+                for name in klass.__dict__.get("__slots__", ()):
+                    if name != "__weakref__" and name not in cls._transient and name not in fields:
+                        fields.append(name)
+            fields = tuple(fields)
+            cls._record_fields = fields
+        return fields
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Cannot set attribute '{}' of immutable {}".format(name, type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError("Cannot delete attribute '{}' of immutable {}".format(name, type(self).__name__))
+
+    def __getstate__(self):
+        return tuple([ getattr(self, name, None) for name in self._fields() ])
+
+    # accepts the tuple state of __getstate__(), or the dict state pickled by the former dict-based classes
+    def __setstate__(self, state):
+        for name in self._transient:
+            object.__setattr__(self, name, None)
+        if isinstance(state, dict):
+            for name in self._fields():
+                object.__setattr__(self, name, state.get(name, self._defaults.get(name)))
+        else:
+            for name, value in zip(self._fields(), state):
+                object.__setattr__(self, name, value)
+
 # every address has an address "region" which determines whether it can
 # be compared / overlapped with another address
 class AddressRegion(object):
@@ -172,9 +218,26 @@ class AddressRegionAbsolute(AddressRegion):
     def __hash__(self):
         return hash(self.addrtype)
 
-class Address(object):
+class Address(ImmutableRecord):
+    __slots__ = ("addrtype", "__weakref__")
+
     def __init__(self, addrtype):
-        self.addrtype = addrtype
+        object.__setattr__(self, "_hash", None)
+        object.__setattr__(self, "addrtype", addrtype)
+
+    # Get the interned (shared) address of the given constructor arguments.
+    # Structurally equal addresses built by intern() are the same object.
+    @classmethod
+    def intern(cls, *args):
+        return intern_value((cls,) + args, lambda: cls(*args))
+
+    # the constructor arguments of this address
+    def _intern_args(self):
+        return ()
+
+    # unpickled addresses are interned
+    def __reduce__(self):
+        return (intern_address, (type(self), self._intern_args()))
 
     def get_addrtype(self):
         return self.addrtype
@@ -224,9 +287,11 @@ class Address(object):
         return hash(self.addrtype)
 
 class AbsoluteAddress(Address):
+    __slots__ = ("addr",)
+
     def __init__(self, addr):
         super(AbsoluteAddress, self).__init__(addrtype=AddressType.ABSOLUTE)
-        self.addr = addr
+        object.__setattr__(self, "addr", addr)
 
     def get_region(self):
         return AddressRegionAbsolute()
@@ -234,11 +299,14 @@ class AbsoluteAddress(Address):
     def space_offset(self):
         return self.addr
 
+    def _intern_args(self):
+        return (self.addr,)
+
     def add_const(self, n):
-        return AbsoluteAddress(self.addr + n)
+        return AbsoluteAddress.intern(self.addr + n)
 
     def add_addr(self, other):
-        return AbsoluteAddress(self.addr + other.addr)
+        return AbsoluteAddress.intern(self.addr + other.addr)
 
     def distance(self, addr):
         return addr.addr - self.addr
@@ -260,40 +328,56 @@ class AbsoluteAddress(Address):
         return self.addr >= addr.addr
 
     def __eq__(self, addr):
-        return self.addr == addr.addr
+        return self is addr or self.addr == addr.addr
 
     def __str__(self):
         return "<{}:{:#x}>".format(AddressType.to_string(self.addrtype), self.addr)
 
     def __hash__(self):
-        return hash((self.addrtype, self.addr))
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash((self.addrtype, self.addr)))
+        return self._hash
 
 class RegisterAddress(Address):
+    __slots__ = ("register", "byte_offset")
+    _defaults = { "byte_offset": 0 }
+
     def __init__(self, register, byte_offset=0):
         super(RegisterAddress, self).__init__(addrtype=AddressType.REGISTER)
-        self.register = register
-        self.byte_offset = byte_offset # the byte offset "within" the register storage
+        object.__setattr__(self, "register", register)
+        object.__setattr__(self, "byte_offset", byte_offset) # the byte offset "within" the register storage
 
     def get_region(self):
         return AddressRegionRegister(self)
 
+    @classmethod
+    def intern(cls, register, byte_offset=0):
+        return super(RegisterAddress, cls).intern(register, byte_offset)
+
+    def _intern_args(self):
+        return (self.register, self.byte_offset)
+
     def add_const(self, n):
-        return RegisterAddress(self.register, byte_offset=self.byte_offset + n)
+        return RegisterAddress.intern(self.register, self.byte_offset + n)
 
     def __eq__(self, addr):
-        return self.register == addr.register
+        return self is addr or self.register == addr.register
 
     def __str__(self):
         return "<{}:{}>".format(AddressType.to_string(self.addrtype), self.register)
 
     def __hash__(self):
-        return hash((self.addrtype, self.register, self.byte_offset))
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash((self.addrtype, self.register, self.byte_offset)))
+        return self._hash
 
 class RegisterOffsetAddress(Address):
+    __slots__ = ("register", "offset")
+
     def __init__(self, register, offset):
         super(RegisterOffsetAddress, self).__init__(addrtype=AddressType.REGISTER_OFFSET)
-        self.register = register
-        self.offset = offset
+        object.__setattr__(self, "register", register)
+        object.__setattr__(self, "offset", offset)
 
     def get_region(self):
         return AddressRegionRegisterOffset(self.register)
@@ -304,8 +388,11 @@ class RegisterOffsetAddress(Address):
     def get_register(self):
         return self.register
 
+    def _intern_args(self):
+        return (self.register, self.offset)
+
     def add_const(self, n):
-        return RegisterOffsetAddress(self.register, self.offset + n)
+        return RegisterOffsetAddress.intern(self.register, self.offset + n)
 
     def distance(self, addr):
         return addr.offset - self.offset
@@ -327,7 +414,7 @@ class RegisterOffsetAddress(Address):
         return self.offset >= addr.offset
 
     def __eq__(self, addr):
-        return self.register == addr.register and self.offset == addr.offset
+        return self is addr or (self.register == addr.register and self.offset == addr.offset)
 
     def __str__(self):
         negative = self.offset < 0
@@ -336,13 +423,17 @@ class RegisterOffsetAddress(Address):
         return "<{}:reg({}){}{:#x}>".format(AddressType.to_string(self.addrtype), self.register, opstr, offsetstr)
 
     def __hash__(self):
-        return hash((self.addrtype, self.register, self.offset))
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash((self.addrtype, self.register, self.offset)))
+        return self._hash
 
 # offset from a stack frame's base pointer
 class StackAddress(Address):
+    __slots__ = ("offset",)
+
     def __init__(self, offset):
         super(StackAddress, self).__init__(addrtype=AddressType.STACK)
-        self.offset = offset
+        object.__setattr__(self, "offset", offset)
 
     def get_region(self):
         return AddressRegionStack()
@@ -350,8 +441,11 @@ class StackAddress(Address):
     def space_offset(self):
         return self.offset
 
+    def _intern_args(self):
+        return (self.offset,)
+
     def add_const(self, n):
-        return StackAddress(self.offset + n)
+        return StackAddress.intern(self.offset + n)
 
     def distance(self, addr):
         return addr.offset - self.offset
@@ -373,15 +467,19 @@ class StackAddress(Address):
         return self.offset >= addr.offset
 
     def __eq__(self, addr):
-        return self.offset == addr.offset
+        return self is addr or self.offset == addr.offset
 
     def __str__(self):
         return "<{}:{:#x}>".format(AddressType.to_string(self.addrtype), self.offset)
 
     def __hash__(self):
-        return hash((self.addrtype, self.offset))
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash((self.addrtype, self.offset)))
+        return self._hash
 
 class ExternalAddress(Address):
+    __slots__ = ()
+
     def __init__(self):
         super(ExternalAddress, self).__init__(addrtype=AddressType.EXTERNAL)
 
@@ -392,6 +490,8 @@ class ExternalAddress(Address):
         return hash(self.addrtype)
 
 class UnknownAddress(Address):
+    __slots__ = ()
+
     def __init__(self):
         super(UnknownAddress, self).__init__(addrtype=AddressType.UNKNOWN)
 
@@ -402,31 +502,44 @@ class UnknownAddress(Address):
         return hash(self.addrtype)
 
 
+# unpickling entry point of interned addresses (see Address.__reduce__)
+def intern_address(cls, args):
+    return cls.intern(*args)
+
 # Range includes start, excludes end.
 # start < end
 # start and end addresses must be of the same AddressType.
-class AddressRange(object):
+class AddressRange(ImmutableRecord):
+    __slots__ = ("start", "addrtype", "end", "size")
+
     # start: Address
     # end: Address | None
     # size: int | None
     # provide either end or size
     def __init__(self, start, end=None, size=None):
-        self.start = start
-        self.addrtype = self.start.addrtype
+        object.__setattr__(self, "_hash", None)
+        object.__setattr__(self, "start", start)
+        object.__setattr__(self, "addrtype", start.addrtype)
         assert(AddressType.rangeable(self.addrtype))
         if end:
-            assert(end.addrtype == self.start.addrtype)
-            if start > end:
-                raise Exception("start > end in AddressRange\nstart = {}\nend = {}".format(start, end))
-            self.end = end
-            self.size = self.start.distance(self.end)
+            AddressRange.verify_bounds(start, end)
+            object.__setattr__(self, "end", end)
+            object.__setattr__(self, "size", self.start.distance(self.end))
         elif size:
             assert(size >= 0)
-            self.size = size
-            self.end = start.add_const(size)
+            object.__setattr__(self, "size", size)
+            object.__setattr__(self, "end", start.add_const(size))
         else:
             raise Exception("Must provide 'end' or 'size' attribute to construct AddressRange.")
 
+    # check that [start, end) is a valid range, without building it
+    @staticmethod
+    def verify_bounds(start, end):
+        assert(AddressType.rangeable(start.addrtype))
+        assert(end.addrtype == start.addrtype)
+        if start > end:
+            raise Exception("start > end in AddressRange\nstart = {}\nend = {}".format(start, end))
+
     def does_overlap(self, other):
         overlap = self.get_overlap(other)
         return overlap.does_overlap()
@@ -463,7 +576,7 @@ class AddressRange(object):
         return self.start >= rng.start
 
     def __eq__(self, other):
-        return self.start == other.start and self.end == other.end and self.size == other.size
+        return self is other or (self.start == other.start and self.end == other.end and self.size == other.size)
 
     def __str__(self):
         return "<AddressRange ({},{})>".format(self.start, self.end)
@@ -472,9 +585,11 @@ class AddressRange(object):
         return self.__str__()
 
     def __hash__(self):
-        return hash((self.start, self.end))
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash((self.start, self.end)))
+        return self._hash
 
-class AddressLiveRange(object):
+class AddressLiveRange(ImmutableRecord):
     """
     This class represents the association between an Address (stack location, register, etc.)
     and the PC range that it is considered "alive" for a particular variable.
@@ -489,13 +604,18 @@ class AddressLiveRange(object):
         The address of the PC of the last instruction in the live range.
 
     """
+    __slots__ = ("addr", "startpc", "endpc", "_pc_range")
+    _transient = ImmutableRecord._transient + ("_pc_range",)
+
     def __init__(self, addr=None, startpc=None, endpc=None):
-        self.addr = addr
-        self.startpc = startpc
-        self.endpc = endpc
-        self.pc_range = AddressRange(self.startpc, end=self.endpc) \
-            if self.startpc is not None and self.endpc is not None \
-            else None
+        object.__setattr__(self, "_hash", None)
+        object.__setattr__(self, "addr", addr)
+        object.__setattr__(self, "startpc", startpc)
+        object.__setattr__(self, "endpc", endpc)
+        object.__setattr__(self, "_pc_range", None) # built on first use, see get_pc_range()
+        # the PC range is validated now, even though it's built later
+        if startpc is not None and endpc is not None:
+            AddressRange.verify_bounds(startpc, endpc)
 
     # if startpc & endpc are both None, this range is considered global
     def is_global(self):
@@ -505,7 +625,13 @@ class AddressLiveRange(object):
         return self.addr
 
     def get_pc_range(self):
-        return self.pc_range
+        if self._pc_range is None and self.startpc is not None and self.endpc is not None:
+            object.__setattr__(self, "_pc_range", AddressRange(self.startpc, end=self.endpc))
+        return self._pc_range
+
+    @property
+    def pc_range(self):
+        return self.get_pc_range()
 
     # comparison operators based on where the PC AddressRange starts line up
     def __lt__(self, other):
@@ -530,7 +656,9 @@ class AddressLiveRange(object):
         return self.__str__()
 
     def __hash__(self):
-        return hash((self.startpc, self.endpc, self.addr))
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash((self.startpc, self.endpc, self.addr)))
+        return self._hash
 
 class AddressRangeOverlap(object):
 
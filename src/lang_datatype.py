@@ -1,4 +1,6 @@
 
+from hashcons import *
+
 # enum of "meta types"
 class MetaType(object):
     """
@@ -149,6 +151,10 @@ class DataTypeRecursiveDescent(object):
     def __repr__(self):
         return str(self)
 
+# unpickling entry point of interned datatypes (see DataType.__reduce_ex__)
+def intern_datatype(cls, args):
+    return cls.intern(*args)
+
 class DataType(object):
     """
     The base class for representing a data type.
@@ -172,6 +178,74 @@ class DataType(object):
     def get_size(self):
         return self.size
 
+    # the key of this datatype in the intern table (see hashcons), or None if it can't be interned
+    def _intern_key(self):
+        return None
+
+    # the arguments of the intern() factory of this datatype
+    def _intern_args(self):
+        return ()
+
+    # is this datatype interned (i.e. shared, and never to be mutated)?
+    @staticmethod
+    def is_interned(dtype):
+        key = dtype._intern_key() if isinstance(dtype, DataType) else None
+        return key is not None and is_interned_value(key, dtype)
+
+    # the fields (other than subtypes) that identify this datatype, see digest()
+    def _digest_fields(self):
+        return [ type(self).__name__, str(self.metatype), str(self.size) ]
+
+    # the subtypes of this datatype (DataType | None), see digest()
+    def _digest_subtypes(self):
+        return []
+
+    # A stable (across processes/runs) SHA-256 hex digest of this datatype's structure, computed once.
+    # Pointers to composite types don't include the structure of their basetype (see DataTypePointer),
+    # so recursive types don't recurse. As a guard, a type that is already being digested contributes
+    # a back-reference instead (and digests depending on one aren't memoized).
+    def digest(self):
+        return self._digest_in([])[0]
+
+    # stack: [DataType] (the types being digested, outermost first)
+    # returns (digest, lowest index in the stack referenced by this type or its subtypes)
+    def _digest_in(self, stack):
+        memo = self.__dict__.get(DIGEST_MEMO)
+        if memo is not None:
+            return (memo, len(stack))
+
+        for i, dtype in enumerate(stack):
+            if dtype is self:
+                return ("<ref {}>".format(len(stack) - i), i)
+
+        idx = len(stack)
+        lowest = idx
+        parts = self._digest_fields()
+        stack.append(self)
+        for subtype in self._digest_subtypes():
+            if subtype is None:
+                parts.append("None")
+                continue
+            sub, sublowest = subtype._digest_in(stack)
+            parts.append(sub)
+            lowest = min(lowest, sublowest)
+        stack.pop()
+
+        digest = digest_strings(parts)
+        # a digest that refers back to an enclosing type depends on where the digest started
+        if lowest >= idx:
+            self.__dict__[DIGEST_MEMO] = digest
+        return (digest, lowest)
+
+    def __getstate__(self):
+        return state_without_hash_memo(self)
+
+    # interned datatypes are interned again when unpickled
+    def __reduce_ex__(self, protocol):
+        if DataType.is_interned(self):
+            return (intern_datatype, (type(self), self._intern_args()))
+        return super(DataType, self).__reduce_ex__(protocol)
+
     # by default, assume a primitive type (doesn't reference any other types)
     # override in children
     def is_primitive(self):
@@ -195,6 +269,12 @@ class DataType(object):
         else:
             raise NotImplementedError()
 
+    # Flatten this datatype into a list of (offset, stride, count, primitive type) runs, where a
+    # run stands for count primitives at offset, offset + stride, offset + 2*stride, ...
+    # Unlike flatten(), arrays of primitives aren't expanded element by element.
+    def flatten_runs(self):
+        return [ (off, primitive.get_size(), 1, primitive) for (off, primitive) in self.flatten() ]
+
     # how many layers of "composition" does this type contain?
     # 0 for primitive
     # for composite types, 1 + max composition level of subtypes
@@ -263,11 +343,14 @@ class DataType(object):
     # exact equality
     # override in child classes
     def __eq__(self, other):
-        return self.rough_match(other)
+        return self is other or self.rough_match(other)
 
     def __str__(self):
         pass # implement in children
 
+    # Only the hashes of primitive types are memoized. The resolver fills in composite types
+    # (prototypes, pointers, arrays, structs & unions) after building them, so theirs may change.
+    @memoized_hash
     def __hash__(self):
         return hash((self.metatype, self.size))
 
@@ -304,8 +387,14 @@ class DataTypeFunctionPrototype(DataType):
     def flatten(self):
         return None
 
+    def _digest_fields(self):
+        return super(DataTypeFunctionPrototype, self)._digest_fields() + [ str(self.variadic) ]
+
+    def _digest_subtypes(self):
+        return [ self.rettype ] + list(self.paramtypes if self.paramtypes is not None else [])
+
     def __eq__(self, other):
-        return self.rough_match(other) \
+        return self is other or self.rough_match(other) \
             and self.rettype == other.rettype \
             and self.paramtypes == other.paramtypes \
             and self.variadic == other.variadic
@@ -335,11 +424,25 @@ class DataTypeInt(DataType):
         )
         self.signed = signed
 
+    # the interned (shared) int type of the given size & signedness
+    @staticmethod
+    def intern(size, signed=True):
+        return intern_value((DataTypeInt, size, signed), lambda: DataTypeInt(size=size, signed=signed))
+
+    def _intern_key(self):
+        return (DataTypeInt, self.size, self.signed)
+
+    def _intern_args(self):
+        return (self.size, self.signed)
+
     def is_signed(self):
         return self.signed
 
+    def _digest_fields(self):
+        return super(DataTypeInt, self)._digest_fields() + [ str(self.signed) ]
+
     def __eq__(self, other):
-        return self.rough_match(other) and self.signed == other.signed
+        return self is other or (self.rough_match(other) and self.signed == other.signed)
 
     def __str__(self):
         s = ""
@@ -352,6 +455,7 @@ class DataTypeInt(DataType):
             s += "int" + str(self.size)
         return s
 
+    @memoized_hash
     def __hash__(self):
         return hash((self.metatype, self.size, self.signed))
 
@@ -366,9 +470,21 @@ class DataTypeFloat(DataType):
             size=size
         )
 
+    # the interned (shared) float type of the given size
+    @staticmethod
+    def intern(size):
+        return intern_value((DataTypeFloat, size), lambda: DataTypeFloat(size=size))
+
+    def _intern_key(self):
+        return (DataTypeFloat, self.size)
+
+    def _intern_args(self):
+        return (self.size,)
+
     def __str__(self):
         return "float" + str(self.size)
 
+    @memoized_hash
     def __hash__(self):
         return hash((self.metatype, self.size))
 
@@ -383,9 +499,21 @@ class DataTypeUndefined(DataType):
             size=size
         )
 
+    # the interned (shared) undefined type of the given size
+    @staticmethod
+    def intern(size):
+        return intern_value((DataTypeUndefined, size), lambda: DataTypeUndefined(size=size))
+
+    def _intern_key(self):
+        return (DataTypeUndefined, self.size)
+
+    def _intern_args(self):
+        return (self.size,)
+
     def __str__(self):
         return "undefined" + str(self.size)
 
+    @memoized_hash
     def __hash__(self):
         return hash((self.metatype, self.size))
 
@@ -398,10 +526,19 @@ class DataTypeVoid(DataType):
             metatype=MetaType.VOID,
             size=0
         )
+
+    # the interned (shared) void type
+    @staticmethod
+    def intern():
+        return intern_value((DataTypeVoid,), DataTypeVoid)
+
+    def _intern_key(self):
+        return (DataTypeVoid,)
     
     def __str__(self):
         return "void"
 
+    @memoized_hash
     def __hash__(self):
         return hash((self.metatype, self.size))
 
@@ -421,6 +558,32 @@ class DataTypePointer(DataType):
         )
         self.basetype = basetype
 
+    # The interned (shared) pointer type to the given basetype, if the basetype is itself interned.
+    # Otherwise (i.e. pointers to composite types, which may be self-referential), returns None.
+    @staticmethod
+    def intern(basetype, size):
+        if not DataType.is_interned(basetype):
+            return None
+        return intern_value((DataTypePointer, id(basetype), size), lambda: DataTypePointer(basetype=basetype, size=size))
+
+    def _intern_key(self):
+        return (DataTypePointer, id(self.basetype), self.size)
+
+    # does the digest of this pointer include only the fields of the basetype, rather than its structure?
+    # true for composite basetypes, which cuts the cycles of recursive types (i.e. a struct with a pointer to itself)
+    def _digest_shallow(self):
+        return self.basetype is not None and self.basetype.get_metatype() in [ MetaType.STRUCT, MetaType.UNION, MetaType.FUNCTION_PROTOTYPE ]
+
+    def _digest_fields(self):
+        fields = super(DataTypePointer, self)._digest_fields()
+        return fields + self.basetype._digest_fields() if self._digest_shallow() else fields
+
+    def _digest_subtypes(self):
+        return [] if self._digest_shallow() else [ self.basetype ]
+
+    def _intern_args(self):
+        return (self.basetype, self.size)
+
     def is_primitive(self):
         return True
 
@@ -428,7 +591,7 @@ class DataTypePointer(DataType):
         return False
 
     def __eq__(self, other):
-        return self.rough_match(other) and self.basetype.rough_match(other.basetype)
+        return self is other or (self.rough_match(other) and self.basetype.rough_match(other.basetype))
 
     def __str__(self):
         return str(self.basetype) + " *"
@@ -482,6 +645,12 @@ class DataTypeArray(DataType):
     def get_basetype(self):
         return self.basetype
 
+    def _digest_fields(self):
+        return super(DataTypeArray, self)._digest_fields() + [ str(self.dimensions) ]
+
+    def _digest_subtypes(self):
+        return [ self.basetype ]
+
     def get_num_elements(self):
         return DataTypeArray.compute_flat_length(self.dimensions)
 
@@ -529,6 +698,21 @@ class DataTypeArray(DataType):
             for (off, primitive) in self.basetype.flatten():
                 yield (offset + off, primitive)
 
+    def flatten_runs(self):
+        num_elements = self.get_num_elements()
+        elem_size = self.basetype.get_size()
+        base_runs = self.basetype.flatten_runs()
+
+        # if an element is a single run of densely packed primitives,
+        # then the whole array is one run of those primitives
+        if len(base_runs) == 1:
+            (off, stride, count, primitive) = base_runs[0]
+            if off == 0 and stride > 0 and stride == primitive.get_size() and stride * count == elem_size:
+                return [ (0, stride, count * num_elements, primitive) ] if num_elements > 0 else []
+
+        # otherwise, repeat the runs of the basetype for each element
+        return [ (i * elem_size + off, stride, count, primitive) for i in range(0, num_elements) for (off, stride, count, primitive) in base_runs ]
+
     # get the component type that starts at a given offset, possibly restricting size
     # int -> DescentRecord | None
     def get_component_type_at_offset(self, offset, size=None):
@@ -575,7 +759,7 @@ class DataTypeArray(DataType):
         )
 
     def __eq__(self, other):
-        return self.rough_match(other) \
+        return self is other or self.rough_match(other) \
             and self.basetype == other.basetype \
             and self.dimensions == other.dimensions
 
@@ -609,6 +793,12 @@ class DataTypeStruct(DataType):
     def get_number_members(self):
         return len(self.membertype_offsets)
 
+    def _digest_fields(self):
+        return super(DataTypeStruct, self)._digest_fields() + [ str(self.name), str(self.get_member_offsets()) ]
+
+    def _digest_subtypes(self):
+        return self.get_membertypes()
+
     def _resolve_size(self):
         if self.size is None and self.membertype_offsets is not None: # if explicit size not provided, calculate on our own
             offset, memtype = self.membertype_offsets[-1]
@@ -646,7 +836,7 @@ class DataTypeStruct(DataType):
 
             if padding > 0:
                 padding_offset = offset + memtype.size
-                padding_dtype = DataTypeUndefined(size=padding)
+                padding_dtype = DataTypeUndefined.intern(padding)
                 membertype_offsets.append((padding_offset, padding_dtype))
 
         return membertype_offsets
@@ -657,6 +847,9 @@ class DataTypeStruct(DataType):
             for (off, primitive) in memtype.flatten():
                 yield (offset + off, primitive)
 
+    def flatten_runs(self):
+        return [ (offset + off, stride, count, primitive) for (offset, memtype) in self.membertype_offsets for (off, stride, count, primitive) in memtype.flatten_runs() ]
+
     # get the component type that starts at a given offset, possibly restricting size
     # the component could be padding (undefined type)
     # int -> DescentRecord | None
@@ -696,7 +889,7 @@ class DataTypeStruct(DataType):
         ])
 
     def __eq__(self, other):
-        return self.rough_match(other) and self.members_equal(other)
+        return self is other or (self.rough_match(other) and self.members_equal(other))
 
     def __str__(self):
         s = "<STRUCT "
@@ -731,6 +924,12 @@ class DataTypeUnion(DataType):
         if self.size is None and self.membertypes is not None: # if explicit size not provided, calculate on our own
             self.size = max([ mem.get_size() for mem in self.membertypes ])
 
+    def _digest_fields(self):
+        return super(DataTypeUnion, self)._digest_fields() + [ str(self.name) ]
+
+    def _digest_subtypes(self):
+        return list(self.membertypes)
+
     # by default, assume a primitive type (doesn't reference any other types)
     # override in children
     def is_primitive(self):
@@ -747,7 +946,7 @@ class DataTypeUnion(DataType):
     # union contains non-deterministic primitive decomposition
     # just return an "undefined" type equal to the size of the union
     def flatten(self):
-        yield (0, DataTypeUndefined(size=self.size))
+        yield (0, DataTypeUndefined.intern(self.size))
 
     # offset = the offset into this datatype to find match for
     # offset_to_subtype = the actual offset of the direct subtype in recursion
@@ -787,7 +986,7 @@ class DataTypeUnion(DataType):
         ])
 
     def __eq__(self, other):
-        return self.rough_match(other) and self.members_equal(other)
+        return self is other or (self.rough_match(other) and self.members_equal(other))
 
     def __str__(self):
         s = "<UNION "
@@ -1,6 +1,10 @@
 from lang import *
 from lang_address import *
 from lang_datatype import *
+from bisect import bisect_right
+
+# the attribute of a Variable's or Function's __dict__ holding its PC index of live ranges
+PC_INDEX_MEMO = "_pc_index"
 
 class Variable(object):
     def __init__(self, name=None, dtype=None, liveranges=None, param=False, function=None):
@@ -66,27 +70,57 @@ class Variable(object):
     def get_parent_function(self):
         return self.function
 
+    # The PC index of this variable's live ranges, built on first use (live ranges are assigned while
+    # parsing, and don't change once a PC is looked up): the live ranges with a PC range, sorted by start PC,
+    # as parallel lists of (start PC offsets, end PC offsets, running max of the ends, live ranges).
+    # PC ranges are absolute, so the offsets of their start & end Addresses are comparable.
+    def _get_pc_index(self):
+        index = self.__dict__.get(PC_INDEX_MEMO)
+        if index is None:
+            items = []
+            for liverange in self.liveranges:
+                pc_range = liverange.get_pc_range()
+                if pc_range is not None and pc_range.get_start().get_addrtype() == AddressType.ABSOLUTE:
+                    items.append((pc_range.get_start().space_offset(), pc_range.get_end().space_offset(), len(items), liverange))
+            items.sort(key=lambda item: (item[0], item[2]))
+
+            max_ends = []
+            for (start, end, i, liverange) in items:
+                max_ends.append(max(end, max_ends[-1]) if max_ends else end)
+            index = (
+                [ item[0] for item in items ],
+                [ item[1] for item in items ],
+                max_ends,
+                [ (item[2], item[3]) for item in items ]
+            )
+            self.__dict__[PC_INDEX_MEMO] = index
+        return index
+
+    # Given a PC Address, find the AddressLiveRange whose PC range contains it (or None).
+    # Binary search over the live ranges sorted by start PC: only the ranges starting at or before
+    # the PC, and not all ending before it, are checked. Live ranges of a variable don't overlap,
+    # so this is usually a single check. If they do, the first matching live range is returned.
     def get_liverange_at_pc(self, pc):
-        for liverange in self.liveranges:
-            if liverange.get_pc_range().contains(pc):
-                return liverange
-        return None
-
-    # Given a PC Address, find the Address of the AddressLiveRange associated with the containing PC range (or None).
-    def get_address_at_pc(self, pc):
-        liverange = self.get_liverange_at_pc(pc)
-        return liverange.get_addr() if liverange else None
+        if pc.get_addrtype() != AddressType.ABSOLUTE:
+            return None
+        (starts, ends, max_ends, liveranges) = self._get_pc_index()
+        pc = pc.space_offset()
+
+        found = None
+        i = bisect_right(starts, pc) - 1
+        while i >= 0 and max_ends[i] > pc:
+            if pc < ends[i] and (found is None or liveranges[i][0] < found[0]):
+                found = liveranges[i]
+            i -= 1
+        return found[1] if found is not None else None
 
     # for the given PC, find the Address where this Variable resides (or None).
+    # A global variable resides at the same Address for all PCs.
     def get_address_at_pc(self, pc):
         if self.is_global():
-            return self.liveranges[0].get_addr()
-        
-        for liverange in self.liveranges:
-            if liverange.get_pc_range().contains(pc):
-                return liverange.get_addr()
-
-        return None
+            return self.liveranges[0].get_addr() if self.liveranges else None
+        liverange = self.get_liverange_at_pc(pc)
+        return liverange.get_addr() if liverange else None
 
     # returns a list of Varnode objects corresponding to each of its
     # "instantiations"/liveranges.
@@ -100,20 +134,44 @@ class Variable(object):
     def select_primitive_varnodes(self, varnode_cond=None):
         return sum([ varnode.select_primitive_varnodes(varnode_cond=varnode_cond) for varnode in self.get_varnodes() ], [])
 
+    # A stable SHA-256 hex digest of this variable's content, computed once.
+    # (The parent function isn't part of the digest, the function's digest includes its variables.)
+    def digest(self):
+        memo = self.__dict__.get(DIGEST_MEMO)
+        if memo is None:
+            assert_complete(self)
+            memo = digest_strings([
+                str(self.name),
+                self.dtype.digest() if self.dtype is not None else "None",
+                str(self.liveranges),
+                str(self.param)
+            ])
+            self.__dict__[DIGEST_MEMO] = memo
+        return memo
+
+    def __getstate__(self):
+        state = state_without_hash_memo(self)
+        state.pop(PC_INDEX_MEMO, None)
+        return state
+
     def __str__(self):
         lbl = "PARAM" if self.is_param() else "VAR"
         return "<{} {} :: {} @ {}>".format(lbl, self.name, self.dtype, self.liveranges)
 
+    @memoized_hash
     def __hash__(self):
         return hash((self.dtype, tuple(self.liveranges), self.param))
 
 # the most atomic form of a variable-like entity
 # a datatype, address, and pc range that indicates its lifetime
-class Varnode(object):
+class Varnode(ImmutableRecord):
+    __slots__ = ("dtype", "liverange", "var")
+
     def __init__(self, dtype, liverange, var=None):
-        self.dtype = dtype
-        self.liverange = liverange
-        self.var = var # the Variable that "spawned" this Varnode
+        object.__setattr__(self, "_hash", None)
+        object.__setattr__(self, "dtype", dtype)
+        object.__setattr__(self, "liverange", liverange)
+        object.__setattr__(self, "var", var) # the Variable that "spawned" this Varnode
 
     # () -> AddressLiveRange
     def get_liverange(self):
@@ -143,6 +201,56 @@ class Varnode(object):
     def get_size(self):
         return self.get_datatype().get_size()
 
+    # A Varnode is a run of a single element (see StridedVarnode)
+
+    # () -> bool
+    def is_strided(self):
+        return False
+
+    # the number of elements
+    # () -> int
+    def get_count(self):
+        return 1
+
+    # the distance (in bytes) between the starts of consecutive elements
+    # () -> int
+    def get_stride(self):
+        return self.get_size()
+
+    # () -> int
+    def get_element_size(self):
+        return self.get_size()
+
+    # () -> DataType
+    def get_element_datatype(self):
+        return self.get_datatype()
+
+    # are the elements packed without gaps?
+    # () -> bool
+    def is_dense(self):
+        return True
+
+    # int -> Varnode
+    def get_element(self, i):
+        if i != 0:
+            raise IndexError("Varnode element index out of range: {}".format(i))
+        return self
+
+    # the [start, end) indices of the elements that overlap the bytes [start, end)
+    # given as offsets from the address of this Varnode
+    # (int, int) -> (int, int)
+    def get_element_range(self, start, end):
+        return (0, 1) if start < self.get_size() and end > 0 else (0, 0)
+
+    # a live range at an offset from this Varnode's address, with the same PC range
+    # int -> AddressLiveRange
+    def _make_liverange_at_offset(self, off):
+        addr = self.get_addr().add_const(off)
+        pc_range = self.get_pc_range()
+        startpc = pc_range.get_start() if pc_range is not None else None
+        endpc = pc_range.get_end() if pc_range is not None else None
+        return AddressLiveRange(addr=addr, startpc=startpc, endpc=endpc)
+
     # flattens this Varnode to Varnodes of only primitive datatypes
     # () -> [Varnode]
     def flatten(self):
@@ -151,17 +259,30 @@ class Varnode(object):
 
         varnodes = []
         for off, primtype in dtype_flattened:
-            addr = self.get_addr().add_const(off)
-            pc_range = self.get_pc_range()
-            startpc = pc_range.get_start() if pc_range is not None else None
-            endpc = pc_range.get_end() if pc_range is not None else None
-            liverange = AddressLiveRange(addr=addr, startpc=startpc, endpc=endpc)
+            liverange = self._make_liverange_at_offset(off)
             varnodes.append(Varnode(primtype, liverange, var=self.var))
 
         return varnodes
 
+    # flattens this Varnode to Varnodes of only primitive datatypes, keeping runs of
+    # consecutive primitives of an array as single StridedVarnodes
+    # () -> [Varnode | StridedVarnode]
+    def flatten_strided(self):
+        # [(offset: int, stride: int, count: int, primtype: DataType)]
+        dtype_runs = self.dtype.flatten_runs()
+
+        varnodes = []
+        for off, stride, count, primtype in dtype_runs:
+            liverange = self._make_liverange_at_offset(off)
+            if count == 1:
+                varnodes.append(Varnode(primtype, liverange, var=self.var))
+            else:
+                varnodes.append(StridedVarnode(primtype, liverange, stride, count, var=self.var))
+
+        return varnodes
+
     def select_primitive_varnodes(self, varnode_cond=None):
-        return [ varnode for varnode in self.flatten() if varnode_cond is None or varnode_cond(varnode) ]
+        return [ varnode for varnode in self.flatten_strided() if varnode_cond is None or varnode_cond(varnode) ]
             
 
     # # builds a VarnodeCompareRecord|None from the infomation contained in the
@@ -183,7 +304,9 @@ class Varnode(object):
     #         else Varnode.from_variable_at_pc(var.get_datatype(), var.get_parent_function().get_start_pc())
 
     def __hash__(self):
-        return hash((self.dtype, self.liverange))
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash((self.dtype, self.liverange)))
+        return self._hash
 
     def __str__(self):
         return "<Varnode address={} datatype={}>".format(
@@ -192,4 +315,69 @@ class Varnode(object):
         )
 
     def __repr__(self):
-        return str(self)
\ No newline at end of file
+        return str(self)
+
+# a run of count primitive Varnodes of the same datatype, starting at the address of the
+# liverange and stride bytes apart (e.g. the elements of an array of primitives).
+# Stands for all the elements at once: elements are only built when asked for.
+class StridedVarnode(Varnode):
+    __slots__ = ("stride", "count")
+
+    def __init__(self, dtype, liverange, stride, count, var=None):
+        Varnode.__init__(self, dtype, liverange, var=var)
+        object.__setattr__(self, "stride", stride)
+        object.__setattr__(self, "count", count)
+
+    def is_strided(self):
+        return True
+
+    def get_count(self):
+        return self.count
+
+    def get_stride(self):
+        return self.stride
+
+    def get_element_size(self):
+        return self.dtype.get_size()
+
+    # the number of bytes spanned by the run
+    def get_size(self):
+        return self.stride * (self.count - 1) + self.get_element_size()
+
+    def is_dense(self):
+        return self.stride == self.get_element_size()
+
+    # builds the Varnode of the i-th element
+    # int -> Varnode
+    def get_element(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError("StridedVarnode element index out of range: {}".format(i))
+        return Varnode(self.dtype, self._make_liverange_at_offset(i * self.stride), var=self.var)
+
+    def get_element_range(self, start, end):
+        lo = max(0, (start - self.get_element_size()) // self.stride + 1)
+        hi = min(self.count, -(-end // self.stride))
+        return (lo, max(lo, hi))
+
+    # () -> [Varnode]
+    def expand(self):
+        return [ self.get_element(i) for i in range(0, self.count) ]
+
+    def flatten(self):
+        return self.expand()
+
+    def flatten_strided(self):
+        return [ self ]
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash((self.dtype, self.liverange, self.stride, self.count)))
+        return self._hash
+
+    def __str__(self):
+        return "<StridedVarnode address={} datatype={} stride={} count={}>".format(
+            self.get_addr(),
+            self.get_datatype(),
+            self.stride,
+            self.count
+        )
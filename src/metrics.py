@@ -4,6 +4,7 @@ from typing import Callable
 from lang import *
 from compare_unoptimized import *
 from cache import cache
+from varnode_table import *
 
 class Metric(object):
     
@@ -141,7 +142,7 @@ def make_metrics() -> List[MetricsGroup]:
     varnodes_group = MetricsGroup("varnodes", "Varnode recovery")
     varnodes_group.mk_add_metric(
         "Ground truth varnodes",
-        lambda cmp: len(varnodes_truth(cmp))
+        lambda cmp: count_base_varnodes(cmp)
     )
 
     for compare_level in VarnodeCompareLevel.range():
@@ -167,7 +168,7 @@ def make_metrics() -> List[MetricsGroup]:
 
         group.mk_add_metric(
             "Ground truth varnodes".format(metatype_str),
-            lambda cmp, metatype=metatype: len(varnodes_truth_metatype(cmp, metatype))
+            lambda cmp, metatype=metatype: count_base_varnodes(cmp, metatypes=(metatype,))
         )
 
         for compare_level in VarnodeCompareLevel.range():
@@ -192,14 +193,14 @@ def make_metrics() -> List[MetricsGroup]:
 
     primitive_varnodes_group.mk_add_metric(
         "Ground truth varnodes",
-        lambda cmp: len(varnodes_truth(cmp, primitive=True))
+        lambda cmp: count_base_varnodes(cmp, primitive=True)
     )
 
     for compare_level in VarnodeCompareLevel.range():
         compare_level_str = VarnodeCompareLevel.to_string(compare_level) if compare_level != VarnodeCompareLevel.NO_MATCH else "NO MATCH"
         primitive_varnodes_group.mk_add_metric(
             "Varnodes matched @ level {}".format(compare_level_str),
-            lambda cmp, compare_level=compare_level: len(varnode_compare_records_matched_at_level(cmp, compare_level, primitive=True))
+            lambda cmp, compare_level=compare_level: count_varnodes_matched_at_level(cmp, compare_level, primitive=True)
         )
 
     primitive_varnodes_group.mk_add_metric(
@@ -218,18 +219,14 @@ def make_metrics() -> List[MetricsGroup]:
 
         group.mk_add_metric(
             "Ground truth varnodes",
-            lambda cmp, metatype=metatype: len(varnodes_truth_metatype(cmp, metatype, primitive=True))
+            lambda cmp, metatype=metatype: count_base_varnodes(cmp, primitive=True, metatypes=(metatype,))
         )
 
         for compare_level in VarnodeCompareLevel.range():
             compare_level_str = VarnodeCompareLevel.to_string(compare_level) if compare_level != VarnodeCompareLevel.NO_MATCH else "NO MATCH"
             group.mk_add_metric(
                 "Varnodes matched @ level {}".format(compare_level_str, metatype_str),
-                lambda cmp, metatype=metatype, compare_level=compare_level: len([
-                    record for record in
-                    varnode_compare_records_matched_at_level(cmp, compare_level, primitive=True)
-                    if record.get_varnode().get_datatype().get_metatype() == metatype
-                ])
+                lambda cmp, metatype=metatype, compare_level=compare_level: count_varnodes_matched_at_level_metatype(cmp, compare_level, metatype, primitive=True)
             )
 
         group.mk_add_metric(
@@ -362,14 +359,28 @@ def select_comparable_varnodes(cmp: UnoptimizedProgramInfoCompare2, left: bool =
     _cmp = cmp if left else cmp.flip()
     return [ record.get_varnode() for record in select_comparable_varnode_compare_records(_cmp, primitive=primitive) ]
 
+# the VarnodeTable of either the left or right program info objects
+def varnode_table(cmp: UnoptimizedProgramInfoCompare2, left: bool = True) -> VarnodeTable:
+    return get_varnode_table(cmp.get_left() if left else cmp.get_right())
+
+# the number of (possibly primitive) varnodes that match the base filters, optionally restricted to metatypes
+def count_base_varnodes(cmp: UnoptimizedProgramInfoCompare2, left: bool = True, primitive: bool = False, metatypes: List[int] = None) -> int:
+    table = varnode_table(cmp, left=left)
+    mask = table.select_base(primitive=primitive)
+    if metatypes is not None:
+        mask &= table.select(primitive=None, metatypes=metatypes)
+    return table.count_varnodes(mask)
+
 # --------------------- BYTES --------------------------
 # Ground-truth data bytes
 def bytes_truth(cmp: UnoptimizedProgramInfoCompare2) -> int:
-    return sum([ varnode.get_size() for varnode in varnodes_truth(cmp) ])
+    table = varnode_table(cmp, left=True)
+    return table.count_bytes(table.select_base())
 
 # Decompiler data bytes
 def bytes_decomp(cmp: UnoptimizedProgramInfoCompare2) -> int:
-    return sum([ varnode.get_size() for varnode in varnodes_decomp(cmp) ])
+    table = varnode_table(cmp, left=False)
+    return table.count_bytes(table.select_base())
 
 # Found bytes (in ground-truth & decompiler)
 def bytes_found(cmp: UnoptimizedProgramInfoCompare2) -> int:
@@ -449,9 +460,29 @@ def varnode_compare_records_matched_at_level(cmp: UnoptimizedProgramInfoCompare2
 def varnodes_extraneous(cmp: UnoptimizedProgramInfoCompare2, primitive: bool = False) -> List[Varnode]:
     return varnodes_missed(cmp.flip(), primitive=primitive)
 
+# the number of (primitive) elements of the varnodes: a StridedVarnode counts once per element
+def count_varnodes(varnodes: Iterator[Varnode]) -> int:
+    return sum([ varnode.get_count() for varnode in varnodes ])
+
+# the number of (primitive) elements of the records' varnodes that are matched at one of the levels
+def _count_varnodes_match_levels(varnode_cmp_records: List[VarnodeCompareRecord], levels: List[int]) -> int:
+    return sum([ record.get_level_counts().get(level, 0) for record in varnode_cmp_records for level in levels ])
+
+def count_varnodes_matched_at_level(cmp: UnoptimizedProgramInfoCompare2, level: int, primitive: bool = False) -> int:
+    return _count_varnodes_match_levels(select_comparable_varnode_compare_records(cmp, primitive=primitive), [level])
+
+def count_varnodes_matched_at_above_level(cmp: UnoptimizedProgramInfoCompare2, level: int, primitive: bool = False) -> int:
+    return _count_varnodes_match_levels(select_comparable_varnode_compare_records(cmp, primitive=primitive), range(level, VarnodeCompareLevel.MATCH + 1))
+
+# the average compare level over the (primitive) elements of the records' varnodes
 def _varnodes_avg_compare_level(varnode_cmp_records: List[VarnodeCompareRecord]) -> float:
-    compare_levels = [ record.get_compare_level() for record in varnode_cmp_records ]
-    return mean(compare_levels) if len(compare_levels) > 0 else None
+    total = 0
+    count = 0
+    for record in varnode_cmp_records:
+        for level, num in record.get_level_counts().items():
+            total += level * num
+            count += num
+    return total / count if count > 0 else None
 
 # map each VarnodeCompareLevel into its integer encoding and find the average across all compare records
 def varnodes_avg_compare_level(cmp: UnoptimizedProgramInfoCompare2, primitive: bool = False) -> float:
@@ -467,6 +498,9 @@ def _select_comparable_varnodes_metatype(cmp: UnoptimizedProgramInfoCompare2, me
 def _select_comparable_varnode_compare_records_metatype(cmp: UnoptimizedProgramInfoCompare2, metatype: int, primitive: bool = False) -> List[VarnodeCompareRecord]:
     return [ record for record in select_comparable_varnode_compare_records(cmp, primitive=primitive) if record.get_varnode().get_datatype().get_metatype() == metatype ]
 
+def count_varnodes_matched_at_level_metatype(cmp: UnoptimizedProgramInfoCompare2, level: int, metatype: int, primitive: bool = False) -> int:
+    return _count_varnodes_match_levels(_select_comparable_varnode_compare_records_metatype(cmp, metatype, primitive=primitive), [level])
+
 # Ground-truth varnodes w/ metatype
 def varnodes_truth_metatype(cmp: UnoptimizedProgramInfoCompare2, metatype: int, primitive: bool = False) -> List[Varnode]:
     return _select_comparable_varnodes_metatype(cmp, metatype, left=True, primitive=primitive)
@@ -611,9 +645,9 @@ def _mk_metrics(cmp: UnoptimizedProgramInfoCompare2) -> dict:
     }
 
     varnodes_group = {}
-    _varnodes_truth = len(varnodes_truth(cmp))
+    _varnodes_truth = count_base_varnodes(cmp)
     varnodes_group["varnodes - ground truth"] = _varnodes_truth
-    varnodes_group["varnodes - decompiler"] = len(varnodes_decomp(cmp))
+    varnodes_group["varnodes - decompiler"] = count_base_varnodes(cmp, left=False)
     for level in range(VarnodeCompareLevel.NO_MATCH, VarnodeCompareLevel.MATCH + 1):
         varnodes_group["varnodes matched @ or above {}".format(VarnodeCompareLevel.to_string(level))] = len(varnode_compare_records_matched_at_above_level(cmp, level))
     varnodes_group["varnodes missed"] = len(varnodes_missed(cmp))
@@ -622,14 +656,14 @@ def _mk_metrics(cmp: UnoptimizedProgramInfoCompare2) -> dict:
     METRICS["VARNODES"] = varnodes_group
 
     primitives_group = {}
-    _primitives_truth = len(varnodes_truth(cmp, primitive=True))
+    _primitives_truth = count_base_varnodes(cmp, primitive=True)
     primitives_group["primitive varnodes - ground truth"] = _primitives_truth
-    primitives_group["primitive varnodes - decompiler"] = len(varnodes_decomp(cmp, primitive=True))
+    primitives_group["primitive varnodes - decompiler"] = count_base_varnodes(cmp, left=False, primitive=True)
     for level in range(VarnodeCompareLevel.NO_MATCH, VarnodeCompareLevel.MATCH + 1):
-        primitives_group["primitive varnodes matched @ or above {}".format(VarnodeCompareLevel.to_string(level))] = len(varnode_compare_records_matched_at_above_level(cmp, level, primitive=True))
-    primitives_group["primitive varnodes missed"] = len(varnodes_missed(cmp, primitive=True))
-    primitives_group["primitive varnodes extraneous"] = len(varnodes_extraneous(cmp, primitive=True))
-    primitives_group["primitive varnodes match %"] = 100.0 * (len(varnode_compare_records_matched_at_above_level(cmp, VarnodeCompareLevel.MATCH, primitive=True)) / _primitives_truth)
+        primitives_group["primitive varnodes matched @ or above {}".format(VarnodeCompareLevel.to_string(level))] = count_varnodes_matched_at_above_level(cmp, level, primitive=True)
+    primitives_group["primitive varnodes missed"] = count_varnodes_matched_at_level(cmp, VarnodeCompareLevel.NO_MATCH, primitive=True)
+    primitives_group["primitive varnodes extraneous"] = count_varnodes_matched_at_level(cmp.flip(), VarnodeCompareLevel.NO_MATCH, primitive=True)
+    primitives_group["primitive varnodes match %"] = 100.0 * (count_varnodes_matched_at_level(cmp, VarnodeCompareLevel.MATCH, primitive=True) / _primitives_truth)
     METRICS["PRIMITIVE VARNODES"] = primitives_group
 
     # parameters_group = {}
@@ -643,9 +677,9 @@ def _mk_metrics(cmp: UnoptimizedProgramInfoCompare2) -> dict:
 
     for metatype in [MetaType.INT, MetaType.FLOAT, MetaType.POINTER, MetaType.ARRAY, MetaType.STRUCT, MetaType.UNION, MetaType.UNDEFINED]:
         metatype_group = {}
-        truth = len(varnodes_truth_metatype(cmp, metatype))
+        truth = count_base_varnodes(cmp, metatypes=(metatype,))
         metatype_group["(metatype = {}) varnodes - ground truth".format(MetaType.repr(metatype))] = truth
-        metatype_group["(metatype = {}) varnodes - decompiler".format(MetaType.repr(metatype))] = len(varnodes_decomp_metatype(cmp, metatype))
+        metatype_group["(metatype = {}) varnodes - decompiler".format(MetaType.repr(metatype))] = count_base_varnodes(cmp, left=False, metatypes=(metatype,))
         metatype_group["(metatype = {}) varnodes missed".format(MetaType.repr(metatype))] = len([ record for record in varnode_compare_records_match_levels(cmp, [VarnodeCompareLevel.NO_MATCH]) if record.get_varnode().get_datatype().get_metatype() == metatype ])
 
         aligned = len([ record for record in varnode_compare_records_matched_at_above_level(cmp, VarnodeCompareLevel.ALIGNED) if record.get_varnode().get_datatype().get_metatype() == metatype ])
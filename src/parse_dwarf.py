@@ -71,8 +71,8 @@ class ParseDWARF(object):
             startaddr = endaddr = None
             if pc_range is not None:
                 lowpc, highpc = pc_range
-                startaddr = AbsoluteAddress(lowpc)
-                endaddr = AbsoluteAddress(highpc)
+                startaddr = AbsoluteAddress.intern(lowpc)
+                endaddr = AbsoluteAddress.intern(highpc)
 
             # get basetype ref
             rettyperef = self.get_DIE_key(get_DIE_attr_ref_DIE(die, "DW_AT_type"))
@@ -126,8 +126,8 @@ class ParseDWARF(object):
                 # we consider the default PC range for this variable to be
                 # lowest addr from scope's ranges -> highest addr from scope's ranges
                 _scopestartpc, _scopeendpc = merge_ranges(pc_ranges)
-                scopestartpc = AbsoluteAddress(_scopestartpc)
-                scopeendpc = AbsoluteAddress(_scopeendpc)
+                scopestartpc = AbsoluteAddress.intern(_scopestartpc)
+                scopeendpc = AbsoluteAddress.intern(_scopeendpc)
 
             liveranges = get_DIE_liveranges(
                 die,
@@ -378,9 +378,12 @@ class ParseDWARF(object):
         proginfo = self.db.resolve_root()
 
         # for local variables with 'static' keyword, move these to globals
+        # (this changes the content of the program & functions, so nothing may have hashed them yet)
         for ref in self.static_local_refs:
             record = self.db.lookup(ref)
             if record and record.obj and record.obj.function:
+                assert_not_memoized(record.obj.function)
+                assert_not_memoized(proginfo)
                 record.obj.function.vars.remove(record.obj)
                 record.obj.function = None
                 proginfo.globals.append(record.obj)
@@ -385,8 +385,8 @@ def get_DIE_liveranges(die, scopestartpc=None, scopeendpc=None):
                 # type(loc) == LocationEntry
                 addr = parse_dwarf_locexpr_addr(die.dwarfinfo, loc.loc_expr)
                 if addr is not None:
-                    startpc = AbsoluteAddress(loc.begin_offset)
-                    endpc = AbsoluteAddress(loc.end_offset)
+                    startpc = AbsoluteAddress.intern(loc.begin_offset)
+                    endpc = AbsoluteAddress.intern(loc.end_offset)
                     liveranges.append(AddressLiveRange(
                         addr=addr,
                         startpc=startpc,
@@ -423,33 +423,33 @@ def parse_dwarf_expr_ops_to_addr(expr_ops):
         # absolute address?
         if expr_op.op_name == "DW_OP_addr":
             addr = expr_op.args[0]
-            return AbsoluteAddress(addr)
+            return AbsoluteAddress.intern(addr)
 
         # base register offset address?
         elif expr_op.op_name == "DW_OP_fbreg":
             offset = expr_op.args[0]
             # TODO: Avoid implicit assumption of x86-64 & RBP here
-            return StackAddress(offset)
+            return StackAddress.intern(offset)
 
         # stored in register?
         elif DW_OP_name2opcode["DW_OP_reg0"] <= expr_op.op <= DW_OP_name2opcode["DW_OP_reg31"]:
             regnum = expr_op.op - DW_OP_name2opcode["DW_OP_reg0"]
-            return RegisterAddress(regnum)
+            return RegisterAddress.intern(regnum)
 
         elif expr_op.op_name == "DW_OP_regx":
             regnum = expr_op.args[0]
-            return RegisterAddress(regnum)
+            return RegisterAddress.intern(regnum)
 
         # offset from a register?
         elif DW_OP_name2opcode["DW_OP_breg0"] <= expr_op.op <= DW_OP_name2opcode["DW_OP_breg31"]:
             regnum = expr_op.op - DW_OP_name2opcode["DW_OP_reg0"]
             offset = expr_op.args[0]
-            return RegisterOffsetAddress(regnum, offset)
+            return RegisterOffsetAddress.intern(regnum, offset)
 
         elif expr_op.op_name == "DW_OP_bregx":
             regnum = expr_op.args[0]
             offset = expr_op.args[1]
-            return RegisterOffsetAddress(regnum, offset)
+            return RegisterOffsetAddress.intern(regnum, offset)
 
         else:
             raise NotImplementedError(expr_ops)
@@ -111,8 +111,8 @@ class ParseGhidra(object):
         # get absolute addresses (as ints) of low and high PCs for function
         startpc, endpc = self.util.get_function_pc_range(fn) # (int, int)
         # translate the raw PC ints to Address objects
-        startaddr = AbsoluteAddress(startpc)
-        endaddr = AbsoluteAddress(endpc)
+        startaddr = AbsoluteAddress.intern(startpc)
+        endaddr = AbsoluteAddress.intern(endpc)
 
         params = self.util.get_highfn_params(highfn) # Iter<VariableInfo>
         paramrefs = [ self.register_obj(v) for v in params ]
@@ -381,15 +381,15 @@ class ParseGhidra(object):
         offset = addr.getOffset()
 
         if addrtype == AddressType.STACK:
-            return StackAddress(self.util.resolve_stack_frame_offset(offset))
+            return StackAddress.intern(self.util.resolve_stack_frame_offset(offset))
         elif addrtype == AddressType.ABSOLUTE:
-            return AbsoluteAddress(self.util.resolve_absolute_address(offset))
+            return AbsoluteAddress.intern(self.util.resolve_absolute_address(offset))
         elif addrtype == AddressType.EXTERNAL:
             return ExternalAddress()
         elif addrtype == AddressType.REGISTER:
             regnum = self.util.ghidra2dwarf_register(offset)
             # TODO: what if regnum is None?
-            return RegisterAddress(regnum)
+            return RegisterAddress.intern(regnum)
         elif addrtype == AddressType.UNKNOWN:
             return UnknownAddress()
         else:
@@ -444,8 +444,8 @@ class ParseGhidra(object):
 
         return AddressLiveRange(
             addr=addr,
-            startpc=AbsoluteAddress(startpc) if startpc else None,
-            endpc=AbsoluteAddress(endpc) if endpc else None
+            startpc=AbsoluteAddress.intern(startpc) if startpc else None,
+            endpc=AbsoluteAddress.intern(endpc) if endpc else None
         )
 
     # Given a Ghidra DataType object, map it to the metatype code in our translation language.
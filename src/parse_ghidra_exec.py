@@ -2,11 +2,12 @@
 # Then either output the program info summary or the serialized object.
 # @category: Research
 
+import os
 import parse_ghidra
 from parse_actions import do_action
 
 def usage():
-    print("ACTION: pickle <OUTPATH> | summary")
+    print("ACTION: pickle <OUTPATH> | pickledir <OUTDIR> | summary")
 
 def parse_ghidra_exec(args):
     print(args)
@@ -14,6 +15,14 @@ def parse_ghidra_exec(args):
         usage()
         exit(1)
 
+    if args[0] == "pickledir":
+        # Batch mode: this script runs once for each program imported into the project.
+        # Re-import the parser so it binds the GhidraScript state of the current program,
+        # then write the pickle to <OUTDIR>/<program name>.pickle
+        reload(parse_ghidra)
+        outpath = os.path.join(args[1], "{}.pickle".format(getCurrentProgram().getName()))
+        args = ["pickle", outpath]
+
     proginfo = parse_ghidra.parse()
     
     do_action(proginfo, args)
@@ -5,6 +5,14 @@ from ghidra.app.util.bin.format.dwarf4.next import DWARFRegisterMappingsManager
 from ghidra.program.model.symbol import SymbolType
 from ghidra.program.model.address import Address
 from ghidra.program.model.listing import VariableStorage
+from java.util.concurrent import Callable, Executors, LinkedBlockingQueue
+from collections import deque, OrderedDict
+import os
+
+# the number of threads used to decompile functions (1 -> decompile serially)
+DECOMPILE_THREADS = int(os.environ.get("GHIDRA_DECOMPILE_THREADS", "1"))
+# the per-function decompiler timeout in seconds (0 -> no timeout)
+DECOMPILE_TIMEOUT = int(os.environ.get("GHIDRA_DECOMPILE_TIMEOUT", "0"))
 
 class VariableInfo(object):
     def __init__(
@@ -65,7 +73,7 @@ class VariableInfo(object):
 # while also avoiding duplicate computation and unnecessary parameters.
 class GhidraUtil(object):
     # perform setup
-    def __init__(self, curr, monitor):
+    def __init__(self, curr, monitor, decompile_threads=None, decompile_timeout=None):
         # current Program to act on
         self.curr = curr # getCurrentProgram()
         # the program monitor
@@ -75,6 +83,18 @@ class GhidraUtil(object):
 
         # self.decompiler :: DecompInterface
         self.decompiler = self._generate_decomp_interface()
+        # self.decompile_threads :: int
+        # self.decompile_timeout :: int (seconds)
+        self.decompile_threads = max(decompile_threads if decompile_threads is not None else DECOMPILE_THREADS, 1)
+        self.decompile_timeout = decompile_timeout if decompile_timeout is not None else DECOMPILE_TIMEOUT
+
+        # The pass over the decompiled functions records the global variables each one references,
+        # so the global variable pass doesn't have to decompile every function again.
+        # Only the VariableInfo of each symbol is kept, not the HighFunctions.
+        # self.referenced_global_vars :: OrderedDict[int->VariableInfo] (by HighSymbol id, in order of first reference)
+        # self.referenced_global_vars_complete :: bool (has a pass over all the functions finished?)
+        self.referenced_global_vars = OrderedDict()
+        self.referenced_global_vars_complete = False
 
         # self.reg_d2g_map :: dict[int->int]
         # self.reg_g2d_map :: dict[int->int]
@@ -130,8 +150,9 @@ class GhidraUtil(object):
         return offset - self.curr.getDefaultPointerSize()
 
     # Function -> DecompileResults
-    def decompile_function(self, func):
-        return self.decompiler.decompileFunction(func, 0, self.monitor)
+    def decompile_function(self, func, decompiler=None):
+        decompiler = decompiler if decompiler is not None else self.decompiler
+        return decompiler.decompileFunction(func, self.decompile_timeout, self.monitor)
 
     # get HighFunction from DecompileResults by calling .getHighFunction()
     # HighFunction -> List[HighSymbol]
@@ -244,6 +265,8 @@ class GhidraUtil(object):
 
     # Iterator global variable HighSymbol objects from the target binary that are referenced
     # from at least one of the decompiled functions.
+    # The HighSymbols belong to their HighFunctions, so this decompiles the functions again:
+    # get_referenced_global_vars() uses what the function pass already recorded instead.
     # () -> Generator[HighSymbol]
     def get_referenced_global_var_highsyms(self):
         # def addr_ref(highsym): # symbols can be referenced 
@@ -263,9 +286,22 @@ class GhidraUtil(object):
                     id_refs.append(_id_ref)
                     yield gblsym
 
+    # The global variables referenced from at least one of the decompiled functions,
+    # as recorded by a (complete) pass of get_decompiled_functions(). Runs that pass if none has finished yet.
     # () -> List[VariableInfo]
     def get_referenced_global_vars(self):
-        return [ VariableInfo.fromHighSymbol(gblsym) for gblsym in self.get_referenced_global_var_highsyms() ]
+        if not self.referenced_global_vars_complete:
+            for _ in self.get_decompiled_functions():
+                pass
+        return list(self.referenced_global_vars.values())
+
+    # Record the global variables referenced in a decompiled function
+    # HighFunction -> None
+    def _record_referenced_global_vars(self, highfn):
+        for gblsym in self.get_highfn_global_var_highsyms(highfn):
+            _id_ref = gblsym.getId()
+            if _id_ref is not None and _id_ref not in self.referenced_global_vars:
+                self.referenced_global_vars[_id_ref] = VariableInfo.fromHighSymbol(gblsym)
     
     # () -> Iter<Function>
     def get_functions(self, filter=True):
@@ -311,12 +347,44 @@ class GhidraUtil(object):
 
     # For each function, decompile and yield the DecompileResults.
     # Consumer should check whether the decompilation succeeded.
-    # () -> Iter<DecompileResults>
-    def get_decompile_results(self):
-        return (self.decompile_function(fn) for fn in self.get_functions())
-
-    # Iterates over DecompileResults for each Function and maps them to their HighFunction.
+    # Iter<Function>|None -> Iter<DecompileResults>
+    def get_decompile_results(self, funcs=None):
+        funcs = funcs if funcs is not None else self.get_functions()
+        if self.decompile_threads > 1:
+            return self._get_decompile_results_parallel(funcs)
+        return (self.decompile_function(fn) for fn in funcs)
+
+    # Decompile the functions on a pool of threads, each borrowing a DecompInterface
+    # from a shared pool (a DecompInterface can't be used by 2 threads at once).
+    # Results are yielded in the same (address) order as the given functions.
+    # Iter<Function> -> Iter<DecompileResults>
+    def _get_decompile_results_parallel(self, funcs):
+        nthreads = self.decompile_threads
+        decompilers = LinkedBlockingQueue()
+        decompilers.put(self.decompiler)
+        extra_decompilers = [ self._generate_decomp_interface() for _ in range(nthreads - 1) ]
+        for decompiler in extra_decompilers:
+            decompilers.put(decompiler)
+
+        executor = Executors.newFixedThreadPool(nthreads)
+        # bound the number of outstanding (possibly completed) results held in memory
+        window = 4 * nthreads
+        pending = deque()
+        try:
+            for fn in funcs:
+                pending.append(executor.submit(_DecompileTask(self, decompilers, fn)))
+                if len(pending) >= window:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            executor.shutdownNow()
+            for decompiler in extra_decompilers:
+                decompiler.dispose()
+
+    # Iterates over the HighFunction of each Function, in address order.
     # Discards any where decompilation failed/timed out.
+    # Records the global variables each function references along the way (see get_referenced_global_vars()).
     # () -> Iter<HighFunction>
     def get_decompiled_functions(self):
 
@@ -324,7 +392,12 @@ class GhidraUtil(object):
         def is_decompile_success(res):
             return res.decompileCompleted()
 
-        return (res.getHighFunction() for res in self.get_decompile_results() if is_decompile_success(res))
+        for res in self.get_decompile_results():
+            if is_decompile_success(res):
+                highfn = res.getHighFunction()
+                self._record_referenced_global_vars(highfn)
+                yield highfn
+        self.referenced_global_vars_complete = True
 
     # For a given Varnode (P-Code SSA Variable), return the absolute address range it spans during its lifetime.
     # Varnode -> (int, int|None) | None
@@ -366,5 +439,18 @@ class GhidraUtil(object):
     def is_valid_address(self, addr):
         return addr != Address.NO_ADDRESS
 
-
-
+# Decompiles a single function on an executor thread with a DecompInterface
+# borrowed from the shared pool of decompilers.
+class _DecompileTask(Callable):
+    def __init__(self, util, decompilers, func):
+        self.util = util # GhidraUtil
+        self.decompilers = decompilers # LinkedBlockingQueue<DecompInterface>
+        self.func = func # Function
+
+    # () -> DecompileResults
+    def call(self):
+        decompiler = self.decompilers.take()
+        try:
+            return self.util.decompile_function(self.func, decompiler=decompiler)
+        finally:
+            self.decompilers.put(decompiler)
@@ -1,14 +1,60 @@
 """
 A simple redis-cache interface for storing python objects.
 """
+from collections import OrderedDict
 from functools import wraps
+import atexit
 import pickle
 import json
 import hashlib
-import redis
 import logging
+import os
+import queue
+import sys
+import sqlite3
+import threading
+import time
+from sqlitecache import SQLiteConnect
+import cachestats
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# optional compression codecs (zlib, from the standard library, is always available)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+import zlib
 
 DEFAULT_EXPIRY = 60 * 60 * 24
+# the storage backend used by SimpleCache unless one is passed explicitly: "redis" or "sqlite"
+DEFAULT_BACKEND = os.environ.get("SIMPLECACHE_BACKEND", "redis")
+# the codec used to compress pickled values: "zstd", "lz4", "zlib", "none" or "auto" (best available)
+DEFAULT_COMPRESSION = os.environ.get("SIMPLECACHE_COMPRESSION", "auto")
+# values larger than this (in bytes, after compression) are split into chunks stored under separate keys
+DEFAULT_CHUNK_SIZE = int(os.environ.get("SIMPLECACHE_CHUNK_SIZE", 32 * 1024 * 1024))
+# default budget (in bytes) for the total size of the values stored by a SimpleCache (0 -> no byte budget)
+DEFAULT_MAX_BYTES = int(os.environ.get("SIMPLECACHE_MAX_BYTES", 8 * 1024 * 1024 * 1024))
+# the number of least recently used keys read at a time when choosing entries to evict
+EVICTION_BATCH = 16
+# values smaller than this aren't worth compressing
+COMPRESS_MIN_SIZE = 1024
+# the number of chunks requested by each MGET of a pipelined read
+CHUNKS_PER_MGET = 4
+# default bounds of LocalCache: number of entries, and total (serialized) size in bytes
+DEFAULT_LOCAL_MAX_ENTRIES = int(os.environ.get("SIMPLECACHE_LOCAL_MAX_ENTRIES", 64))
+DEFAULT_LOCAL_MAX_BYTES = int(os.environ.get("SIMPLECACHE_LOCAL_MAX_BYTES", 1024 * 1024 * 1024))
+# default bound of the WriteBehind queue of pending stores
+DEFAULT_WRITE_BEHIND_MAX_PENDING = int(os.environ.get("SIMPLECACHE_WRITE_BEHIND_MAX_PENDING", 8))
 basestring = str
 unicode = str
 
@@ -31,6 +77,8 @@ class RedisConnect(object):
         RedisNoConnException is raised if we fail to ping.
         :return: redis.StrictRedis Connection Object
         """
+        if redis is None:
+            raise RedisNoConnException("The redis client library is not installed")
         try:
             redis.StrictRedis(host=self.host, port=self.port, password=self.password).ping()
         except redis.ConnectionError as e:
@@ -58,6 +106,12 @@ class RedisNoConnException(Exception):
     pass
 
 
+# errors raised by the backends when the storage itself fails
+CONNECTION_ERRORS = (sqlite3.Error,) + ((redis.ConnectionError,) if redis is not None else ())
+# errors raised by a transaction when a watched key changed before it was executed
+WATCH_ERRORS = (redis.WatchError,) if redis is not None else ()
+
+
 class DoNotCache(Exception):
     _result = None
 
@@ -79,23 +133,53 @@ class SimpleCache(object):
                  port=None,
                  db=None,
                  password=None,
-                 namespace="SimpleCache"):
+                 namespace="SimpleCache",
+                 backend=None,
+                 path=None,
+                 max_bytes=None,
+                 compression=None,
+                 chunk_size=None):
+        """
+        Entries are evicted in least-recently-used order once either the
+        number of entries reaches `limit`, or storing a value would make the
+        total payload size exceed `max_bytes`.
+        :param max_bytes: the byte budget (0 -> no byte budget).
+            Defaults to the SIMPLECACHE_MAX_BYTES environment variable.
+        :param compression: the codec of pickled values, see Codec.from_name().
+            Defaults to the SIMPLECACHE_COMPRESSION environment variable.
+        :param chunk_size: pickled values larger than this many bytes are split
+            into chunks. Defaults to the SIMPLECACHE_CHUNK_SIZE environment variable.
+        :param backend: "redis" (default) or "sqlite" (an embedded on-disk database, see sqlitecache).
+            Defaults to the SIMPLECACHE_BACKEND environment variable.
+        :param path: the database file of the sqlite backend.
+            Defaults to the SIMPLECACHE_SQLITE_PATH environment variable.
+        """
 
         self.limit = limit  # No of json encoded strings to cache
+        max_bytes = max_bytes if max_bytes is not None else DEFAULT_MAX_BYTES
+        self.max_bytes = max_bytes if max_bytes > 0 else None  # Budget (in bytes) for the total size of the stored values
+        self.codec = Codec.from_name(compression if compression else DEFAULT_COMPRESSION)
+        self.chunk_size = chunk_size if chunk_size else DEFAULT_CHUNK_SIZE
         self.expire = expire  # Time to keys to expire in seconds
         self.prefix = namespace
         self.host = host
         self.port = port
         self.db = db
+        self.backend = backend if backend else DEFAULT_BACKEND
 
         try:
-            self.connection = RedisConnect(host=self.host,
-                                           port=self.port,
-                                           db=self.db,
-                                           password=password).connect()
-        except RedisNoConnException as e:
+            if self.backend == "sqlite":
+                self.connection = SQLiteConnect(path=path).connect()
+            elif self.backend == "redis":
+                self.connection = RedisConnect(host=self.host,
+                                               port=self.port,
+                                               db=self.db,
+                                               password=password).connect()
+            else:
+                raise ValueError("Unknown SimpleCache backend '{0}'".format(self.backend))
+        except (RedisNoConnException,) + CONNECTION_ERRORS as e:
+            logging.warning("SimpleCache ({0}) is unavailable, caching is disabled: {1}".format(self.backend, e))
             self.connection = None
-            pass
 
         # Should we hash keys? There is a very small risk of collision invloved.
         self.hashkeys = hashkeys
@@ -109,33 +193,213 @@ class SimpleCache(object):
     def get_set_name(self):
         return "SimpleCache-{0}-keys".format(self.prefix)
 
-    def store(self, key, value, expire=None):
+    def get_lru_name(self):
+        """
+        Sorted set of keys, scored by their last access time.
+        """
+        return "SimpleCache-{0}-lru".format(self.prefix)
+
+    def get_sizes_name(self):
+        """
+        Hash of key -> size (in bytes) of its stored value.
+        """
+        return "SimpleCache-{0}-sizes".format(self.prefix)
+
+    def get_bytes_name(self):
+        """
+        Counter of the total size (in bytes) of all stored values.
+        """
+        return "SimpleCache-{0}-bytes".format(self.prefix)
+
+    def get_chunks_name(self):
+        """
+        Hash of key -> number of chunks its value is split into (chunked values only).
+        """
+        return "SimpleCache-{0}-chunks".format(self.prefix)
+
+    def make_chunk_key(self, key, idx):
+        return self.make_key("{0}:chunk:{1}".format(key, idx))
+
+    def _chunk_keys(self, key, start=0, end=None):
+        if end is None:
+            nchunks = self.connection.hget(self.get_chunks_name(), key)
+            end = int(nchunks) if nchunks is not None else 0
+        return [self.make_chunk_key(key, i) for i in range(start, end)]
+
+    def _delete_values(self, keys, pipe):
+        """
+        Delete the stored values (including any chunks) of the given keys.
+        """
+        for key in keys:
+            key = to_unicode(key)
+            pipe.delete(self.make_key(key), *self._chunk_keys(key))
+
+    def used_bytes(self):
+        """
+        :return: int, the total size of the values stored in this cache
+        """
+        used = self.connection.get(self.get_bytes_name())
+        return int(used) if used is not None else 0
+
+    def touch(self, *keys, **kwargs):
+        """
+        Record an access to the given keys, for LRU eviction.
+        Only keys that are already tracked are updated (ZADD XX), so touching
+        a key that was never stored leaves no bookkeeping behind.
+        :param pipe: queue the update on this pipeline instead of sending it
+        """
+        pipe = kwargs.get("pipe")
+        if keys:
+            now = time.time()
+            (pipe if pipe is not None else self.connection).zadd(
+                self.get_lru_name(), {to_unicode(key): now for key in keys}, xx=True)
+
+    def _forget(self, keys, pipe=None):
+        """
+        Remove the bookkeeping (key set, access time, size) of the given keys.
+        """
+        keys = [to_unicode(key) for key in keys]
+        if not keys:
+            return
+        sizes = [self.connection.hget(self.get_sizes_name(), key) for key in keys]
+        freed = sum(int(size) for size in sizes if size is not None)
+
+        _pipe = pipe if pipe is not None else self.connection.pipeline()
+        self._queue_forget(keys, freed, _pipe)
+        if pipe is None:
+            _pipe.execute()
+
+    def _queue_forget(self, keys, freed, pipe):
+        """
+        Queue the removal of the bookkeeping of the given keys, whose values
+        were freed bytes in total.
+        """
+        pipe.srem(self.get_set_name(), *keys)
+        pipe.zrem(self.get_lru_name(), *keys)
+        pipe.hdel(self.get_sizes_name(), *keys)
+        pipe.hdel(self.get_chunks_name(), *keys)
+        if freed:
+            pipe.incrby(self.get_bytes_name(), -freed)
+
+    def _eviction_candidates(self, pipe):
+        """
+        Iterate the keys in least recently used order, then the keys stored
+        before access times were tracked.
+        :param pipe: a pipeline in immediate (watching) mode
+        """
+        seen = set()
+        start = 0
+        while True:
+            batch = pipe.zrange(self.get_lru_name(), start, start + EVICTION_BATCH - 1)
+            for member in batch:
+                seen.add(member)
+                yield to_unicode(member.decode('utf-8'))
+            if len(batch) < EVICTION_BATCH:
+                break
+            start += EVICTION_BATCH
+        for member in sorted(pipe.smembers(self.get_set_name()) - seen):
+            yield to_unicode(member.decode('utf-8'))
+
+    def _plan_evictions(self, pipe, key, size):
+        """
+        Choose the entries to evict (least recently used first) so that storing
+        a value of the given size under key keeps within the limits.
+        The entry being replaced doesn't count against the limits, and is never evicted.
+        :param pipe: a pipeline in immediate (watching) mode
+        :return: (size of the entry being replaced, list of (victim key, size, number of chunks))
+        """
+        set_name = self.get_set_name()
+        old_size = pipe.hget(self.get_sizes_name(), key)
+        old_size = int(old_size) if old_size is not None else 0
+        count = pipe.scard(set_name) - (1 if pipe.sismember(set_name, key) else 0)
+        used = pipe.get(self.get_bytes_name())
+        used = (int(used) if used is not None else 0) - old_size
+
+        def over_budget():
+            if count >= self.limit:
+                return True
+            return self.max_bytes is not None and used + size > self.max_bytes
+
+        victims = []
+        candidates = self._eviction_candidates(pipe)
+        while over_budget():
+            victim = next(candidates, None)
+            if victim is None:
+                break
+            if victim == key:
+                continue
+            victim_size = pipe.hget(self.get_sizes_name(), victim)
+            victim_size = int(victim_size) if victim_size is not None else 0
+            victim_chunks = pipe.hget(self.get_chunks_name(), victim)
+            victim_chunks = int(victim_chunks) if victim_chunks is not None else 0
+            victims.append((victim, victim_size, victim_chunks))
+            if pipe.sismember(set_name, victim):
+                count -= 1
+            used -= victim_size
+        return (old_size, victims)
+
+    def store(self, key, value, expire=None, size=None, chunks=None):
         """
         Method stores a value after checking for space constraints and
-        freeing up space if required.
+        freeing up space if required (least recently used entries first).
+        The budget is read, entries are evicted and the value is written in a
+        single transaction (WATCH/MULTI, retried if the bookkeeping changed in
+        between), so concurrent writers keep the byte accounting consistent.
         :param key: key by which to reference datum being stored in Redis
         :param value: actual value being stored under this key
         :param expire: time-to-live (ttl) for this datum
+        :param size: the size charged against the byte budget (defaults to the size of value)
+        :param chunks: list of chunks stored under separate keys, which value refers to
         """
         key = to_unicode(key)
         value = to_unicode(value)
         set_name = self.get_set_name()
-
-        while self.connection.scard(set_name) >= self.limit:
-            del_key = self.connection.spop(set_name)
-            self.connection.delete(self.make_key(del_key))
-
-        pipe = self.connection.pipeline()
+        size = size if size is not None else len(value)
+        chunks = chunks if chunks else []
         if expire is None:
             expire = self.expire
 
-        if (isinstance(expire, int) and expire <= 0) or (expire is None):
-            pipe.set(self.make_key(key), value)
-        else:
-            pipe.setex(self.make_key(key), expire, value)
+        items = [(self.make_chunk_key(key, i), chunk) for (i, chunk) in enumerate(chunks)]
+        items.append((self.make_key(key), value))
+        watched = [set_name, self.get_lru_name(), self.get_sizes_name(), self.get_bytes_name(), self.get_chunks_name()]
 
-        pipe.sadd(set_name, key)
-        pipe.execute()
+        with self.connection.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(*watched)
+                    old_size, victims = self._plan_evictions(pipe, key, size)
+
+                    # chunks left over from a larger value previously stored under this key
+                    old_chunks = pipe.hget(self.get_chunks_name(), key)
+                    old_chunks = int(old_chunks) if old_chunks is not None else 0
+
+                    pipe.multi()
+                    for (victim, _, victim_chunks) in victims:
+                        pipe.delete(self.make_key(victim), *self._chunk_keys(victim, 0, victim_chunks))
+                    if victims:
+                        self._queue_forget([victim for (victim, _, _) in victims], sum(victim_size for (_, victim_size, _) in victims), pipe)
+
+                    if old_chunks > len(chunks):
+                        pipe.delete(*self._chunk_keys(key, len(chunks), old_chunks))
+                    for (item_key, item_value) in items:
+                        if (isinstance(expire, int) and expire <= 0) or (expire is None):
+                            pipe.set(item_key, item_value)
+                        else:
+                            pipe.setex(item_key, expire, item_value)
+
+                    if chunks:
+                        pipe.hset(self.get_chunks_name(), key, len(chunks))
+                    else:
+                        pipe.hdel(self.get_chunks_name(), key)
+                    pipe.sadd(set_name, key)
+                    pipe.zadd(self.get_lru_name(), {key: time.time()})
+                    pipe.hset(self.get_sizes_name(), key, size)
+                    pipe.incrby(self.get_bytes_name(), size - old_size)
+                    pipe.execute()
+                    return
+                except WATCH_ERRORS:
+                    # another writer changed the bookkeeping, plan again
+                    continue
 
 
     def expire_all_in_set(self):
@@ -195,20 +459,78 @@ class SimpleCache(object):
             return self.connection.pttl("{0}:{1}".format(self.prefix, key))
 
     def store_json(self, key, value, expire=None):
-        self.store(key, json.dumps(value), expire)
+        """
+        :return: int, the size of the stored (serialized) value
+        """
+        payload = json.dumps(value)
+        self.store(key, payload, expire)
+        return len(payload)
+
+    def store_bytes(self, key, data, expire=None):
+        """
+        Store a (possibly large) bytes value, splitting it into chunks of at
+        most chunk_size bytes stored under separate keys if needed.
+        """
+        if len(data) <= self.chunk_size:
+            self.store(key, data, expire)
+            return
+
+        chunks = [data[i:i + self.chunk_size] for i in range(0, len(data), self.chunk_size)]
+        manifest = Codec.CHUNKED_MAGIC + json.dumps({"chunks": len(chunks), "size": len(data)}).encode('utf-8')
+        self.store(key, manifest, expire, size=len(data), chunks=chunks)
+
+    def get_bytes(self, key):
+        """
+        Get a value stored with store_bytes(), reassembling its chunks with
+        pipelined MGETs.
+        """
+        key = to_unicode(key)
+        data = self.get(key)
+        if data is None or not data.startswith(Codec.CHUNKED_MAGIC):
+            return data
+
+        manifest = json.loads(data[len(Codec.CHUNKED_MAGIC):].decode('utf-8'))
+        chunk_keys = self._chunk_keys(key, 0, manifest["chunks"])
+        pipe = self.connection.pipeline()
+        for i in range(0, len(chunk_keys), CHUNKS_PER_MGET):
+            pipe.mget(chunk_keys[i:i + CHUNKS_PER_MGET])
+        chunks = sum(pipe.execute(), [])
+
+        if None in chunks:  # a chunk expired or was evicted
+            self.invalidate(key)
+            raise CacheMissException
+        return b"".join(chunks)
+
+    def encode_pickle(self, value):
+        """
+        :return: bytes, the pickled and compressed value
+        """
+        return Codec.encode(self.codec, pickle.dumps(value))
+
+    def decode_pickle(self, data):
+        return pickle.loads(Codec.decode(data))
 
     def store_pickle(self, key, value, expire=None):
-        self.store(key, pickle.dumps(value), expire)
+        """
+        :return: int, the size of the stored (serialized) value
+        """
+        payload = self.encode_pickle(value)
+        self.store_bytes(key, payload, expire)
+        return len(payload)
 
     def get(self, key):
         key = to_unicode(key)
         if key:  # No need to validate membership, which is an O(1) operation, but seems we can do without.
-            value = self.connection.get(self.make_key(key))
+            # the access time is recorded in the same round-trip as the read
+            pipe = self.connection.pipeline()
+            pipe.get(self.make_key(key))
+            self.touch(key, pipe=pipe)
+            value = pipe.execute()[0]
             if value is None:  # expired key
                 if not key in self:  # If key does not exist at all, it is a straight miss.
                     raise CacheMissException
 
-                self.connection.srem(self.get_set_name(), key)
+                self._forget([key])
                 raise ExpiredKeyException
             else:
                 return value
@@ -221,22 +543,57 @@ class SimpleCache(object):
         """
         if keys:
             cache_keys = [self.make_key(to_unicode(key)) for key in keys]
-            values = self.connection.mget(cache_keys)
+            pipe = self.connection.pipeline()
+            pipe.mget(cache_keys)
+            self.touch(*keys, pipe=pipe)
+            values = pipe.execute()[0]
 
             if None in values:
-                pipe = self.connection.pipeline()
-                for cache_key, value in zip(cache_keys, values):
-                    if value is None:  # non-existant or expired key
-                        pipe.srem(self.get_set_name(), cache_key)
-                pipe.execute()
+                # non-existant or expired keys
+                self._forget([key for (key, value) in zip(keys, values) if value is None])
+
+            found = {k: v for (k, v) in zip(keys, values) if v is not None}
+            return found
 
-            return {k: v for (k, v) in zip(keys, values) if v is not None}
+    def mget_bytes(self, keys):
+        """
+        Get many values stored with store_bytes(): one MGET for the values,
+        then one pipeline of MGETs for the chunks of all the chunked ones.
+        :return: dict of found key/values (entries with a missing chunk are invalidated)
+        """
+        found = self.mget(keys) or {}
+        chunked = [(key, json.loads(data[len(Codec.CHUNKED_MAGIC):].decode('utf-8'))["chunks"])
+                   for (key, data) in found.items() if data.startswith(Codec.CHUNKED_MAGIC)]
+        if not chunked:
+            return found
+
+        pipe = self.connection.pipeline()
+        for (key, nchunks) in chunked:
+            chunk_keys = self._chunk_keys(key, 0, nchunks)
+            for i in range(0, nchunks, CHUNKS_PER_MGET):
+                pipe.mget(chunk_keys[i:i + CHUNKS_PER_MGET])
+        replies = iter(pipe.execute())
+
+        for (key, nchunks) in chunked:
+            chunks = sum([next(replies) for i in range(0, nchunks, CHUNKS_PER_MGET)], [])
+            if None in chunks:  # a chunk expired or was evicted
+                self.invalidate(key)
+                del found[key]
+            else:
+                found[key] = b"".join(chunks)
+        return found
+
+    def mget_pickle(self, keys):
+        """
+        :return: dict of found key/unpickled values
+        """
+        return dict((key, self.decode_pickle(data)) for (key, data) in self.mget_bytes(keys).items())
 
     def get_json(self, key):
         return json.loads(self.get(key))
 
     def get_pickle(self, key):
-        return pickle.loads(self.get(key))
+        return self.decode_pickle(self.get_bytes(key))
 
     def mget_json(self, keys):
         """
@@ -258,8 +615,8 @@ class SimpleCache(object):
         """
         key = to_unicode(key)
         pipe = self.connection.pipeline()
-        pipe.srem(self.get_set_name(), key)
-        pipe.delete(self.make_key(key))
+        self._delete_values([key], pipe)
+        self._forget([key], pipe=pipe)
         pipe.execute()
 
     def __contains__(self, key):
@@ -281,8 +638,9 @@ class SimpleCache(object):
 
 
     def flush(self):
-        keys = list(self.keys())
-        keys.append(self.get_set_name())
+        keys = [self.make_key(to_unicode(k.decode('utf-8'))) for k in self.keys()]
+        keys += sum([self._chunk_keys(to_unicode(k.decode('utf-8'))) for k in self.keys()], [])
+        keys += [self.get_set_name(), self.get_lru_name(), self.get_sizes_name(), self.get_bytes_name(), self.get_chunks_name()]
         with self.connection.pipeline() as pipe:
             pipe.delete(*keys)
             pipe.execute()
@@ -304,11 +662,175 @@ class SimpleCache(object):
         return key
 
 
+class LocalCache(object):
+    """
+    A bounded, in-process LRU cache of live objects, meant to sit in front of
+    a SimpleCache. It is bounded by a number of entries and/or by the
+    estimated size of its entries (their serialized size, when known).
+    Thread-safe.
+    """
+    def __init__(self, max_entries=DEFAULT_LOCAL_MAX_ENTRIES, max_bytes=DEFAULT_LOCAL_MAX_BYTES):
+        """
+        :param max_entries: maximum number of entries (None -> unbounded)
+        :param max_bytes: maximum total estimated size of the entries (None -> unbounded)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, size, meta), least recently used first
+        self.used_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: (bool, value, meta) - whether the key was found, its value and its metadata record
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return (False, None, None)
+            self.entries.move_to_end(key)
+            return (True, entry[0], entry[2])
+
+    @staticmethod
+    def estimate_size(value):
+        """
+        Cheaply estimate the size of a value whose serialized size isn't known yet: the in-memory
+        size of the value and of the items it directly holds, without serializing it (so it can be
+        called on the caller's thread). Entries stored behind are resized to their actual size later.
+        :return: int
+        """
+        size = sys.getsizeof(value)
+        if isinstance(value, dict):
+            size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(sys.getsizeof(item) for item in value)
+        return size
+
+    def put(self, key, value, size=None, meta=None):
+        """
+        :param size: the serialized size of value (estimated if None, see estimate_size())
+        """
+        size = size if size is not None else LocalCache.estimate_size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            self.invalidate(key)
+            return
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.used_bytes -= old[1]
+            self.entries[key] = (value, size, meta)
+            self.used_bytes += size
+            self._evict()
+
+    def resize(self, key, size):
+        """
+        Replace the (estimated) size of an entry with its actual serialized size,
+        once that is known. Nothing happens if the entry was evicted meanwhile.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            self.entries[key] = (entry[0], size, entry[2])
+            self.used_bytes += size - entry[1]
+            self._evict()
+
+    def _evict(self):
+        # evict least recently used entries until within bounds (the lock must be held)
+        while self.entries and ((self.max_entries is not None and len(self.entries) > self.max_entries)
+                                or (self.max_bytes is not None and self.used_bytes > self.max_bytes)):
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.used_bytes -= evicted_size
+
+    def invalidate(self, key):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.used_bytes -= old[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used_bytes = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class WriteBehind(object):
+    """
+    Applies cache stores asynchronously on a background thread, so callers
+    don't wait for values to be pickled and uploaded. The queue of pending
+    stores is bounded: once it is full, submit() blocks until the writer
+    catches up (backpressure). Pending stores are flushed at interpreter exit.
+    A forked child process gets its own writer (the parent's thread doesn't
+    survive the fork, and the parent's pending stores are its own).
+    """
+    def __init__(self, max_pending=DEFAULT_WRITE_BEHIND_MAX_PENDING):
+        """
+        :param max_pending: maximum number of queued stores before submit() blocks
+        """
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pid = None
+        self.jobs = None
+        self.thread = None
+        atexit.register(self.flush)
+
+    def _start(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.jobs = queue.Queue(maxsize=self.max_pending)
+                self.thread = threading.Thread(target=self._run, args=(self.jobs,),
+                                               name="SimpleCache-write-behind", daemon=True)
+                self.thread.start()
+                self.pid = os.getpid()
+            return self.jobs
+
+    def _run(self, jobs):
+        while True:
+            function, args, stats = jobs.get()
+            try:
+                function(*args)
+            except:
+                if stats is not None:
+                    stats.incr("errors")
+                logging.exception("SimpleCache write-behind store failed")
+            finally:
+                jobs.task_done()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queue the call function(*args), blocking while the queue is full.
+        :param stats: cachestats counters of the cached function, whose "errors" count a failed store
+        """
+        self._start().put((function, args, kwargs.get("stats")))
+
+    def pending(self):
+        return 0 if self.pid != os.getpid() else self.jobs.unfinished_tasks
+
+    def flush(self):
+        """
+        Block until all the queued stores of this process are applied.
+        """
+        if self.pid == os.getpid():
+            self.jobs.join()
+
+
 def cache_it(limit=10000, expire=DEFAULT_EXPIRY, cache=None,
              use_json=False, namespace=None,
              recache_callback=None, # object -> bool ... if this returns True, recompute and recache the result
              store_transform=None, # object -> object ... callable to transform the result value before caching
-             load_transform=None # object -> object ... callable to transform the retrieved cached value
+             load_transform=None, # object -> object ... callable to transform the retrieved cached value
+             make_meta=None, # int|None -> object ... builds the metadata record stored next to a result, given the result's payload size
+             recache_meta_callback=None, # object -> bool ... if this returns True for the metadata record, recompute and recache the result
+             key_func=None, # (*args, **kwargs) -> str ... computes the cache key of a call, instead of hashing the serialized arguments
+             local_cache=None, # LocalCache ... in-process tier of live objects, consulted before the SimpleCache
+             write_behind=None # WriteBehind ... if set, results are stored asynchronously by this writer
             ):
     """
     Arguments and function result must be pickleable.
@@ -316,6 +838,16 @@ def cache_it(limit=10000, expire=DEFAULT_EXPIRY, cache=None,
     :param expire: period after which an entry in cache is considered expired
     :param cache: SimpleCache object, if created separately
     :param recache_callback: Callable (object -> bool). If this returns True, recompute & recache the value.
+    :param make_meta: Callable (int|None -> object). Builds a (small) metadata record that is pickled under
+        '<key>:meta' whenever a result is stored.
+    :param recache_meta_callback: Callable (object -> bool). Decides staleness from the metadata record alone,
+        before the payload is fetched. If this returns True (or the record is missing), recompute & recache the value.
+    :param key_func: Callable (*args, **kwargs -> str). Computes the key of a call from its arguments. Use this
+        when serializing the arguments is expensive and they carry a cheaper unique identifier.
+    :param local_cache: LocalCache object. Results are also kept alive in this bounded in-process tier,
+        so repeated calls return the same object without a round-trip or unpickling.
+    :param write_behind: WriteBehind object. If set, a computed result is returned immediately and
+        stored in the background. The result must not be mutated until it is stored (see WriteBehind.flush()).
     :return: decorated function
     """
     cache_ = cache  ## Since python 2.x doesn't have the nonlocal keyword, we need to do this
@@ -329,56 +861,215 @@ def cache_it(limit=10000, expire=DEFAULT_EXPIRY, cache=None,
             # the expire value of the passed cache object
             expire = None
 
-        @wraps(function)
-        def func(*args, **kwargs):
-            ## Handle cases where caching is down or otherwise not available.
-            if cache.connection is None:
-                result = function(*args, **kwargs)
-                return result
+        stats = cachestats.get_stats(namespace if namespace else cache.prefix, function.__name__)
+
+        def is_fresh(res, meta):
+            if recache_meta_callback and (meta is None or recache_meta_callback(meta)):
+                return False
+            return not (recache_callback and recache_callback(res))
+
+        def remember(cache_key, res, size, meta):
+            if local_cache is not None:
+                local_cache.put(cache_key, res, size=size, meta=meta)
 
+        def store_behind(cache_key, meta_key, result):
+            size, meta = store(cache_key, meta_key, result)
+            if local_cache is not None:
+                local_cache.resize(cache_key, size)
+
+        def store(cache_key, meta_key, result):
+            start = cachestats.timer()
+            payload = json.dumps(result) if use_json else cache.encode_pickle(result)
+            serialized = cachestats.timer()
+            if use_json:
+                cache.store(cache_key, payload, expire)
+            else:
+                cache.store_bytes(cache_key, payload, expire)
+            meta = None
+            if make_meta:
+                meta = make_meta(len(payload))
+                cache.store_pickle(meta_key, meta, expire)
+            stats.observe("serialize_seconds", serialized - start)
+            stats.observe("transfer_seconds", cachestats.timer() - serialized)
+            stats.observe("payload_bytes", len(payload))
+            return (len(payload), meta)
+
+        def make_cache_key(args, kwargs):
             serializer = json if use_json else pickle
-            fetcher = cache.get_json if use_json else cache.get_pickle
-            storer = cache.store_json if use_json else cache.store_pickle
 
             ## Key will be either a md5 hash or just pickle object,
             ## in the form of `function name`:`key`
-            key = cache.get_hash(serializer.dumps([args, kwargs]))
+            if key_func:
+                key = key_func(*args, **kwargs)
+            else:
+                key = cache.get_hash(serializer.dumps([args, kwargs]))
             cache_key = '{func_name}:{key}'.format(func_name=function.__name__,
                                                    key=key)
 
             if namespace:
                 cache_key = '{namespace}:{key}'.format(namespace=namespace,
                                                        key=cache_key)
+            return cache_key
+
+        def prefetch(arg_tuples):
+            """
+            Look up the cached results of many calls at once: the metadata
+            records and then the payloads of all the calls are each fetched
+            with a single pipelined request. Nothing is computed.
+            :param arg_tuples: list of tuples of positional arguments
+            :return: (list of (args, result) for the hits, list of args for the misses)
+            """
+            hits, pending, misses = [], [], []
+            for args in arg_tuples:
+                args = tuple(args)
+                cache_key = make_cache_key(args, {})
+                if local_cache is not None:
+                    found, res, meta = local_cache.get(cache_key)
+                    if found and is_fresh(res, meta):
+                        stats.incr("local_hits")
+                        hits.append((args, load_transform(res) if load_transform else res))
+                        continue
+                pending.append((args, cache_key))
+
+            if cache.connection is None:
+                stats.incr("misses", len(pending))
+                return (hits, [args for (args, _) in pending])
+
+            try:
+                start = cachestats.timer()
+                metas = {}
+                if recache_meta_callback:
+                    metas = cache.mget_pickle(['{key}:meta'.format(key=cache_key) for (_, cache_key) in pending])
+                    fresh = []
+                    for (args, cache_key) in pending:
+                        meta = metas.get('{key}:meta'.format(key=cache_key))
+                        if meta is None:
+                            stats.incr("misses")
+                            misses.append(args)
+                        elif recache_meta_callback(meta):
+                            stats.incr("recaches")
+                            misses.append(args)
+                        else:
+                            fresh.append((args, cache_key))
+                    pending = fresh
+
+                if use_json:
+                    payloads = cache.mget([cache_key for (_, cache_key) in pending]) or {}
+                else:
+                    payloads = cache.mget_bytes([cache_key for (_, cache_key) in pending])
+                stats.observe("transfer_seconds", cachestats.timer() - start)
+            except CONNECTION_ERRORS as e:
+                logging.exception(e)
+                stats.incr("errors")
+                return (hits, misses + [args for (args, _) in pending])
+
+            for (args, cache_key) in pending:
+                data = payloads.get(cache_key)
+                if data is None:
+                    stats.incr("misses")
+                    misses.append(args)
+                    continue
+
+                start = cachestats.timer()
+                res = json.loads(data) if use_json else cache.decode_pickle(data)
+                stats.observe("serialize_seconds", cachestats.timer() - start)
+                stats.observe("payload_bytes", len(data))
+                if recache_callback and recache_callback(res):
+                    stats.incr("recaches")
+                    misses.append(args)
+                    continue
+
+                stats.incr("hits")
+                remember(cache_key, res, len(data), metas.get('{key}:meta'.format(key=cache_key)))
+                hits.append((args, load_transform(res) if load_transform else res))
+            return (hits, misses)
+
+        @wraps(function)
+        def func(*args, **kwargs):
+            cache_key = make_cache_key(args, kwargs)
+            meta_key = '{key}:meta'.format(key=cache_key)
+
+            ## The in-process tier holds live objects: a hit returns the very same object.
+            if local_cache is not None:
+                found, res, meta = local_cache.get(cache_key)
+                if found and is_fresh(res, meta):
+                    stats.incr("local_hits")
+                    return load_transform(res) if load_transform else res
+
+            ## Handle cases where caching is down or otherwise not available.
+            if cache.connection is None:
+                stats.incr("misses")
+                start = cachestats.timer()
+                result = function(*args, **kwargs)
+                stats.observe("compute_seconds", cachestats.timer() - start)
+                remember(cache_key, result, None, make_meta(None) if make_meta else None)
+                return result
 
             try:
-                res = fetcher(cache_key)
+                start = cachestats.timer()
+                # stale entries are detected from the metadata record, without transferring the payload
+                meta = None
+                if recache_meta_callback:
+                    meta = cache.get_pickle(meta_key)
+                    if recache_meta_callback(meta):
+                        raise RecacheException
+
+                if use_json:
+                    data = cache.get(cache_key)
+                    fetched = cachestats.timer()
+                    res = json.loads(data)
+                else:
+                    data = cache.get_bytes(cache_key)
+                    fetched = cachestats.timer()
+                    res = cache.decode_pickle(data)
+                stats.observe("transfer_seconds", fetched - start)
+                stats.observe("serialize_seconds", cachestats.timer() - fetched)
+                stats.observe("payload_bytes", len(data))
                 if recache_callback and recache_callback(res):
                     raise RecacheException
-                
+
+                stats.incr("hits")
+                remember(cache_key, res, len(data), meta)
                 if load_transform:
                     res = load_transform(res)
                 return res
-            except (ExpiredKeyException, CacheMissException, RecacheException) as e:
+            except RecacheException as e:
+                stats.incr("recaches")
+            except (ExpiredKeyException, CacheMissException) as e:
                 ## Add some sort of cache miss handing here.
-                pass
+                stats.incr("misses")
             except:
+                stats.incr("errors")
                 logging.exception("Unknown redis-simple-cache error. Please check your Redis free space.")
 
             try:
+                start = cachestats.timer()
                 result = function(*args, **kwargs)
+                stats.observe("compute_seconds", cachestats.timer() - start)
                 if store_transform:
                     result = store_transform(result)
             except DoNotCache as e:
                 result = e.result
             else:
-                try:
-                    storer(cache_key, result, expire)
-                except redis.ConnectionError as e:
-                    logging.exception(e)
+                if write_behind is not None:
+                    # the payload size isn't known until the writer serializes the result: it is estimated until then
+                    # (remembered first, so that the writer's resize() can't be overwritten by the estimate)
+                    remember(cache_key, result, None, make_meta(None) if make_meta else None)
+                    write_behind.submit(store_behind, cache_key, meta_key, result, stats=stats)
+                else:
+                    size, meta = None, None
+                    try:
+                        size, meta = store(cache_key, meta_key, result)
+                    except CONNECTION_ERRORS as e:
+                        stats.incr("errors")
+                        logging.exception(e)
+                    remember(cache_key, result, size, meta)
 
             if load_transform:
                 result = load_transform(result)
             return result
+        func.stats = stats
+        func.prefetch = prefetch
         return func
     return decorator
 
@@ -401,3 +1092,79 @@ def to_unicode(obj, encoding='utf-8'):
         if not isinstance(obj, unicode):
             obj = unicode(obj, encoding)
     return obj
+
+
+class Codec(object):
+    """
+    Compression codecs for stored values. Encoded values are framed with
+    FRAME_MAGIC and a codec id, so every entry records how to decode it and
+    values stored without a frame (plain pickles) are still readable.
+    """
+    NONE = 0
+    ZLIB = 1
+    ZSTD = 2
+    LZ4 = 3
+
+    FRAME_MAGIC = b"\x00SCZ"
+    CHUNKED_MAGIC = b"\x00SCC"
+
+    _names = {"none": NONE, "zlib": ZLIB, "zstd": ZSTD, "lz4": LZ4}
+
+    @staticmethod
+    def available(codec):
+        if codec == Codec.ZSTD:
+            return zstandard is not None
+        if codec == Codec.LZ4:
+            return lz4 is not None
+        return codec in (Codec.NONE, Codec.ZLIB)
+
+    @staticmethod
+    def from_name(name):
+        """
+        :param name: "zstd", "lz4", "zlib", "none" or "auto" (the best available codec)
+        :return: int, codec id
+        """
+        if name == "auto":
+            for codec in (Codec.ZSTD, Codec.LZ4, Codec.ZLIB):
+                if Codec.available(codec):
+                    return codec
+        if name not in Codec._names:
+            raise ValueError("Unknown compression codec '{0}'".format(name))
+        codec = Codec._names[name]
+        if not Codec.available(codec):
+            raise ValueError("Compression codec '{0}' is not installed".format(name))
+        return codec
+
+    @staticmethod
+    def compress(codec, data):
+        if codec == Codec.ZSTD:
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        if codec == Codec.LZ4:
+            return lz4.frame.compress(data)
+        if codec == Codec.ZLIB:
+            return zlib.compress(data, 3)
+        return data
+
+    @staticmethod
+    def decompress(codec, data):
+        if codec == Codec.ZSTD:
+            return zstandard.ZstdDecompressor().decompress(data)
+        if codec == Codec.LZ4:
+            return lz4.frame.decompress(data)
+        if codec == Codec.ZLIB:
+            return zlib.decompress(data)
+        return data
+
+    @staticmethod
+    def encode(codec, data):
+        if len(data) < COMPRESS_MIN_SIZE:
+            codec = Codec.NONE
+        return Codec.FRAME_MAGIC + bytes([codec]) + Codec.compress(codec, data)
+
+    @staticmethod
+    def decode(data):
+        if not data.startswith(Codec.FRAME_MAGIC):
+            return data
+        offset = len(Codec.FRAME_MAGIC)
+        return Codec.decompress(data[offset], data[offset + 1:])
+
@@ -39,14 +39,15 @@ class ProgramInfoStub(ResolverDatabase.ResolverStub):
         self.functionrefs = functionrefs
 
     def resolve(self, record):
-        record.obj = ProgramInfo()
+        # incomplete (not hashable) until its globals & functions are resolved
+        record.obj = mark_incomplete(ProgramInfo())
 
         globals = record.db.resolve_many(self.globalrefs)
         functions = record.db.resolve_many(self.functionrefs)
 
         record.obj.globals = filter_variables(globals)
         record.obj.functions = functions
-        return record.obj
+        return mark_complete(record.obj)
 
     def __str__(self):
         return "<ProgramInfoStub globalrefs={} functionrefs={}>".format(self.globalrefs, self.functionrefs)
@@ -71,10 +72,10 @@ class FunctionStub(ResolverDatabase.ResolverStub):
         assert_not_none(self, "paramrefs")
         assert_not_none(self, "varrefs")
 
-        record.obj = Function()
+        record.obj = mark_incomplete(Function())
 
         # startaddr = record.db.resolve(self.startaddrref)
-        rettype = DataTypeVoid() if self.rettyperef is None else db_resolve_subtype(record.db, self.rettyperef)
+        rettype = DataTypeVoid.intern() if self.rettyperef is None else db_resolve_subtype(record.db, self.rettyperef)
         params = record.db.resolve_many(self.paramrefs)
         vars = record.db.resolve_many(self.varrefs)
 
@@ -85,7 +86,7 @@ class FunctionStub(ResolverDatabase.ResolverStub):
         record.obj.params = filter_variables(params)
         record.obj.vars = filter_variables(vars)
         record.obj.variadic = self.variadic
-        return record.obj
+        return mark_complete(record.obj)
 
     def __str__(self):
         return "<FunctionStub paramrefs={} varrefs={}>".format(self.paramrefs, self.varrefs)
@@ -108,7 +109,7 @@ class VariableStub(ResolverDatabase.ResolverStub):
         assert_not_none(self, "dtyperef")
         assert_not_none(self, "liveranges")
 
-        record.obj = Variable()
+        record.obj = mark_incomplete(Variable())
 
         function = None
         if self.functionref is not None:
@@ -121,7 +122,7 @@ class VariableStub(ResolverDatabase.ResolverStub):
         record.obj.liveranges = self.liveranges
         record.obj.param = self.param
         record.obj.function = function
-        return record.obj
+        return mark_complete(record.obj)
 
     def __str__(self):
         return "<VariableStub dtyperef={} functionref={}>".format(self.dtyperef, self.functionref)
@@ -155,7 +156,7 @@ class DataTypeFunctionPrototypeStub(DataTypeStub):
         record.obj = DataTypeFunctionPrototype()
 
         # if rettype is None, assume void return type
-        rettype = DataTypeVoid() if self.rettyperef is None else record.db.resolve(self.rettyperef)
+        rettype = DataTypeVoid.intern() if self.rettyperef is None else record.db.resolve(self.rettyperef)
         paramtypes = db_resolve_subtypes(record.db, self.paramtyperefs)
 
         record.obj.rettype = rettype
@@ -183,7 +184,7 @@ class DataTypeIntStub(DataTypeStub):
     def resolve(self, record):
         assert_not_none(self, "size")
 
-        return DataTypeInt(size=self.size, signed=self.signed)
+        return DataTypeInt.intern(self.size, signed=self.signed)
 
     def __hash__(self):
         return hash((self.metatype, self.size, self.signed))
@@ -198,7 +199,7 @@ class DataTypeFloatStub(DataTypeStub):
     def resolve(self, record):
         assert_not_none(self, "size")
 
-        return DataTypeFloat(size=self.size)
+        return DataTypeFloat.intern(self.size)
 
 class DataTypeUndefinedStub(DataTypeStub):
     def __init__(self, size=None):
@@ -210,7 +211,7 @@ class DataTypeUndefinedStub(DataTypeStub):
     def resolve(self, record):
         assert_not_none(self, "size")
 
-        return DataTypeUndefined(size=self.size)
+        return DataTypeUndefined.intern(self.size)
 
 class DataTypeVoidStub(DataTypeStub):
     def __init__(self):
@@ -220,7 +221,7 @@ class DataTypeVoidStub(DataTypeStub):
         )
 
     def resolve(self, record):
-        return DataTypeVoid()
+        return DataTypeVoid.intern()
 
 class DataTypePointerStub(DataTypeStub):
     def __init__(self, basetyperef=None, size=None):
@@ -246,6 +247,12 @@ class DataTypePointerStub(DataTypeStub):
         #     print(refrecord)
         #     raise Exception("Pointer basetype is None")
 
+        # pointers to interned (primitive) types are shared
+        interned = DataTypePointer.intern(basetype, self.size)
+        if interned is not None:
+            record.obj = interned
+            return interned
+
         record.obj.basetype = basetype
         return record.obj
 
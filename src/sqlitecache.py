@@ -0,0 +1,401 @@
+"""
+An embedded, on-disk backend for SimpleCache that needs no server.
+SQLiteConnection implements the subset of the redis client interface used by
+SimpleCache (strings with expiry, sets, key patterns & pipelines) on top of
+a single SQLite database file, opened in WAL & memory-mapped mode so several
+processes can share it.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "simplecache", "simplecache.sqlite3")
+DEFAULT_MMAP_SIZE = 1 << 30
+
+# the redis commands implemented by SQLiteConnection (as _<command>(db, ...) methods)
+COMMANDS = frozenset([
+    "get", "mget", "set", "setex", "delete", "pttl", "keys",
+    "sadd", "srem", "scard", "spop", "smembers", "sismember",
+    "incrby", "zadd", "zrem", "zrange", "zcard", "zscore", "hset", "hget", "hdel",
+])
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)",
+    "CREATE TABLE IF NOT EXISTS sets (name TEXT NOT NULL, member BLOB NOT NULL, PRIMARY KEY (name, member))",
+    "CREATE TABLE IF NOT EXISTS zsets (name TEXT NOT NULL, member BLOB NOT NULL, score REAL NOT NULL, PRIMARY KEY (name, member))",
+    "CREATE INDEX IF NOT EXISTS zsets_score ON zsets (name, score)",
+    "CREATE TABLE IF NOT EXISTS hashes (name TEXT NOT NULL, field BLOB NOT NULL, value BLOB NOT NULL, PRIMARY KEY (name, field))",
+]
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return str(value).encode('utf-8')
+
+
+def _to_str(key):
+    return key.decode('utf-8') if isinstance(key, bytes) else str(key)
+
+
+def _glob_pattern(pattern):
+    """
+    Translate a redis glob pattern into a SQLite GLOB pattern.
+    Both support *, ? and [...] classes, but SQLite has no backslash escapes:
+    an escaped special character becomes a single-character class instead.
+    """
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern):
+            i += 1
+            c = pattern[i]
+            out.append('[' + c + ']' if c in '*?[' else c)
+        else:
+            out.append(c)
+        i += 1
+    return ''.join(out)
+
+
+class SQLiteConnect(object):
+    """
+    The SQLite counterpart of RedisConnect: stores the database location and
+    creates the connection object used by SimpleCache.
+    """
+    def __init__(self, path=None, mmap_size=None):
+        self.path = path if path else os.environ.get("SIMPLECACHE_SQLITE_PATH", DEFAULT_SQLITE_PATH)
+        self.mmap_size = mmap_size if mmap_size is not None else DEFAULT_MMAP_SIZE
+
+    def connect(self):
+        """
+        :return: SQLiteConnection Connection Object
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        connection = SQLiteConnection(self.path, mmap_size=self.mmap_size)
+        connection.ping()
+        return connection
+
+
+class SQLiteConnection(object):
+    """
+    Redis-like commands backed by SQLite.
+    Values and set members are returned as bytes, like the redis client does.
+    Expired keys are treated as missing and are deleted lazily.
+    """
+    def __init__(self, path, mmap_size=DEFAULT_MMAP_SIZE):
+        self.path = path
+        self.mmap_size = mmap_size
+        self._lock = threading.RLock()
+        self._db = None
+        self._pid = None
+
+    def _conn(self):
+        # a sqlite3 connection must not be shared with a forked child process
+        if self._db is None or self._pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA mmap_size={0}".format(int(self.mmap_size)))
+            for stmt in _SCHEMA:
+                db.execute(stmt)
+            self._db = db
+            self._pid = os.getpid()
+        return self._db
+
+    def _execute(self, commands):
+        """
+        Run a list of (command name, args, kwargs) in a single transaction.
+        :return: list of command results
+        """
+        db = self._begin()
+        try:
+            results = self._run(db, commands)
+        except:
+            self._rollback(db)
+            raise
+        self._commit(db)
+        return results
+
+    def _run(self, db, commands):
+        return [getattr(self, "_" + name)(db, *args, **kwargs) for (name, args, kwargs) in commands]
+
+    def _begin(self):
+        """
+        Start a transaction, holding the database's write lock (and this
+        connection's lock) until _commit() or _rollback().
+        :return: the sqlite3 connection
+        """
+        self._lock.acquire()
+        try:
+            db = self._conn()
+            db.execute("BEGIN IMMEDIATE")
+        except:
+            self._lock.release()
+            raise
+        return db
+
+    def _commit(self, db):
+        try:
+            db.execute("COMMIT")
+        finally:
+            self._lock.release()
+
+    def _rollback(self, db):
+        try:
+            db.execute("ROLLBACK")
+        finally:
+            self._lock.release()
+
+    def pipeline(self):
+        return SQLitePipeline(self)
+
+    def ping(self):
+        with self._lock:
+            self._conn().execute("SELECT 1")
+        return True
+
+    def __getattr__(self, name):
+        # expose every _<command>(db, ...) implementation as a single-command transaction
+        if name not in COMMANDS:
+            raise AttributeError(name)
+
+        def command(*args, **kwargs):
+            return self._execute([(name, args, kwargs)])[0]
+        return command
+
+    ## strings
+
+    def _live(self, db, key, now=None):
+        row = db.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= (now if now is not None else time.time()):
+            db.execute("DELETE FROM kv WHERE key = ?", (key,))
+            return None
+        return row
+
+    def _get(self, db, name):
+        row = self._live(db, _to_str(name))
+        return bytes(row[0]) if row is not None else None
+
+    def _mget(self, db, keys, *args):
+        keys = list(keys) + list(args) if not isinstance(keys, (str, bytes)) else [keys] + list(args)
+        now = time.time()
+        rows = [self._live(db, _to_str(key), now) for key in keys]
+        return [bytes(row[0]) if row is not None else None for row in rows]
+
+    def _set(self, db, name, value):
+        db.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, NULL)",
+                   (_to_str(name), sqlite3.Binary(_to_bytes(value))))
+        return True
+
+    def _setex(self, db, name, time_, value):
+        db.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                   (_to_str(name), sqlite3.Binary(_to_bytes(value)), time.time() + int(time_)))
+        return True
+
+    def _delete(self, db, *names):
+        deleted = 0
+        for name in names:
+            name = _to_str(name)
+            deleted += db.execute("DELETE FROM kv WHERE key = ?", (name,)).rowcount
+            for table in ("sets", "zsets", "hashes"):
+                deleted += 1 if db.execute("DELETE FROM {0} WHERE name = ?".format(table), (name,)).rowcount else 0
+        return deleted
+
+    def _incrby(self, db, name, amount=1):
+        row = self._live(db, _to_str(name))
+        value = (int(bytes(row[0])) if row is not None else 0) + int(amount)
+        expires_at = row[1] if row is not None else None
+        db.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                   (_to_str(name), sqlite3.Binary(_to_bytes(value)), expires_at))
+        return value
+
+    def _collection_exists(self, db, name):
+        # sets, sorted sets & hashes never expire
+        return any(db.execute("SELECT 1 FROM {0} WHERE name = ? LIMIT 1".format(table), (name,)).fetchone()
+                   for table in ("sets", "zsets", "hashes"))
+
+    def _pttl(self, db, name):
+        name = _to_str(name)
+        row = self._live(db, name)
+        if row is None:
+            return -1 if self._collection_exists(db, name) else -2
+        if row[1] is None:
+            return -1
+        return int((row[1] - time.time()) * 1000)
+
+    def _keys(self, db, pattern='*'):
+        pattern = _glob_pattern(_to_str(pattern))
+        now = time.time()
+        keys = [row[0] for row in db.execute(
+            "SELECT key FROM kv WHERE key GLOB ? AND (expires_at IS NULL OR expires_at > ?)", (pattern, now))]
+        for table in ("sets", "zsets", "hashes"):
+            keys += [row[0] for row in db.execute("SELECT DISTINCT name FROM {0} WHERE name GLOB ?".format(table), (pattern,))]
+        return [_to_bytes(key) for key in keys]
+
+    ## sets
+
+    def _sadd(self, db, name, *values):
+        name = _to_str(name)
+        return sum(db.execute("INSERT OR IGNORE INTO sets (name, member) VALUES (?, ?)",
+                              (name, sqlite3.Binary(_to_bytes(value)))).rowcount for value in values)
+
+    def _srem(self, db, name, *values):
+        name = _to_str(name)
+        return sum(db.execute("DELETE FROM sets WHERE name = ? AND member = ?",
+                              (name, sqlite3.Binary(_to_bytes(value)))).rowcount for value in values)
+
+    def _scard(self, db, name):
+        return db.execute("SELECT COUNT(*) FROM sets WHERE name = ?", (_to_str(name),)).fetchone()[0]
+
+    def _spop(self, db, name):
+        name = _to_str(name)
+        row = db.execute("SELECT member FROM sets WHERE name = ? ORDER BY RANDOM() LIMIT 1", (name,)).fetchone()
+        if row is None:
+            return None
+        db.execute("DELETE FROM sets WHERE name = ? AND member = ?", (name, row[0]))
+        return bytes(row[0])
+
+    def _smembers(self, db, name):
+        return set(bytes(row[0]) for row in db.execute("SELECT member FROM sets WHERE name = ?", (_to_str(name),)))
+
+    def _sismember(self, db, name, value):
+        return db.execute("SELECT 1 FROM sets WHERE name = ? AND member = ?",
+                          (_to_str(name), sqlite3.Binary(_to_bytes(value)))).fetchone() is not None
+
+    ## sorted sets
+
+    def _zadd(self, db, name, mapping, xx=False):
+        # xx: only update the scores of existing members
+        name = _to_str(name)
+        added = 0
+        for member, score in mapping.items():
+            member = sqlite3.Binary(_to_bytes(member))
+            exists = db.execute("SELECT 1 FROM zsets WHERE name = ? AND member = ?", (name, member)).fetchone()
+            if xx and not exists:
+                continue
+            db.execute("INSERT OR REPLACE INTO zsets (name, member, score) VALUES (?, ?, ?)", (name, member, float(score)))
+            added += 0 if exists else 1
+        return added
+
+    def _zrem(self, db, name, *values):
+        name = _to_str(name)
+        return sum(db.execute("DELETE FROM zsets WHERE name = ? AND member = ?",
+                              (name, sqlite3.Binary(_to_bytes(value)))).rowcount for value in values)
+
+    def _zrange(self, db, name, start, end, withscores=False):
+        # start & end are inclusive indexes, which may be negative (counted from the end), as in redis
+        name = _to_str(name)
+        count = self._zcard(db, name)
+        start = start + count if start < 0 else start
+        end = end + count if end < 0 else end
+        if start > end or start >= count:
+            return []
+        rows = db.execute("SELECT member, score FROM zsets WHERE name = ? ORDER BY score, member LIMIT ? OFFSET ?",
+                          (name, end - start + 1, max(start, 0))).fetchall()
+        return [(bytes(member), score) for (member, score) in rows] if withscores else [bytes(member) for (member, _) in rows]
+
+    def _zcard(self, db, name):
+        return db.execute("SELECT COUNT(*) FROM zsets WHERE name = ?", (_to_str(name),)).fetchone()[0]
+
+    def _zscore(self, db, name, value):
+        row = db.execute("SELECT score FROM zsets WHERE name = ? AND member = ?",
+                         (_to_str(name), sqlite3.Binary(_to_bytes(value)))).fetchone()
+        return row[0] if row is not None else None
+
+    ## hashes
+
+    def _hset(self, db, name, key=None, value=None, mapping=None):
+        name = _to_str(name)
+        items = dict(mapping) if mapping else {}
+        if key is not None:
+            items[key] = value
+        added = 0
+        for field, value in items.items():
+            field = sqlite3.Binary(_to_bytes(field))
+            exists = db.execute("SELECT 1 FROM hashes WHERE name = ? AND field = ?", (name, field)).fetchone()
+            db.execute("INSERT OR REPLACE INTO hashes (name, field, value) VALUES (?, ?, ?)",
+                       (name, field, sqlite3.Binary(_to_bytes(value))))
+            added += 0 if exists else 1
+        return added
+
+    def _hget(self, db, name, key):
+        row = db.execute("SELECT value FROM hashes WHERE name = ? AND field = ?",
+                         (_to_str(name), sqlite3.Binary(_to_bytes(key)))).fetchone()
+        return bytes(row[0]) if row is not None else None
+
+    def _hdel(self, db, name, *keys):
+        name = _to_str(name)
+        return sum(db.execute("DELETE FROM hashes WHERE name = ? AND field = ?",
+                              (name, sqlite3.Binary(_to_bytes(key)))).rowcount for key in keys)
+
+
+class SQLitePipeline(object):
+    """
+    Buffers commands and runs them in a single transaction on execute(),
+    mirroring redis.client.Pipeline.
+    SQLite has no optimistic locking: watch() starts the transaction right away,
+    holding the database's write lock until execute() or reset(). Until multi()
+    is called, commands run immediately (inside the transaction) and return their
+    results, as in redis. The watched keys can't change before execute(), so it
+    never fails with a WatchError.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.commands = []
+        self.db = None  # the open transaction, once watching
+        self.buffering = True
+
+    def __getattr__(self, name):
+        if name not in COMMANDS:
+            raise AttributeError(name)
+
+        def command(*args, **kwargs):
+            if not self.buffering:
+                return self.connection._run(self.db, [(name, args, kwargs)])[0]
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+    def watch(self, *names):
+        if self.db is None:
+            self.db = self.connection._begin()
+        self.buffering = False
+
+    def multi(self):
+        self.buffering = True
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        if self.db is None:
+            return self.connection._execute(commands) if commands else []
+
+        db, self.db = self.db, None
+        try:
+            results = self.connection._run(db, commands)
+        except:
+            self.connection._rollback(db)
+            raise
+        self.connection._commit(db)
+        return results
+
+    def reset(self):
+        self.commands = []
+        self.buffering = True
+        if self.db is not None:
+            db, self.db = self.db, None
+            self.connection._rollback(db)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
@@ -0,0 +1,153 @@
+import random
+
+from compare_optimized import *
+
+INT = DataTypeInt.intern(4)
+
+# vars: [(name, DataType, [(Address, start pc, end pc)])] -> Function
+def make_function(vars):
+    function = Function(name="f", startaddr=AbsoluteAddress(0), endaddr=AbsoluteAddress(0x100), params=[], vars=[])
+    function.vars = [
+        Variable(name, dtype, [ AddressLiveRange(addr, AbsoluteAddress(start), AbsoluteAddress(end)) for (addr, start, end) in locations ], function=function)
+        for (name, dtype, locations) in vars
+    ]
+    return function
+
+# {name of left var -> compare level} of the records of a context comparison
+def record_levels(context_cmp):
+    return dict([ (record.get_varnode().get_var().get_name(), record.get_compare_level()) for record in context_cmp.get_varnode_compare_records() ])
+
+def pc_ranges(cmp):
+    return [ (c.get_pc_range().get_start().space_offset(), c.get_pc_range().get_end().space_offset()) for c in cmp.get_context_comparisons() ]
+
+# Checks every interval of the sweep against a comparison of the live sets built from scratch.
+# Returns the number of mismatches.
+def check_against_brute_force(cmp):
+    bad = 0
+    for context_cmp in cmp.get_context_comparisons():
+        pc = context_cmp.get_pc_range().get_start()
+        left_varnodes = context_cmp.get_left().get_varnodes()
+        right_varnodes = context_cmp.get_right().get_varnodes()
+
+        # the live sets are the ones the functions' PC indexes give
+        if not cmp.primitive:
+            for (varnodes, function) in ((left_varnodes, cmp.get_left()), (right_varnodes, cmp.get_right())):
+                live = set([ (id(var), id(liverange)) for (var, liverange) in function.get_live_at_pc(pc) ])
+                if set([ (id(varnode.get_var()), id(varnode.get_liverange())) for varnode in varnodes ]) != live:
+                    bad += 1
+
+        full = ConstPCVariableSetSnapshotCompare2(ConstPCVariableSetSnapshot(left_varnodes), ConstPCVariableSetSnapshot(right_varnodes))
+        if full.bytes_overlapped() != context_cmp.bytes_overlapped():
+            bad += 1
+        summary = lambda records: sorted([
+            (id(record.get_varnode()), record.get_compare_level(), sorted([ id(varnode) for varnode in record.get_compared_varnodes() ]))
+            for record in records
+        ])
+        if summary(full.get_varnode_compare_records()) != summary(context_cmp.get_varnode_compare_records()):
+            bad += 1
+        if cmp.get_context_comparison_at_pc(pc) is not context_cmp:
+            bad += 1
+    return bad
+
+# locals moving between (possibly overlapping) stack slots & registers over PCs
+def make_random_function(rng):
+    vars = []
+    for k in range(0, 6):
+        locations = []
+        pc = rng.randint(0, 10)
+        for _ in range(0, rng.randint(1, 4)):
+            start = pc + rng.randint(0, 4)
+            end = start + rng.randint(1, 8)
+            pc = end
+            if rng.random() < 0.8:
+                addr = StackAddress(-8 * (k + 1 + 6 * rng.randint(0, 1)) - rng.choice((0, 0, 2)))
+            else:
+                addr = RegisterAddress(k)
+            locations.append((addr, start, end))
+        vars.append(("v{}".format(k), INT, locations))
+    return make_function(vars)
+
+def test_sweep_matches_brute_force():
+    rng = random.Random(3)
+    for i in range(0, 100):
+        left = make_random_function(rng)
+        right = make_random_function(rng)
+        cmp = OptimizedFunctionCompare2(left, right, primitive=(i % 2 == 1))
+        assert check_against_brute_force(cmp) == 0
+
+def test_overlapping_locals():
+    # 2 locals that share part of a stack slot, live over the same PCs
+    left = make_function([
+        ("a", INT, [ (StackAddress(-0x10), 0x10, 0x30) ]),
+        ("b", INT, [ (StackAddress(-0xe), 0x10, 0x30) ])
+    ])
+    right = make_function([ ("c", INT, [ (StackAddress(-0x10), 0x10, 0x30) ]) ])
+
+    cmp = OptimizedFunctionCompare2(left, right)
+    assert pc_ranges(cmp) == [ (0x10, 0x30) ]
+    assert record_levels(cmp.get_context_comparisons()[0]) == { "a": VarnodeCompareLevel.MATCH, "b": VarnodeCompareLevel.OVERLAP }
+    assert check_against_brute_force(cmp) == 0
+
+    # and the other way around
+    flipped = cmp.flip()
+    assert record_levels(flipped.get_context_comparisons()[0]) == { "c": VarnodeCompareLevel.MATCH }
+    assert check_against_brute_force(flipped) == 0
+
+def test_interval_reuse():
+    left = make_function([
+        ("a", INT, [ (StackAddress(-0x10), 0, 0x40) ]),
+        ("r", INT, [ (RegisterAddress(0), 0x10, 0x20) ])
+    ])
+    right = make_function([
+        ("a", INT, [ (StackAddress(-0x10), 0, 0x40) ]),
+        ("r", INT, [ (RegisterAddress(0), 0x18, 0x20) ])
+    ])
+    cmp = OptimizedFunctionCompare2(left, right)
+    assert pc_ranges(cmp) == [ (0, 0x10), (0x10, 0x18), (0x18, 0x20), (0x20, 0x40) ]
+
+    # the stack doesn't change, so its comparison is shared by all the intervals
+    stack = StackAddress(-0x10).get_region()
+    stack_cmps = [ context_cmp.get_space_comparison(stack) for context_cmp in cmp.get_context_comparisons() ]
+    assert all([ stack_cmp is stack_cmps[0] for stack_cmp in stack_cmps ])
+
+    # the register is compared again each time it changes
+    register = RegisterAddress(0).get_region()
+    register_cmps = [ context_cmp.get_space_comparison(register) for context_cmp in cmp.get_context_comparisons()[1:3] ]
+    assert register_cmps[0] is not register_cmps[1]
+
+    # records combine the comparisons of each left varnode over its whole live range
+    # (registers aren't rangeable, so they aren't compared)
+    levels = dict([ (record.get_varnode().get_var().get_name(), record.get_compare_level()) for record in cmp.get_varnode_compare_records() ])
+    assert levels == { "a": VarnodeCompareLevel.MATCH, "r": VarnodeCompareLevel.NO_MATCH }
+    # the shared stack comparison is only counted once
+    (stack_record,) = stack_cmps[0].get_varnode_compare_records()
+    assert len(cmp.get_varnode_compare_record(stack_record.get_varnode()).get_comparisons()) == 1
+    assert check_against_brute_force(cmp) == 0
+
+def test_get_context_comparison_at_pc():
+    left = make_function([
+        ("a", INT, [ (StackAddress(-0x10), 0x10, 0x20), (StackAddress(-0x18), 0x30, 0x38) ])
+    ])
+    right = make_function([ ("b", INT, [ (StackAddress(-0x10), 0x18, 0x20) ]) ])
+    cmp = OptimizedFunctionCompare2(left, right)
+    # the gap [0x20, 0x30) where nothing is live is skipped
+    assert pc_ranges(cmp) == [ (0x10, 0x18), (0x18, 0x20), (0x30, 0x38) ]
+
+    context_cmps = cmp.get_context_comparisons()
+    at = lambda offset: cmp.get_context_comparison_at_pc(AbsoluteAddress(offset))
+    assert at(0x10) is context_cmps[0]
+    assert at(0x17) is context_cmps[0]
+    assert at(0x18) is context_cmps[1]
+    assert at(0x1f) is context_cmps[1]
+    assert at(0x34) is context_cmps[2]
+    for offset in (0, 0xf, 0x20, 0x2f, 0x38, 0x100):
+        assert at(offset) is None
+
+    assert record_levels(context_cmps[0]) == { "a": VarnodeCompareLevel.NO_MATCH }
+    assert record_levels(context_cmps[1]) == { "a": VarnodeCompareLevel.MATCH }
+
+if __name__ == "__main__":
+    test_sweep_matches_brute_force()
+    test_overlapping_locals()
+    test_interval_reuse()
+    test_get_context_comparison_at_pc()
@@ -0,0 +1,166 @@
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from resolve import *
+from resolve_stubs import *
+
+# Tests of the interning of addresses & datatypes, and of the memoized hashes & digests
+# of the resolved ProgramInfo, Function and Variable objects.
+# Run with pytest, or as a script.
+
+def roundtrip(value):
+    return pickle.loads(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+def test_intern_addresses():
+    for (cls, args) in [
+        (AbsoluteAddress, (0x1000,)),
+        (StackAddress, (-0x10,)),
+        (RegisterAddress, (3,)),
+        (RegisterAddress, (3, 2)),
+        (RegisterOffsetAddress, (6, -8)),
+        (ExternalAddress, ()),
+        (UnknownAddress, ())
+    ]:
+        addr = cls.intern(*args)
+        assert cls.intern(*args) is addr
+        assert roundtrip(addr) is addr
+        # addresses built directly are interned when unpickled
+        assert roundtrip(cls(*args)) is addr
+    assert StackAddress.intern(-0x10) is not StackAddress.intern(-0x8)
+    assert RegisterAddress.intern(3, 2) is not RegisterAddress.intern(3)
+    assert StackAddress.intern(-0x10).add_const(8) is StackAddress.intern(-0x8)
+
+def test_intern_datatypes():
+    i32 = DataTypeInt.intern(4)
+    for (dtype, same) in [
+        (i32, lambda: DataTypeInt.intern(4, signed=True)),
+        (DataTypeInt.intern(4, signed=False), lambda: DataTypeInt.intern(4, signed=False)),
+        (DataTypeFloat.intern(8), lambda: DataTypeFloat.intern(8)),
+        (DataTypeUndefined.intern(2), lambda: DataTypeUndefined.intern(2)),
+        (DataTypeVoid.intern(), lambda: DataTypeVoid.intern()),
+        (DataTypePointer.intern(i32, 8), lambda: DataTypePointer.intern(DataTypeInt.intern(4), 8))
+    ]:
+        assert DataType.is_interned(dtype)
+        assert same() is dtype
+        assert roundtrip(dtype) is dtype
+    assert DataTypeInt.intern(4) is not DataTypeInt.intern(4, signed=False)
+    assert DataTypePointer.intern(i32, 8) is not DataTypePointer.intern(i32, 4)
+
+    # datatypes built directly aren't interned, nor are pointers to non-interned types
+    assert not DataType.is_interned(DataTypeInt(size=4))
+    assert roundtrip(DataTypeInt(size=4)) is not i32
+    assert DataTypePointer.intern(DataTypeStruct(name="s", membertype_offsets=[ (0, i32) ], size=4), 8) is None
+
+def test_pointer_stub_interned():
+    def resolve_pointers():
+        db = ResolverDatabase()
+        db.make_record("int", DataTypeIntStub(size=4))
+        db.make_record("int *", DataTypePointerStub(basetyperef="int", size=8))
+        db.make_record("s", DataTypeStructStub(name="s", membertyperef_offsets=[ (0, "int") ], size=4))
+        db.make_record("s *", DataTypePointerStub(basetyperef="s", size=8))
+        return (db.resolve("int *"), db.resolve("s *"))
+
+    (int_ptr, struct_ptr) = resolve_pointers()
+    (other_int_ptr, other_struct_ptr) = resolve_pointers()
+    # resolved pointers to interned types are the interned pointer
+    assert int_ptr is DataTypePointer.intern(DataTypeInt.intern(4), 8)
+    assert other_int_ptr is int_ptr
+    # pointers to other types aren't shared
+    assert struct_ptr is not other_struct_ptr
+    assert not DataType.is_interned(struct_ptr) and struct_ptr.basetype.name == "s"
+
+# a small program, resolved from stubs: a global self-referencing struct, and a function
+# with a parameter & a local that moves between the stack & a register
+def make_program():
+    db = ResolverDatabase()
+    db.make_record("int", DataTypeIntStub(size=4))
+    db.make_record("node", DataTypeStructStub(name="node", membertyperef_offsets=[ (0, "int"), (8, "node *") ], size=16))
+    db.make_record("node *", DataTypePointerStub(basetyperef="node", size=8))
+    db.make_record("head", VariableStub(name="head", dtyperef="node", liveranges=[ AddressLiveRange(AbsoluteAddress(0x4000), None, None) ]))
+    db.make_record("n", VariableStub(name="n", dtyperef="int", param=True, functionref="main",
+        liveranges=[ AddressLiveRange(RegisterAddress(0), AbsoluteAddress(0x1000), AbsoluteAddress(0x1010)) ]))
+    db.make_record("i", VariableStub(name="i", dtyperef="int", functionref="main", liveranges=[
+        AddressLiveRange(StackAddress(-0x14), AbsoluteAddress(0x1004), AbsoluteAddress(0x1020)),
+        AddressLiveRange(RegisterAddress(1), AbsoluteAddress(0x1020), AbsoluteAddress(0x1030))
+    ]))
+    db.make_record("main", FunctionStub(name="main", startaddr=AbsoluteAddress(0x1000), endaddr=AbsoluteAddress(0x1040),
+        rettyperef="int", paramrefs=[ "n" ], varrefs=[ "i" ]))
+    db.make_record("program", ProgramInfoStub(globalrefs=[ "head" ], functionrefs=[ "main" ]))
+    db.set_root_key("program")
+    return db.resolve_root()
+
+# the resolved objects of a program
+def program_objects(proginfo):
+    return [ proginfo ] + proginfo.get_globals() + sum([ [ fn ] + fn.get_params() + fn.get_vars() for fn in proginfo.get_functions() ], [])
+
+# drop the memoized digests, so that they're computed again
+def forget_digests(proginfo):
+    for obj in program_objects(proginfo):
+        obj.__dict__.pop(DIGEST_MEMO, None)
+    proginfo.fingerprint = None
+
+# the fingerprint of make_program(), or of a pickled program, computed in a new process
+def fingerprint_in_subprocess(path=None, hashseed="0"):
+    env = dict(os.environ, PYTHONHASHSEED=hashseed)
+    if path is None:
+        code = "from test_hashcons import *; print(make_program().compute_fingerprint())"
+    else:
+        code = "from test_hashcons import *; p = pickle.load(open({!r}, 'rb')); forget_digests(p); print(p.compute_fingerprint())".format(path)
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.check_output([ sys.executable, "-c", code ], cwd=src_dir, env=env).decode().strip()
+
+def test_resolved_objects_complete():
+    proginfo = make_program()
+    for obj in program_objects(proginfo):
+        assert INCOMPLETE not in obj.__dict__
+        assert hash(obj) == hash(obj)
+
+def test_hash_incomplete():
+    for obj in (Variable(), Function(), ProgramInfo()):
+        mark_incomplete(obj)
+        for compute in (hash, lambda obj: obj.digest()):
+            try:
+                compute(obj)
+                assert False, "incomplete object was hashed"
+            except AssertionError as e:
+                assert "before it was complete" in str(e)
+        assert HASH_MEMO not in obj.__dict__ and DIGEST_MEMO not in obj.__dict__
+
+def test_digest_pickle_roundtrip():
+    proginfo = make_program()
+    fingerprint = proginfo.compute_fingerprint()
+    assert fingerprint == make_program().compute_fingerprint()
+
+    loaded = pickle.loads(pickle.dumps(proginfo))
+    assert loaded.compute_fingerprint() == fingerprint
+    forget_digests(loaded)
+    assert loaded.compute_fingerprint() == fingerprint
+    # hashes aren't pickled, they're computed again
+    assert all([ HASH_MEMO not in obj.__dict__ for obj in program_objects(pickle.loads(pickle.dumps(proginfo))) ])
+
+def test_digest_across_processes():
+    proginfo = make_program()
+    fingerprint = proginfo.compute_fingerprint()
+    tmpdir = tempfile.mkdtemp(prefix="test_hashcons_")
+    try:
+        path = os.path.join(tmpdir, "program.pickle")
+        with open(path, "wb") as f:
+            pickle.dump(proginfo, f)
+        for hashseed in ("1", "2"):
+            assert fingerprint_in_subprocess(hashseed=hashseed) == fingerprint
+            assert fingerprint_in_subprocess(path, hashseed=hashseed) == fingerprint
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    test_intern_addresses()
+    test_intern_datatypes()
+    test_pointer_stub_interned()
+    test_resolved_objects_complete()
+    test_hash_incomplete()
+    test_digest_pickle_roundtrip()
+    test_digest_across_processes()
@@ -0,0 +1,132 @@
+import random
+
+from interval import IntervalTree
+from compare_scope import *
+from testutil import *
+
+# brute force: the values of the (non-empty) intervals that overlap [start, end)
+def brute_overlap(intervals, start, end):
+    return [ value for (s, e, value) in intervals if s < end and e > start and s < e and start < end ]
+
+def test_empty():
+    tree = IntervalTree()
+    assert len(tree) == 0
+    assert tree.overlap(0, 10) == []
+    assert tree.at(0) == []
+    assert tree.overlapping_pairs() == []
+
+def test_overlap():
+    tree = IntervalTree([ (10, 20, "b"), (0, 5, "a"), (15, 30, "c"), (40, 40, "empty") ])
+    assert list(tree) == [ (0, 5, "a"), (10, 20, "b"), (15, 30, "c"), (40, 40, "empty") ]
+
+    # intervals are half-open
+    assert tree.overlap(5, 10) == []
+    assert tree.overlap(4, 11) == [ "a", "b" ]
+    assert tree.overlap(0, 100) == [ "a", "b", "c" ]
+    assert tree.at(19) == [ "b", "c" ]
+    assert tree.at(20) == [ "c" ]
+    assert tree.at(30) == []
+
+    # empty intervals & queries overlap nothing
+    assert tree.at(40) == []
+    assert tree.overlap(12, 12) == []
+
+def test_overlapping_pairs():
+    tree = IntervalTree([ (0, 8, "a"), (2, 4, "b"), (3, 6, "c"), (8, 9, "d"), (5, 5, "empty") ])
+    assert sorted(tree.overlapping_pairs()) == [ ("a", "b"), ("a", "c"), ("b", "c") ]
+
+def test_random():
+    rng = random.Random(3)
+    for _ in range(0, 200):
+        intervals = [ (start, start + rng.randint(0, 10), i) for i, start in enumerate([ rng.randint(-30, 30) for _ in range(0, rng.randint(0, 40)) ]) ]
+        tree = IntervalTree(intervals)
+        starts = dict([ (value, start) for (start, end, value) in intervals ])
+
+        for _ in range(0, 20):
+            start = rng.randint(-40, 40)
+            end = start + rng.randint(0, 15)
+            found = tree.overlap(start, end)
+            assert sorted(found) == sorted(brute_overlap(intervals, start, end))
+            # ordered by start
+            assert [ starts[value] for value in found ] == sorted([ starts[value] for value in found ])
+
+        pairs = tree.overlapping_pairs()
+        expected = set([
+            frozenset((l[2], r[2])) for l in intervals for r in intervals
+            if l[2] != r[2] and max(l[0], r[0]) < min(l[1], r[1])
+        ])
+        assert len(pairs) == len(expected)
+        assert set([ frozenset(pair) for pair in pairs ]) == expected
+
+def test_snapshot_index():
+    i32 = DataTypeInt.intern(4)
+    i16 = DataTypeInt.intern(2)
+    a = make_stack_varnode(i32, -0x10)
+    b = make_stack_varnode(i32, -0xe)
+    c = make_stack_varnode(i16, -0x8)
+    snapshot = ConstPCVariableSetSnapshot([ c, a, b ])
+    region = a.get_addr().get_region()
+    space = snapshot.get_address_space(region)
+
+    # the index is only built when first asked for, and shared with the address space
+    assert space.index is None
+    index = snapshot.get_index(region)
+    assert index is space.get_index() and len(index) == 3
+
+    assert snapshot.find_at(StackAddress(-0xd)) == [ a, b ]
+    assert snapshot.find_at(StackAddress(-0xa)) == []
+    assert snapshot.find_overlapping(AddressRange(StackAddress(-0xc), size=6)) == [ b, c ]
+    assert snapshot._find_overlaps() == [ (a, b) ]
+
+# brute force: the (left, right) index pairs of the non-empty intervals that overlap
+def brute_overlap_pairs(left, right):
+    return sorted([
+        (l, r) for l, (ls, le) in enumerate(left) for r, (rs, re) in enumerate(right)
+        if ls < le and rs < re and max(ls, rs) < min(le, re)
+    ])
+
+# sorted intervals over a few offsets, so that endpoints often touch, sizes are often 0 & intervals overlap
+def make_random_intervals(rng):
+    return sorted([ (start, start + rng.choice((0, 0, 1, 2, 4, 8))) for start in [ rng.randint(0, 16) for _ in range(0, rng.randint(0, 12)) ] ])
+
+def to_arrays(intervals):
+    return (np.array([ s for (s, e) in intervals ], dtype=np.int64), np.array([ e for (s, e) in intervals ], dtype=np.int64))
+
+def test_interval_overlap_pairs():
+    # touching endpoints don't overlap, empty intervals overlap nothing
+    left_idxs, right_idxs = interval_overlap_pairs(*(to_arrays([ (0, 4), (4, 8), (6, 6) ]) + to_arrays([ (2, 4), (4, 4), (4, 6), (8, 9) ])))
+    assert list(zip(left_idxs.tolist(), right_idxs.tolist())) == [ (0, 0), (1, 2) ]
+
+    rng = random.Random(22)
+    for _ in range(0, 500):
+        left = make_random_intervals(rng)
+        right = make_random_intervals(rng)
+        left_idxs, right_idxs = interval_overlap_pairs(*(to_arrays(left) + to_arrays(right)))
+        assert sorted(zip(left_idxs.tolist(), right_idxs.tolist())) == brute_overlap_pairs(left, right)
+
+def test_comparison_index_pairs():
+    i8 = DataTypeInt.intern(1)
+    dtypes = [ make_array(i8, 0), i8, DataTypeInt.intern(2), DataTypeInt.intern(4), DataTypeInt.intern(8) ]
+    rng = random.Random(22)
+    for _ in range(0, 200):
+        (left, right) = [
+            ConstPCVariableSetSnapshot([ make_stack_varnode(rng.choice(dtypes), rng.randint(-16, 0)) for _ in range(0, rng.randint(0, 10)) ])
+            for _ in range(0, 2)
+        ]
+        region = StackAddress(0).get_region()
+        left_space = left.get_address_space(region)
+        right_space = right.get_address_space(region)
+        if left_space is None or right_space is None:
+            continue
+        intervals = lambda space: [ (varnode.get_addr().space_offset(), varnode.get_addr().space_offset() + varnode.get_size()) for varnode in space.get_varnodes() ]
+        left_idxs, right_idxs = left_space.get_comparison_index_pairs(right_space)
+        assert sorted(zip(left_idxs.tolist(), right_idxs.tolist())) == brute_overlap_pairs(intervals(left_space), intervals(right_space))
+
+if __name__ == "__main__":
+    test_empty()
+    test_overlap()
+    test_overlapping_pairs()
+    test_random()
+    test_snapshot_index()
+    test_interval_overlap_pairs()
+    test_comparison_index_pairs()
@@ -4,6 +4,7 @@ from lang_datatype import *
 from compare_optimized import *
 from util import *
 from build import *
+from testutil import *
 
 # test the descent of dtype0, looking for dtype1 equivalent
 def test_DataTypeRecursiveDescent(dtype0, dtype1, offset, exact_match=False):
@@ -247,9 +248,86 @@ def test_flatten():
             #     print(dtype.membertype_offsets)
             for (off, primitive) in dtype.flatten():
                 print("\t{} -> {}".format(off, primitive))
+            # the runs stand for exactly the flattened primitives
+            assert expand_runs(dtype.flatten_runs()) == list(dtype.flatten())
 
     for fn in proginfo.get_functions():
         print_flattened_vars(fn.get_params() + fn.get_vars())
 
+# [(offset, stride, count, primitive)] -> [(offset, primitive)]
+def expand_runs(runs):
+    return [ (off + i * stride, primitive) for (off, stride, count, primitive) in runs for i in range(0, count) ]
+
+def test_flatten_runs():
+    i32 = DataTypeInt.intern(4)
+    i16 = DataTypeInt.intern(2)
+    mystruct = DataTypeStruct(name="mystruct", membertype_offsets=[(0, i32), (4, make_array(i16, 3))], size=12)
+
+    # arrays of primitives are a single run, however deeply nested
+    assert i32.flatten_runs() == [ (0, 4, 1, i32) ]
+    assert make_array(i32, 10).flatten_runs() == [ (0, 4, 10, i32) ]
+    assert make_array(make_array(i32, 3), 4).flatten_runs() == [ (0, 4, 12, i32) ]
+    assert make_array(i32, 0).flatten_runs() == []
+
+    # arrays of structs repeat the runs of the struct for each element
+    runs = make_array(mystruct, 2).flatten_runs()
+    assert runs == [ (0, 4, 1, i32), (4, 2, 3, i16), (12, 4, 1, i32), (16, 2, 3, i16) ]
+    assert expand_runs(runs) == list(make_array(mystruct, 2).flatten())
+
+def test_strided_varnode():
+    i32 = DataTypeInt.intern(4)
+    (varnode,) = make_stack_varnode(make_array(i32, 5), 0x10).flatten_strided()
+    assert varnode.is_strided() and varnode.is_dense()
+    assert (varnode.get_count(), varnode.get_stride(), varnode.get_size()) == (5, 4, 20)
+
+    elements = varnode.expand()
+    assert [ str(element.get_addr()) for element in elements ] == [ str(StackAddress(0x10 + 4 * i)) for i in range(0, 5) ]
+    assert all([ element.get_datatype() == i32 and element.get_size() == 4 for element in elements ])
+    assert str(varnode.get_element(3).get_addr()) == str(elements[3].get_addr())
+
+    # the elements overlapping bytes [start, end), relative to the varnode's address
+    assert varnode.get_element_range(0, 20) == (0, 5)
+    assert varnode.get_element_range(2, 9) == (0, 3)
+    assert varnode.get_element_range(4, 8) == (1, 2)
+    assert varnode.get_element_range(20, 24) == (5, 5)
+    assert varnode.get_element_range(-8, 0) == (0, 0)
+
+    # with gaps between the elements
+    gapped = StridedVarnode(i32, AddressLiveRange(addr=StackAddress(0), startpc=None, endpc=None), 8, 4)
+    assert not gapped.is_dense() and gapped.get_size() == 28
+    assert gapped.get_element_range(4, 8) == (1, 1)
+    assert gapped.get_element_range(6, 12) == (1, 2)
+
+def compare_level_counts(left, right):
+    (record,) = ConstPCVariableSetSnapshotCompare2(
+        ConstPCVariableSetSnapshot(left.flatten_strided()),
+        ConstPCVariableSetSnapshot(sum([ varnode.flatten_strided() for varnode in right ], []))
+    ).compare_primitives().get_varnode_compare_records()
+    return record.get_level_counts()
+
+def test_strided_level_counts():
+    i32 = DataTypeInt.intern(4)
+    u8 = DataTypeInt.intern(1, signed=False)
+    left = make_stack_varnode(make_array(i32, 8), 0)
+
+    # aligned runs: every element compares the same way
+    assert compare_level_counts(left, [ make_stack_varnode(make_array(i32, 8), 0) ]) == { VarnodeCompareLevel.MATCH: 8 }
+    assert compare_level_counts(left, [ make_stack_varnode(make_array(u8, 32), 0) ]) == { VarnodeCompareLevel.OVERLAP: 8 }
+    assert compare_level_counts(left, [ make_stack_varnode(make_array(i32, 2), 8) ]) == {
+        VarnodeCompareLevel.NO_MATCH: 6,
+        VarnodeCompareLevel.MATCH: 2
+    }
+
+    # misaligned runs: elements are compared one by one
+    assert compare_level_counts(left, [ make_stack_varnode(make_array(i32, 8), 2) ]) == { VarnodeCompareLevel.OVERLAP: 8 }
+    assert compare_level_counts(left, [ make_stack_varnode(make_array(i32, 2), 6), make_stack_varnode(i32, 28) ]) == {
+        VarnodeCompareLevel.NO_MATCH: 4,
+        VarnodeCompareLevel.OVERLAP: 3,
+        VarnodeCompareLevel.MATCH: 1
+    }
+
 if __name__ == "__main__":
+    test_flatten_runs()
+    test_strided_varnode()
+    test_strided_level_counts()
     test_flatten()
\ No newline at end of file
@@ -0,0 +1,114 @@
+import pickle
+import random
+
+from lang import *
+from lang_address import *
+from lang_datatype import *
+from lang_variable import *
+
+# Tests of the PC indexes of Variables & Functions, against linear scans of the live ranges.
+# Run with pytest, or as a script.
+
+INT = DataTypeInt.intern(4)
+
+# linear scan: the live ranges whose (half-open) PC range contains the offset, in order
+def linear_liveranges_at(liveranges, offset):
+    return [
+        liverange for liverange in liveranges
+        if liverange.startpc is not None and liverange.startpc.space_offset() <= offset < liverange.endpc.space_offset()
+    ]
+
+# random live ranges over a few PCs: nested, overlapping, touching & empty PC ranges, and some without any
+def make_random_liveranges(rng):
+    liveranges = []
+    for k in range(0, rng.randint(0, 8)):
+        if rng.random() < 0.1:
+            liveranges.append(AddressLiveRange(StackAddress(-8 * k), None, None))
+            continue
+        start = rng.randint(0, 20)
+        end = start + rng.choice((0, 1, 2, 5, 10, 20))
+        liveranges.append(AddressLiveRange(StackAddress(-8 * k), AbsoluteAddress(start), AbsoluteAddress(end)))
+    return liveranges
+
+# a Variable with the given live ranges, which may overlap (so they're assigned after construction)
+def make_variable(name, liveranges, function=None):
+    var = Variable(name, INT, [], function=function)
+    var.liveranges = liveranges
+    return var
+
+def test_liverange_at_pc():
+    rng = random.Random(24)
+    for _ in range(0, 300):
+        var = make_variable("v", make_random_liveranges(rng), function=object())
+        for offset in range(-2, 45):
+            expected = linear_liveranges_at(var.get_liveranges(), offset)
+            assert var.get_liverange_at_pc(AbsoluteAddress(offset)) is (expected[0] if expected else None)
+        # only absolute PCs are in the index
+        assert var.get_liverange_at_pc(StackAddress(5)) is None
+
+def test_liverange_at_pc_nested():
+    outer = AddressLiveRange(StackAddress(-8), AbsoluteAddress(0), AbsoluteAddress(0x20))
+    inner = AddressLiveRange(StackAddress(-0x10), AbsoluteAddress(0x8), AbsoluteAddress(0x10))
+    later = AddressLiveRange(StackAddress(-0x18), AbsoluteAddress(0x10), AbsoluteAddress(0x18))
+    # the first matching live range is returned, even when a later one starts after it
+    var = make_variable("v", [ inner, outer, later ], function=object())
+    at = lambda offset: var.get_liverange_at_pc(AbsoluteAddress(offset))
+    assert at(0) is outer
+    assert at(0x8) is inner
+    assert at(0xf) is inner
+    assert at(0x10) is outer
+    assert at(0x1f) is outer
+    assert at(0x20) is None
+
+def test_function_pc_index():
+    rng = random.Random(24)
+    for _ in range(0, 100):
+        function = Function(name="f", startaddr=AbsoluteAddress(0), endaddr=AbsoluteAddress(0x40), params=[], vars=[])
+        function.params = [ make_variable("p{}".format(k), make_random_liveranges(rng), function=function) for k in range(0, rng.randint(0, 2)) ]
+        function.vars = [ make_variable("v{}".format(k), make_random_liveranges(rng), function=function) for k in range(0, rng.randint(0, 5)) ]
+
+        for offset in range(-2, 45):
+            pc = AbsoluteAddress(offset)
+            expected = sorted([ (id(var), id(liverange)) for var in function.params + function.vars for liverange in linear_liveranges_at(var.get_liveranges(), offset) ])
+            assert sorted([ (id(var), id(liverange)) for (var, liverange) in function.get_live_at_pc(pc) ]) == expected
+            varnodes = function.get_varnodes_at_pc(pc)
+            assert sorted([ (id(varnode.get_var()), id(varnode.get_liverange())) for varnode in varnodes ]) == expected
+        assert function.get_live_at_pc(StackAddress(5)) == []
+
+def test_getstate_drops_pc_index():
+    function = Function(name="f", startaddr=AbsoluteAddress(0), endaddr=AbsoluteAddress(0x40), params=[], vars=[])
+    liverange = AddressLiveRange(StackAddress(-8), AbsoluteAddress(0), AbsoluteAddress(0x10))
+    var = Variable("v", INT, [ liverange ], function=function)
+    function.vars = [ var ]
+
+    assert function.get_live_at_pc(AbsoluteAddress(4)) == [ (var, liverange) ]
+    assert var.get_liverange_at_pc(AbsoluteAddress(4)) is liverange
+    assert PC_INDEX_MEMO in function.__dict__ and PC_INDEX_MEMO in var.__dict__
+    assert PC_INDEX_MEMO not in function.__getstate__()
+    assert PC_INDEX_MEMO not in var.__getstate__()
+
+    # the indexes are rebuilt after unpickling
+    function = pickle.loads(pickle.dumps(function))
+    (var,) = function.vars
+    assert PC_INDEX_MEMO not in function.__dict__ and PC_INDEX_MEMO not in var.__dict__
+    assert function.get_live_at_pc(AbsoluteAddress(4)) == [ (var, var.get_liveranges()[0]) ]
+    assert var.get_liverange_at_pc(AbsoluteAddress(0x10)) is None
+
+def test_liverange_bounds():
+    # invalid PC ranges are rejected when the live range is built, not when its PC range is first used
+    for (startpc, endpc) in ((AbsoluteAddress(0x10), AbsoluteAddress(0x8)), (AbsoluteAddress(0x10), StackAddress(0x20))):
+        rejected = False
+        try:
+            AddressLiveRange(StackAddress(-8), startpc, endpc)
+        except Exception: # (AssertionError for mismatched address types)
+            rejected = True
+        assert rejected
+    assert AddressLiveRange(StackAddress(-8), AbsoluteAddress(0x10), AbsoluteAddress(0x10)).get_pc_range().get_size() == 0
+    assert AddressLiveRange(AbsoluteAddress(0x4000), None, None).get_pc_range() is None
+
+if __name__ == "__main__":
+    test_liverange_at_pc()
+    test_liverange_at_pc_nested()
+    test_function_pc_index()
+    test_getstate_drops_pc_index()
+    test_liverange_bounds()
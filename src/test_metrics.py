@@ -0,0 +1,96 @@
+import random
+
+from metrics import *
+from testutil import *
+
+# The VarnodeTable-based counts must agree with the compare records they summarize.
+# Run with pytest, or as a script.
+
+DTYPES = [
+    DataTypeInt.intern(4),
+    DataTypeInt.intern(1, signed=False),
+    DataTypeFloat.intern(8),
+    DataTypeArray(basetype=DataTypeInt.intern(2), dimensions=(3,), size=6)
+]
+DTYPES.append(DataTypePointer.intern(DTYPES[0], 8))
+
+def make_variable(rng, name, addr, startpc, endpc, function=None, param=False):
+    liveranges = [ AddressLiveRange(addr, startpc, endpc) ]
+    # some variables move between locations
+    if rng.random() < 0.2:
+        liveranges = [
+            AddressLiveRange(addr, AbsoluteAddress(0), AbsoluteAddress(8)),
+            AddressLiveRange(RegisterAddress(rng.randint(0, 4)), AbsoluteAddress(8), AbsoluteAddress(0x10))
+        ]
+    return Variable(name, rng.choice(DTYPES), liveranges, param=param, function=function)
+
+# a random program, with functions sharing start PCs & globals with several locations
+def make_program(rng):
+    globals = [ make_variable(rng, "g{}".format(k), AbsoluteAddress(0x1000 + 0x10 * k), None, None) for k in range(0, rng.randint(0, 5)) ]
+    functions = []
+    for k in range(0, rng.randint(1, 6)):
+        start = 0x100 * rng.randint(0, 3)
+        function = Function(name="f{}".format(k), startaddr=AbsoluteAddress(start), endaddr=AbsoluteAddress(start + 0x100), rettype=DTYPES[0], params=[], vars=[])
+        pc = lambda: AbsoluteAddress(start + rng.randint(0, 0x80))
+        function.params = [ make_variable(rng, "p{}".format(i), StackAddress(8 * (i + 1)), None, None, function=function, param=True) for i in range(0, rng.randint(0, 2)) ]
+        function.vars = [ make_variable(rng, "v{}".format(i), StackAddress(-8 * (i + 1)), pc(), AbsoluteAddress(start + 0x100), function=function) for i in range(0, rng.randint(0, 5)) ]
+        functions.append(function)
+    return ProgramInfo(globals=globals, functions=functions)
+
+def check_counts(cmp):
+    for (left, varnodes) in ((True, varnodes_truth), (False, varnodes_decomp)):
+        assert count_base_varnodes(cmp, left=left) == len(varnodes(cmp))
+        assert count_base_varnodes(cmp, left=left, primitive=True) == count_varnodes(varnodes(cmp, primitive=True))
+    assert bytes_truth(cmp) == sum([ varnode.get_size() for varnode in varnodes_truth(cmp) ])
+    assert bytes_decomp(cmp) == sum([ varnode.get_size() for varnode in varnodes_decomp(cmp) ])
+
+    for metatype in (MetaType.INT, MetaType.FLOAT, MetaType.POINTER, MetaType.ARRAY):
+        assert count_base_varnodes(cmp, metatypes=(metatype,)) == len(varnodes_truth_metatype(cmp, metatype))
+        assert count_base_varnodes(cmp, primitive=True, metatypes=(metatype,)) == count_varnodes(varnodes_truth_metatype(cmp, metatype, primitive=True))
+
+def test_counts_match_compare_records():
+    rng = random.Random(21)
+    for _ in range(0, 50):
+        cmp = UnoptimizedProgramInfoCompare2(UnoptimizedProgramInfo(make_program(rng)), UnoptimizedProgramInfo(make_program(rng)))
+        check_counts(cmp)
+
+def test_duplicate_start_pcs():
+    i32 = DataTypeInt.intern(4)
+    functions = []
+    for name in ("a", "b"):
+        function = Function(name=name, startaddr=AbsoluteAddress(0), endaddr=AbsoluteAddress(0x10), rettype=i32, params=[], vars=[])
+        function.vars = [ Variable("x", i32, [ AddressLiveRange(StackAddress(-8), AbsoluteAddress(0), AbsoluteAddress(0x10)) ], function=function) ]
+        functions.append(function)
+    proginfo = ProgramInfo(globals=[], functions=functions)
+    cmp = UnoptimizedProgramInfoCompare2(UnoptimizedProgramInfo(proginfo), UnoptimizedProgramInfo(proginfo))
+    # only one of the functions starting at 0 is compared, and counted
+    assert count_base_varnodes(cmp) == len(varnodes_truth(cmp)) == 1
+    assert bytes_truth(cmp) == 4
+
+def test_toy_programs():
+    for name in TOY_PROGRAMS:
+        programs = load_toy_program(name)
+        if programs is not None:
+            check_counts(UnoptimizedProgramInfoCompare2(UnoptimizedProgramInfo(programs[0]), UnoptimizedProgramInfo(programs[1])))
+
+# {toy program -> (# varnodes, # primitive varnodes) matched at each VarnodeCompareLevel}, before the interval join
+TOY_LEVEL_COUNTS = {
+    "p0/p0_O0": ([ 2, 0, 0, 0, 5 ], [ 2, 0, 0, 0, 14 ]),
+    "typecases/typecases_O0": ([ 5, 3, 2, 1, 4 ], [ 5, 1, 0, 7, 119 ]),
+    "params/params_O0": ([ 1, 0, 0, 0, 0 ], [ 1, 0, 0, 0, 0 ])
+}
+
+def test_toy_compare_levels():
+    for name, (levels, primitive_levels) in TOY_LEVEL_COUNTS.items():
+        programs = load_toy_program(name)
+        if programs is None:
+            continue
+        cmp = UnoptimizedProgramInfoCompare2(UnoptimizedProgramInfo(programs[0]), UnoptimizedProgramInfo(programs[1]))
+        assert [ len(varnode_compare_records_matched_at_level(cmp, level)) for level in VarnodeCompareLevel.range() ] == levels, name
+        assert [ count_varnodes_matched_at_level(cmp, level, primitive=True) for level in VarnodeCompareLevel.range() ] == primitive_levels, name
+
+if __name__ == "__main__":
+    test_counts_match_compare_records()
+    test_duplicate_start_pcs()
+    test_toy_programs()
+    test_toy_compare_levels()
@@ -0,0 +1,341 @@
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import cachestats
+from sqlitecache import SQLiteConnect, _glob_pattern
+from rediscache import *
+from cache import import_deps
+
+# Tests of the caching layer, run against the embedded SQLite backend (no Redis server needed).
+# Run with pytest, or as a script.
+
+def make_tmpdir():
+    return tempfile.mkdtemp(prefix="test_simplecache_")
+
+def make_connection(tmpdir):
+    return SQLiteConnect(path=os.path.join(tmpdir, "cache.sqlite3")).connect()
+
+def make_cache(tmpdir, **kwargs):
+    kwargs.setdefault("expire", 0)
+    kwargs.setdefault("compression", "none")
+    return SimpleCache(backend="sqlite", path=os.path.join(tmpdir, "cache.sqlite3"), namespace="test", **kwargs)
+
+## the SQLite command subset
+
+def test_sqlite_strings():
+    tmpdir = make_tmpdir()
+    try:
+        conn = make_connection(tmpdir)
+        assert conn.get("missing") is None
+        conn.set("a", "1")
+        assert conn.get("a") == b"1"
+        assert conn.mget(["a", "missing"]) == [b"1", None]
+        assert conn.incrby("a", 4) == 5
+        assert conn.get("a") == b"5"
+
+        conn.setex("short", 1, "x")
+        assert 0 < conn.pttl("short") <= 1000
+        time.sleep(1.1)
+        assert conn.get("short") is None
+        assert conn.pttl("short") == -2
+
+        assert conn.pttl("a") == -1
+        assert conn.delete("a") == 1
+        assert conn.get("a") is None
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_sqlite_pttl_collections():
+    tmpdir = make_tmpdir()
+    try:
+        conn = make_connection(tmpdir)
+        conn.sadd("set", "m")
+        conn.zadd("zset", {"m": 1.0})
+        conn.hset("hash", "f", "v")
+        # collections exist & never expire
+        for name in ("set", "zset", "hash"):
+            assert conn.pttl(name) == -1, name
+        assert conn.pttl("missing") == -2
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_sqlite_keys_glob():
+    # redis escapes special characters with backslashes, SQLite's GLOB has no escapes
+    assert _glob_pattern("a\\*b*") == "a[*]b*"
+    assert _glob_pattern("a\\?\\[x]") == "a[?][[]x]"
+    assert _glob_pattern("a\\\\b") == "a\\b"
+
+    tmpdir = make_tmpdir()
+    try:
+        conn = make_connection(tmpdir)
+        conn.set("ns:a*b", "1")
+        conn.set("ns:axb", "2")
+        conn.sadd("ns:set", "m")
+        conn.zadd("ns:zset", {"m": 1.0})
+        conn.hset("ns:hash", "f", "v")
+        conn.set("other", "3")
+        assert sorted(conn.keys("ns:*")) == [b"ns:a*b", b"ns:axb", b"ns:hash", b"ns:set", b"ns:zset"]
+        assert conn.keys("ns:a\\*b") == [b"ns:a*b"]
+        assert sorted(conn.keys("ns:a?b")) == [b"ns:a*b", b"ns:axb"]
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_sqlite_sorted_sets():
+    tmpdir = make_tmpdir()
+    try:
+        conn = make_connection(tmpdir)
+        assert conn.zadd("z", {"a": 3, "b": 1, "c": 2}) == 3
+        assert conn.zrange("z", 0, -1) == [b"b", b"c", b"a"]
+        assert conn.zrange("z", 0, 0, withscores=True) == [(b"b", 1.0)]
+        # xx: only existing members are updated
+        assert conn.zadd("z", {"b": 5, "d": 0}, xx=True) == 0
+        assert conn.zscore("z", "d") is None
+        assert conn.zrange("z", 0, -1) == [b"c", b"a", b"b"]
+        assert conn.zrem("z", "a") == 1
+        assert conn.zcard("z") == 2
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_sqlite_pipeline():
+    tmpdir = make_tmpdir()
+    try:
+        conn = make_connection(tmpdir)
+        pipe = conn.pipeline()
+        pipe.set("a", "1")
+        pipe.sadd("s", "x", "y")
+        pipe.get("a")
+        assert pipe.execute() == [True, 2, b"1"]
+
+        # watching: commands run immediately until multi(), then are buffered until execute()
+        with conn.pipeline() as pipe:
+            pipe.watch("a")
+            assert pipe.get("a") == b"1"
+            pipe.multi()
+            pipe.set("a", "2")
+            pipe.scard("s")
+            assert pipe.execute() == [True, 2]
+        assert conn.get("a") == b"2"
+
+        # a transaction that isn't executed is rolled back
+        with conn.pipeline() as pipe:
+            pipe.watch("a")
+            pipe.multi()
+            pipe.set("a", "3")
+        assert conn.get("a") == b"2"
+    finally:
+        shutil.rmtree(tmpdir)
+
+## LRU & byte eviction
+
+def test_evict_lru_limit():
+    tmpdir = make_tmpdir()
+    try:
+        cache = make_cache(tmpdir, limit=3)
+        for key in ("a", "b", "c"):
+            cache.store(key, key * 10)
+            time.sleep(0.01)
+        # reading 'a' makes 'b' the least recently used
+        assert cache.get("a") == b"a" * 10
+        time.sleep(0.01)
+        cache.store("d", "d" * 10)
+        assert sorted(cache.keys()) == [b"a", b"c", b"d"]
+        assert cache.used_bytes() == 30
+
+        # replacing an entry doesn't evict anything
+        cache.store("c", "c" * 5)
+        assert sorted(cache.keys()) == [b"a", b"c", b"d"]
+        assert cache.used_bytes() == 25
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_evict_byte_budget():
+    tmpdir = make_tmpdir()
+    try:
+        cache = make_cache(tmpdir, max_bytes=100)
+        for key in ("a", "b", "c"):
+            cache.store(key, b"x" * 40)
+            time.sleep(0.01)
+        # 'a' was evicted to stay within 100 bytes
+        assert sorted(cache.keys()) == [b"b", b"c"]
+        assert cache.used_bytes() == 80
+        try:
+            cache.get("a")
+            assert False, "evicted entry was found"
+        except CacheMissException:
+            pass
+
+        # a read doesn't leave bookkeeping behind for keys that were never stored
+        assert cache.connection.zscore(cache.get_lru_name(), "a") is None
+
+        cache.invalidate("b")
+        assert cache.used_bytes() == 40
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_default_byte_budget():
+    tmpdir = make_tmpdir()
+    try:
+        assert make_cache(tmpdir).max_bytes == DEFAULT_MAX_BYTES
+        assert make_cache(tmpdir, max_bytes=0).max_bytes is None
+    finally:
+        shutil.rmtree(tmpdir)
+
+## codec framing & chunking
+
+def test_codec_roundtrip():
+    data = b"some repetitive payload " * 200
+    for name in ("none", "zlib", "zstd", "lz4"):
+        codec = Codec._names[name]
+        if not Codec.available(codec):
+            continue
+        encoded = Codec.encode(codec, data)
+        assert encoded.startswith(Codec.FRAME_MAGIC)
+        assert encoded[len(Codec.FRAME_MAGIC)] == codec
+        assert Codec.decode(encoded) == data
+
+    # small values aren't compressed, unframed (legacy) values are read as-is
+    assert Codec.encode(Codec.ZLIB, b"tiny")[len(Codec.FRAME_MAGIC)] == Codec.NONE
+    assert Codec.decode(b"plain pickle") == b"plain pickle"
+
+def test_chunked_roundtrip():
+    tmpdir = make_tmpdir()
+    try:
+        cache = make_cache(tmpdir, chunk_size=10)
+        data = bytes(range(256)) * 2
+        cache.store_bytes("big", data)
+        cache.store_bytes("small", b"0123")
+        assert cache.get_bytes("big") == data
+        assert cache.used_bytes() == len(data) + 4
+        assert cache.mget_bytes(["big", "small", "missing"]) == {"big": data, "small": b"0123"}
+
+        # storing a smaller value removes the left over chunks
+        cache.store_bytes("big", data[:25])
+        assert cache.get_bytes("big") == data[:25]
+        assert cache.connection.get(cache.make_chunk_key("big", 3)) is None
+
+        # a missing chunk invalidates the whole value
+        cache.connection.delete(cache.make_chunk_key("big", 1))
+        try:
+            cache.get_bytes("big")
+            assert False, "value with a missing chunk was found"
+        except CacheMissException:
+            pass
+        assert "big" not in cache
+
+        value = {"nested": [1, 2, 3], "text": "x" * 5000}
+        cache.store_pickle("obj", value)
+        assert cache.get_pickle("obj") == value
+    finally:
+        shutil.rmtree(tmpdir)
+
+## LocalCache
+
+def test_local_cache_bounds():
+    local = LocalCache(max_entries=2, max_bytes=None)
+    local.put("a", 1, size=1)
+    local.put("b", 2, size=1)
+    assert local.get("a") == (True, 1, None)
+    local.put("c", 3, size=1)
+    # 'b' was the least recently used
+    assert "b" not in local and "a" in local and "c" in local
+
+    local = LocalCache(max_entries=None, max_bytes=100)
+    local.put("a", "a", size=60)
+    local.put("b", "b", size=60)
+    assert "a" not in local and local.used_bytes == 60
+    # larger than the whole budget -> not kept
+    local.put("c", "c", size=200)
+    assert "c" not in local
+
+def test_local_cache_unknown_size():
+    local = LocalCache(max_entries=None, max_bytes=3000)
+    for i in range(10):
+        local.put(i, b"x" * 1000)
+    # sizes are estimated when not given, so the byte bound holds
+    assert 0 < local.used_bytes <= 3000
+    assert len(local) == 2
+
+    local.resize(9, 100)
+    local.resize("missing", 100)
+    assert local.used_bytes == LocalCache.estimate_size(b"x" * 1000) + 100
+
+class Unpicklable:
+    def __reduce__(self):
+        raise AssertionError("pickled on the caller's thread")
+
+def test_local_cache_estimate_doesnt_serialize():
+    # the estimate only looks at the value & the items it directly holds
+    value = [Unpicklable(), {"a": Unpicklable()}]
+    local = LocalCache()
+    local.put("k", value)
+    assert local.used_bytes == LocalCache.estimate_size(value) > 0
+
+## WriteBehind
+
+def test_write_behind():
+    stats = cachestats.get_stats("test_simplecache", "test_write_behind")
+    stats.reset()
+    stored = []
+
+    def fail():
+        raise OSError("store failed")
+
+    writer = WriteBehind(max_pending=2)
+    for i in range(5):
+        writer.submit(stored.append, i, stats=stats)
+    writer.submit(fail, stats=stats)
+    writer.flush()
+    assert stored == [0, 1, 2, 3, 4]
+    assert writer.pending() == 0
+    assert stats.get("errors") == 1
+
+def test_cache_it_write_behind():
+    tmpdir = make_tmpdir()
+    try:
+        cache = make_cache(tmpdir)
+        local = LocalCache()
+        writer = WriteBehind()
+        calls = []
+
+        @cache_it(cache=cache, local_cache=local, write_behind=writer, namespace="wb")
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        assert square(3) == 9
+        writer.flush()
+        # the estimated size was replaced by the stored payload's
+        assert local.used_bytes == len(cache.encode_pickle(9))
+        local.clear()
+        # served from the (SQLite) cache once stored
+        assert square(3) == 9
+        assert calls == [3]
+        assert square.stats.get("hits") == 1
+    finally:
+        shutil.rmtree(tmpdir)
+
+## import_deps
+
+def test_import_deps():
+    tmpdir = make_tmpdir()
+    try:
+        src = Path(tmpdir)
+        src.joinpath("a.py").write_text("import b\nfrom c import *\nimport os\n")
+        src.joinpath("b.py").write_text("def f():\n    import c\n")
+        src.joinpath("c.py").write_text("import a\n")
+        src.joinpath("d.py").write_text("")
+        # transitive & cyclic imports within src_dir, modules outside it are ignored
+        assert import_deps("a", src_dir=src) == [src.joinpath(name) for name in ("a.py", "b.py", "c.py")]
+        assert import_deps("b", src_dir=src) == [src.joinpath(name) for name in ("a.py", "b.py", "c.py")]
+        assert import_deps("d", "missing", src_dir=src) == [src.joinpath("d.py")]
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    for name, test in sorted(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print("{} OK".format(name))
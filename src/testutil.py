@@ -0,0 +1,28 @@
+import os
+import pickle
+
+from lang_address import *
+from lang_datatype import *
+from lang_variable import *
+
+# Helpers shared by the test_*.py modules.
+
+def make_array(basetype, length):
+    return DataTypeArray(basetype=basetype, dimensions=(length,), size=basetype.get_size() * length)
+
+# a Varnode on the stack, live at every PC
+def make_stack_varnode(dtype, offset):
+    return Varnode(dtype, AddressLiveRange(addr=StackAddress(offset), startpc=None, endpc=None))
+
+TOY_PROGRAMS = [ "p0/p0_O0", "typecases/typecases_O0", "params/params_O0" ]
+
+# the (DWARF, Ghidra) ProgramInfos of a toy program, or None if it hasn't been parsed
+def load_toy_program(name, programs_dir="../programs/toy"):
+    path = os.path.join(programs_dir, name)
+    if not os.path.exists("{}.ghidra.pickle".format(path)):
+        return None
+    with open("{}_debug.dwarf.pickle".format(path), "rb") as f:
+        dwarf = pickle.load(f)
+    with open("{}.ghidra.pickle".format(path), "rb") as f:
+        ghidra = pickle.load(f)
+    return (dwarf, ghidra)
@@ -142,15 +142,20 @@ class OrderedZipper(object):
         return self.curright == None
 
     def __next__(self):
-        if self._exhausted_left():
-            self.curright = next(self.right)
+        if self._exhausted_left() and self._exhausted_right():
+            raise StopIteration
+
+        elif self._exhausted_left():
+            ret = OrderedZipper.Right(self.curright, self.right_idx)
+            self.curright = try_next(self.right)
             self.right_idx += 1
-            return OrderedZipper.Right(self.curright, self.right_idx)
+            return ret
 
         elif self._exhausted_right():
-            self.curleft = next(self.left)
+            ret = OrderedZipper.Left(self.curleft, self.left_idx)
+            self.curleft = try_next(self.left)
             self.left_idx += 1
-            return OrderedZipper.Left(self.curleft, self.left_idx)
+            return ret
 
         elif self.key(self.curleft) == self.key(self.curright):
             ret = OrderedZipper.Conflict(self.curleft, self.left_idx, self.curright, self.right_idx)
@@ -0,0 +1,171 @@
+from typing import Dict, Iterator, List, Union
+import numpy as np
+
+from lang import *
+from lang_address import *
+from lang_datatype import *
+from lang_variable import *
+from compare_unoptimized import UnoptimizedProgramInfo
+from cache import cache
+
+# A columnar view of the Varnodes of a ProgramInfo, as selected for comparison by
+# UnoptimizedProgramInfo: single-location globals & one function per start PC.
+# Each row is a Varnode: the (high-level) Varnodes of every variable, followed by
+# their primitive Varnodes (StridedVarnodes for runs of array elements).
+# Selections are boolean masks over the rows, so counting, byte sums and metatype
+# breakdowns are array operations rather than loops over Varnode objects.
+class VarnodeTable(object):
+    # values of the 'kind' column
+    KIND_GLOBAL = 0
+    KIND_PARAM = 1
+    KIND_LOCAL = 2
+
+    # the columns, each a NumPy array with one entry per row
+    COLUMNS = [ "region", "addrtype", "start", "size", "count", "metatype", "function", "kind", "primitive", "single_loc" ]
+
+    def __init__(self, unoptimized_proginfo: UnoptimizedProgramInfo):
+        self.unoptimized_proginfo = unoptimized_proginfo
+        self.proginfo = unoptimized_proginfo.get_proginfo()
+
+        # the Varnode of each row
+        self.varnodes: List[Varnode] = []
+        # the distinct AddressRegions, indexed by the 'region' column
+        self.regions: List[AddressRegion] = []
+
+        region_ids: Dict[AddressRegion, int] = {}
+        columns: Dict[str, List[int]] = dict([ (name, []) for name in VarnodeTable.COLUMNS ])
+
+        def add_rows(varnodes: List[Varnode], primitive: bool, function_idx: int, kind: int, single_loc: bool):
+            for varnode in varnodes:
+                addr = varnode.get_addr()
+                region = addr.get_region()
+                region_id = region_ids.get(region)
+                if region_id is None:
+                    region_id = region_ids[region] = len(self.regions)
+                    self.regions.append(region)
+                dtype = varnode.get_datatype()
+                metatype = dtype.get_metatype() if dtype is not None else None
+                size = varnode.get_size() if dtype is not None else None
+
+                self.varnodes.append(varnode)
+                columns["region"].append(region_id)
+                columns["addrtype"].append(addr.get_addrtype())
+                columns["start"].append(addr.space_offset() if addr.rangeable() else 0)
+                columns["size"].append(size if size is not None else 0)
+                columns["count"].append(varnode.get_count())
+                columns["metatype"].append(metatype if metatype is not None else -1)
+                columns["function"].append(function_idx)
+                columns["kind"].append(kind)
+                columns["primitive"].append(primitive)
+                columns["single_loc"].append(single_loc)
+
+        def add_variable(var: Variable, function_idx: int, kind: int):
+            varnodes = var.get_varnodes()
+            add_rows(varnodes, False, function_idx, kind, var.is_single_loc())
+            add_rows(sum([ varnode.flatten_strided() for varnode in varnodes ], []), True, function_idx, kind, var.is_single_loc())
+
+        # the same globals & functions the compare records are made from
+        for varnode in unoptimized_proginfo.get_unoptimized_globals():
+            add_variable(varnode.get_var(), -1, VarnodeTable.KIND_GLOBAL)
+        for function_idx, unoptimized_fn in enumerate(unoptimized_proginfo.get_unoptimized_functions().values()):
+            function = unoptimized_fn.get_function()
+            for var in function.get_params():
+                add_variable(var, function_idx, VarnodeTable.KIND_PARAM)
+            for var in function.get_vars():
+                add_variable(var, function_idx, VarnodeTable.KIND_LOCAL)
+
+        self.region = np.array(columns["region"], dtype=np.int32)
+        self.addrtype = np.array(columns["addrtype"], dtype=np.int8)
+        self.start = np.array(columns["start"], dtype=np.int64)
+        self.size = np.array(columns["size"], dtype=np.int64)
+        self.count = np.array(columns["count"], dtype=np.int64)
+        self.metatype = np.array(columns["metatype"], dtype=np.int16)
+        self.function = np.array(columns["function"], dtype=np.int32)
+        self.kind = np.array(columns["kind"], dtype=np.int8)
+        self.primitive = np.array(columns["primitive"], dtype=bool)
+        self.single_loc = np.array(columns["single_loc"], dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.varnodes)
+
+    def get_proginfo(self) -> ProgramInfo:
+        return self.proginfo
+
+    def get_unoptimized_proginfo(self) -> UnoptimizedProgramInfo:
+        return self.unoptimized_proginfo
+
+    def get_regions(self) -> List[AddressRegion]:
+        return self.regions
+
+    # the (exclusive) end offset of each row
+    def end(self) -> np.ndarray:
+        return self.start + self.size
+
+    # a mask of the rows matching all of the given conditions (None = don't care)
+    def select(self,
+        primitive: Union[bool, None] = False,
+        kinds: Union[Iterator[int], None] = None,
+        addrtypes: Union[Iterator[int], None] = None,
+        metatypes: Union[Iterator[int], None] = None,
+        functions: Union[Iterator[int], None] = None,
+        single_loc: Union[bool, None] = None
+    ) -> np.ndarray:
+        mask = np.ones(len(self), dtype=bool)
+        if primitive is not None:
+            mask &= self.primitive == primitive
+        if kinds is not None:
+            mask &= np.isin(self.kind, list(kinds))
+        if addrtypes is not None:
+            mask &= np.isin(self.addrtype, list(addrtypes))
+        if metatypes is not None:
+            mask &= np.isin(self.metatype, list(metatypes))
+        if functions is not None:
+            mask &= np.isin(self.function, list(functions))
+        if single_loc is not None:
+            mask &= self.single_loc == single_loc
+        return mask
+
+    # the rows of varnodes that are compared when computing metrics:
+    # stack or global varnodes of single-location, non-parameter variables
+    def select_base(self, primitive: bool = False) -> np.ndarray:
+        return self.select(
+            primitive=primitive,
+            kinds=(VarnodeTable.KIND_GLOBAL, VarnodeTable.KIND_LOCAL),
+            addrtypes=(AddressType.ABSOLUTE, AddressType.STACK),
+            single_loc=True
+        )
+
+    # the Varnodes of the selected rows
+    def get_varnodes(self, mask: np.ndarray) -> List[Varnode]:
+        return [ self.varnodes[i] for i in np.flatnonzero(mask) ]
+
+    # the number of selected varnodes (a StridedVarnode counts once per element)
+    def count_varnodes(self, mask: np.ndarray) -> int:
+        return int(self.count[mask].sum())
+
+    # the number of bytes occupied by the selected varnodes
+    def count_bytes(self, mask: np.ndarray) -> int:
+        return int(self.size[mask].sum())
+
+    # {metatype -> number of selected varnodes}
+    def metatype_counts(self, mask: np.ndarray) -> 'Dict[int, int]':
+        return self._breakdown(self.metatype, self.count, mask)
+
+    # {metatype -> number of bytes of the selected varnodes}
+    def metatype_bytes(self, mask: np.ndarray) -> 'Dict[int, int]':
+        return self._breakdown(self.metatype, self.size, mask)
+
+    # {AddressRegion -> number of bytes of the selected varnodes}
+    def region_bytes(self, mask: np.ndarray) -> 'Dict[AddressRegion, int]':
+        return dict([ (self.regions[region_id], num) for region_id, num in self._breakdown(self.region, self.size, mask).items() ])
+
+    @staticmethod
+    def _breakdown(keys: np.ndarray, weights: np.ndarray, mask: np.ndarray) -> 'Dict[int, int]':
+        uniq, inverse = np.unique(keys[mask], return_inverse=True)
+        sums = np.bincount(inverse, weights=weights[mask], minlength=len(uniq))
+        return dict([ (int(key), int(num)) for key, num in zip(uniq, sums) ])
+
+# the VarnodeTable of an UnoptimizedProgramInfo, built once per program
+@cache
+def get_varnode_table(unoptimized_proginfo: UnoptimizedProgramInfo) -> VarnodeTable:
+    return VarnodeTable(unoptimized_proginfo)